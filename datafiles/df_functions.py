@@ -1,8 +1,12 @@
 """ functions file for the datafiles app"""
 from django.core.exceptions import ValidationError
 from workflow.log_functions import *
+from workflow.settings import deltasnap
+from datafiles.patch_functions import makepatch, applypatch, cacheversion
+from datafiles.validation import validate, parsefile
+import base64
+import hashlib
 import json
-import re
 
 
 # Variant that only adds the lookup info so errors can be stored.
@@ -60,6 +64,87 @@ def adddatafile(dfile, uploading_user=None):
         return False
 
 
+def jsonhash(jfile):
+    """
+    hash of the content of a JSON-LD file (keys sorted, generatedAt removed)
+    so that versions that only differ in when they were made have the same hash
+    :param jfile: JSON-LD file (dictionary or JSON string)
+    :return: base32 encoded sha256 hash (52 characters, as JsonFiles.jhash)
+    """
+    if isinstance(jfile, str):
+        jfile = json.loads(jfile)
+    content = {k: v for k, v in jfile.items() if k != 'generatedAt'}
+    canon = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    digest = hashlib.sha256(canon.encode('utf-8')).digest()
+    return base64.b32encode(digest).decode('ascii').rstrip('=')
+
+
+def latesthash(model, lookup):
+    """
+    get the id and jhash of the latest version of a file. The hash of files
+    saved before hashes were added is calculated (once) and saved
+    :param model: JsonFiles (filtered by json_lookup_id)
+    :param lookup: id of the json_lookup row
+    :return: tuple of (file id, jhash) or None if there are no versions
+    """
+    latest = model.objects.filter(json_lookup_id=lookup).order_by('-version', '-id').values_list('id', 'jhash').first()
+    if latest is None or latest[1]:
+        return latest
+    jhash = jsonhash(model.objects.only('file', 'codec', 'zfile').get(id=latest[0]).content)
+    model.objects.filter(id=latest[0]).update(jhash=jhash)
+    return latest[0], jhash
+
+
+def saveblobs(texts, hashes=None):
+    """
+    save facet file texts in the facet_blobs table (once per content hash -
+    see jsonhash - so versions that only differ in generatedAt share a blob)
+    :param texts: list of JSON-LD strings
+    :param hashes: jsonhash of each text (calculated if not given)
+    :return: list of (blob id, jhash) tuples in the order of the texts
+    """
+    if hashes is None:
+        hashes = [jsonhash(text) for text in texts]
+    found = dict(FacetBlobs.objects.filter(jhash__in=set(hashes)).values_list('jhash', 'id'))
+    new = {}
+    for jhash, text in zip(hashes, texts):
+        if jhash not in found and jhash not in new:
+            new[jhash] = FacetBlobs(jhash=jhash, size=len(text))
+            new[jhash].setcontent(text)
+    if new:
+        # another process may have saved the same blob in the meantime
+        FacetBlobs.objects.bulk_create(new.values(), batch_size=100, ignore_conflicts=True)
+        found.update(FacetBlobs.objects.filter(jhash__in=list(new)).values_list('jhash', 'id'))
+    return [(found[jhash], jhash) for jhash in hashes]
+
+
+def setdelta(f, dfile, dstr, baseid, version):
+    """
+    save a version of a data file as a JSON Patch of the previous version. A
+    full copy is kept every deltasnap versions, when the patch is more than
+    half the size of the file and when the patched text is not the same as the
+    file (e.g. keys added in the middle of an object come last after a patch)
+    :param f: JsonFiles object (with the full text set)
+    :param dfile: data jsonld file (dictionary)
+    :param dstr: data jsonld file (JSON text)
+    :param baseid: id of the previous version in json_files
+    :param version: version number of the file
+    :return: boolean (True if saved as a patch)
+    """
+    if (version - 1) % deltasnap == 0:
+        return False
+    base = json.loads(JsonFiles.objects.only('id', 'base', 'file', 'codec', 'zfile').get(id=baseid).content)
+    ops = makepatch(base, dfile)
+    patch = json.dumps(ops, separators=(',', ':'))
+    if len(patch) * 2 > len(dstr):
+        return False
+    if json.dumps(applypatch(base, ops), separators=(',', ':')) != dstr:
+        return False
+    f.setcontent(patch)
+    f.base_id = baseid
+    return True
+
+
 def updatedatafile(dfile=None, form='raw'):
     """
     Add a data jsonld file to the database
@@ -80,17 +165,15 @@ def updatedatafile(dfile=None, form='raw'):
         actlog("DF_A01: Found file in json_lookup (id: " + str(m.id) + ")")
 
     # get latest version of file (if it exists) and check that is different
+    # (compares the hashes of the files - see jsonhash)
     dstr = json.dumps(dfile, separators=(',', ':'))
-    f = JsonFiles.objects.filter(json_lookup=m.id)
-    if f:  # if there is a version in json_files then check against current
+    jhash = jsonhash(dfile)
+    latest = latesthash(JsonFiles, m.id)
+    if latest:  # if there is a version in json_files then check against current
         actlog("DF_A04: Found data file in json_files")
-        latest = f.latest('updated')
-        genatrpl = '"generatedAt": ""'
-        tmp1 = re.sub(r'"generatedAt":"[0-9:\s\-]*"', genatrpl, dstr)
-        tmp2 = re.sub(r'"generatedAt":"[0-9:\s\-]*"', genatrpl, latest.file)
-        if tmp1 == tmp2:  # checking files are same except for creation date
+        if latest[1] == jhash:  # checking files are same except for creation date
             actlog("DF_05: Datafile is the same as last version - not adding")
-            return {"mid": m.id, "fid": latest.id}
+            return {"mid": m.id, "fid": latest[0]}
 
     actlog("DF_A02: Data file is different than last version - adding " + str(m.currentversion + 1) + "...")
 
@@ -98,13 +181,17 @@ def updatedatafile(dfile=None, form='raw'):
     m.currentversion += 1
     m.save()
 
-    # save json file
+    # save json file (as a patch of the latest version - see setdelta)
     f = JsonFiles()
     f.json_lookup_id = m.id
-    f.file = dstr
+    f.setcontent(dstr)
+    if latest:
+        setdelta(f, dfile, dstr, latest[0], m.currentversion)
     f.type = form
     f.version = m.currentversion
+    f.jhash = jhash
     f.save()
+    cacheversion(f.id, dstr)
 
     # return
     if m.id and f.id:
@@ -189,24 +276,29 @@ def updatefacetfile(ffile=None):
         raise ValidationError("The facet file has not yet been added")
 
     # get latest version of file (if it exists) and check that is different
+    # (compares the hash of the file with that of the blob of the latest version)
     ffile = json.dumps(ffile, separators=(',', ':'))
-    j = FacetFiles.objects.filter(facet_lookup_id=m.id)
-    if j:  # if there is a version in facet_files then check against current
-        latest = j.latest('updated')
-        genatrpl = '"generatedAt": ""'
-        tmp1 = re.sub(r'"generatedAt":".*?"', genatrpl, ffile)
-        tmp2 = re.sub(r'"generatedAt":".*?"', genatrpl, latest.file)
-        if tmp1 == tmp2:  # checking files are same except for creation date
+    jhash = jsonhash(ffile)
+    latest = FacetFiles.objects.filter(facet_lookup_id=m.id).order_by('-version', '-id').\
+        values_list('id', 'blob__jhash').first()
+    if latest:  # if there is a version in facet_files then check against current
+        # versions saved before blobs were used are hashed from the file field
+        # (one that is not valid JSON is treated as different)
+        try:
+            lasthash = latest[1] or jsonhash(FacetFiles.objects.values_list('file', flat=True).get(id=latest[0]))
+        except ValueError:
+            lasthash = None
+        if lasthash == jhash:  # checking files are same except for creation date
             return True
 
     # update file version
     m.currentversion += 1
     m.save()
 
-    # save json file
+    # save json file (the text is saved in the blob)
     f = FacetFiles()
     f.facet_lookup_id = m.id
-    f.file = ffile
+    f.blob_id = saveblobs([ffile])[0][0]
     f.type = "raw"
     f.version = m.currentversion
     f.save()
@@ -243,45 +335,17 @@ def getflookup(facetid):
 # ----- Validation -----
 def json_validator(json_file):
     """
-    Validate a SciData JSON-LD file
+    Validate a SciData JSON-LD file (see validation.validate). The parsed
+    file is saved on the upload (json_file.scidata) so it is not parsed again
     :param json_file: jsonld file to be validated
     :return: boolean
     """
-    json_file_content = json.load(json_file)
-    keys_a = []
-    keys_b = []
-    isscidata = True
-    """
-    try:
-        jsonld.to_rdf(json_file_content, {"processingMode": "json-ld-1.0"})
-    except ValidationError:
-        isscidata = False
-    """
-    if not str(json_file).endswith('.jsonld'):
-        isscidata = False
-    if not get_graphuid(json_file):
-        isscidata = False
-    for k, v in json_file_content.items():
-        keys_a.append(k)
-        if k == '@graph':
-            for y, z in v.items():
-                keys_b.append(y)
-    for y in ['@context', '@id', 'generatedAt', '@graph']:
-        if y not in keys_a:
-            isscidata = False
-    for y in ['scidata', 'uid']:
-        if y not in keys_b:
-            isscidata = False
-    if not isscidata:
-        raise ValidationError("Not a valid SciData JSON-LD")
+    validate(json_file)
 
 
 def get_graphuid(json_file):
     """ get uid from json file"""
     try:
-        json_file.seek(0)
-        json_file_content = json.load(json_file)
-        guid = json_file_content['@graph']['uid']
-        return guid
-    except LookupError:
+        return parsefile(json_file)['@graph']['uid']
+    except (LookupError, TypeError, ValueError):
         return False
@@ -68,14 +68,20 @@ class JsonFacetsSerializer(serializers.ModelSerializer):
 
 
 class JsonFilesSerializer(serializers.ModelSerializer):
-    """serializer for the json_files table"""
+    """serializer for the json_files table (the text of the file, not how it is stored)"""
+    file = serializers.SerializerMethodField()
+    base = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         """meta settings"""
         model = JsonFiles
-        fields = '__all__'
+        exclude = ['codec', 'zfile']
         depth = 2
 
+    def get_file(self, obj):
+        """text of the file (decompressed or rebuilt from patches)"""
+        return obj.content
+
 
 class JsonLookupSerializer(serializers.ModelSerializer):
     """serializer for the json_lookups table"""
@@ -9,6 +9,8 @@ django.setup()
 from datafiles.views import *
 from workflow.gdb_functions import *
 from datafiles.models import *
+from datafiles.df_functions import jsonhash
+from datafiles.patch_functions import uncacheversions
 from crossref.restful import Works
 from workflow.jena_functions import *
 
@@ -58,9 +60,11 @@ if False:
             remvidstr = str(remvid).zfill(8)
             keepidstr = str(keepid).zfill(8)
 
-            # get the entries in the json_files table
-            files = JsonFiles.objects.filter(json_lookup_id__in=hits)
+            # get the entries in the json_files table (and their text before any are
+            # changed as versions saved as patches are rebuilt from earlier versions)
+            files = list(JsonFiles.objects.filter(json_lookup_id__in=hits))
             fcount = len(files)
+            texts = {file.id: file.content for file in files}
             for file in files:
                 if file.json_lookup_id == remvid:
                     # update the json_lookup_id
@@ -71,12 +75,17 @@ if False:
                     if file.type == 'normalized':
                         file.version = fcount
                 # update file for uid format
-                temp = file.file.replace('chembl:herg:', 'chembl_herg_')
+                temp = texts[file.id].replace('chembl:herg:', 'chembl_herg_')
                 # update DB id in graphname
                 temp2 = temp.replace('/' + remvidstr + '"', '/' + keepidstr + '"')
                 print(temp2)
-                file.file = temp2
+                # every version is saved as a full copy (a patch of the old text
+                # of an earlier version would no longer apply)
+                file.setcontent(temp2)
+                file.base = None
+                file.jhash = jsonhash(temp2)
                 file.save()
+            uncacheversions(texts.keys())
 
             # replace both versions in the graph with the new, latest one
             path = 'https://scidata.unf.edu/data/'
@@ -0,0 +1,40 @@
+""" compress the text of the data, aspect and facet files saved as plain text """
+from django.core.management.base import BaseCommand
+from datafiles.models import JsonFiles, AspectFiles, FacetBlobs
+from datafiles.zip_functions import codecready, compress
+from workflow.settings import filecodec
+
+tables = {'json_files': JsonFiles, 'aspect_files': AspectFiles, 'facet_blobs': FacetBlobs}
+
+
+class Command(BaseCommand):
+    help = 'Compress the files in json_files, aspect_files and facet_blobs that are saved as plain text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codec', default=filecodec, help='gzip or zstd')
+        parser.add_argument('--tables', default=','.join(tables), help='comma separated list of tables')
+        parser.add_argument('--chunk', type=int, default=100, help='files compressed at a time')
+
+    def handle(self, *args, **options):
+        codec = options['codec']
+        if not codecready(codec):
+            self.stderr.write("codec '" + str(codec) + "' is not available")
+            return
+        for table in options['tables'].split(','):
+            model = tables[table]
+            done, before, after, last = 0, 0, 0, 0
+            while True:
+                rows = list(model.objects.filter(codec__isnull=True, id__gt=last).exclude(file='').order_by('id')
+                            .values_list('id', 'file')[:options['chunk']])
+                if not rows:
+                    break
+                for fid, text in rows:
+                    zfile = compress(text, codec)
+                    # update (not save) so the updated dates of the files do not change
+                    model.objects.filter(id=fid).update(file='', codec=codec, zfile=zfile)
+                    before += len(text.encode('utf-8'))
+                    after += len(zfile)
+                done += len(rows)
+                last = rows[-1][0]
+            sizes = " (" + str(before // 1024) + " KB to " + str(after // 1024) + " KB)"
+            self.stdout.write(table + ": " + str(done) + " files compressed" + sizes)
@@ -0,0 +1,35 @@
+""" save the older versions of data files as patches of the previous version """
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from datafiles.df_functions import setdelta
+from datafiles.models import JsonFiles
+import json
+
+
+class Command(BaseCommand):
+    help = 'Replace the full copies of data file versions in json_files with patches of the previous version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', help='comma separated list of json_lookup ids (default all)')
+
+    def handle(self, *args, **options):
+        files = JsonFiles.objects.filter(base__isnull=True)
+        if options['lookups']:
+            files = files.filter(json_lookup_id__in=options['lookups'].split(','))
+        lookups = files.values_list('json_lookup_id', flat=True).distinct().order_by('json_lookup_id')
+        done = 0
+        for lookup in lookups:
+            versions = list(JsonFiles.objects.filter(json_lookup_id=lookup).order_by('version', 'id')
+                            .values_list('id', 'version', 'base_id'))
+            with transaction.atomic():
+                # each version (that is a full copy) becomes a patch of the one before it
+                for (previd, prevver, prevbase), (fid, version, base) in zip(versions, versions[1:]):
+                    if base is not None:
+                        continue
+                    f = JsonFiles.objects.get(id=fid)
+                    dstr = f.content
+                    if setdelta(f, json.loads(dstr), dstr, previd, version):
+                        JsonFiles.objects.filter(id=fid).update(file=f.file, codec=f.codec, zfile=f.zfile, base_id=previd)
+                        done += 1
+            self.stdout.write("json_lookup " + str(lookup) + ": " + str(len(versions)) + " versions")
+        self.stdout.write(str(done) + " versions saved as patches")
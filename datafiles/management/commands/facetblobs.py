@@ -0,0 +1,46 @@
+""" move the text of the facet files saved before blobs were used into facet_blobs """
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from datafiles.df_functions import jsonhash, saveblobs
+from datafiles.models import FacetBlobs, FacetFiles
+
+
+class Command(BaseCommand):
+    help = 'Save the text of facet_files rows in facet_blobs (once per content hash) and clear the file field'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=200, help='files moved per transaction')
+        parser.add_argument('--keep', action='store_true', help='keep the text in the file field of facet_files')
+        parser.add_argument('--prune', action='store_true', help='remove blobs no longer used by any facet file')
+
+    def handle(self, *args, **options):
+        done = 0
+        last = 0
+        while True:
+            rows = list(FacetFiles.objects.filter(blob__isnull=True, id__gt=last).order_by('id')
+                        .values_list('id', 'file')[:options['chunk']])
+            if not rows:
+                break
+            # rows that are not valid JSON are reported and left without a blob
+            good, hashes = [], []
+            for fid, text in rows:
+                try:
+                    hashes.append(jsonhash(text))
+                    good.append((fid, text))
+                except ValueError:
+                    self.stderr.write("facet file " + str(fid) + " is not valid JSON")
+            with transaction.atomic():
+                blobs = saveblobs([text for fid, text in good], hashes)
+                for (fid, text), (blobid, jhash) in zip(good, blobs):
+                    update = {'blob_id': blobid}
+                    if not options['keep']:
+                        update['file'] = ''
+                    FacetFiles.objects.filter(id=fid).update(**update)
+            done += len(good)
+            last = rows[-1][0]
+            self.stdout.write(str(done) + " facet files moved")
+        if options['prune']:
+            used = FacetFiles.objects.filter(blob__isnull=False).values('blob_id')
+            removed = FacetBlobs.objects.exclude(id__in=used).delete()[0]
+            self.stdout.write(str(removed) + " unused blobs removed")
+        self.stdout.write(str(done) + " facet files moved to " + str(FacetBlobs.objects.count()) + " blobs")
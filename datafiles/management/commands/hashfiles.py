@@ -0,0 +1,31 @@
+""" add the content hash (jhash) to the data files saved before hashes were used """
+from django.core.management.base import BaseCommand
+from datafiles.df_functions import jsonhash
+from datafiles.models import JsonFiles
+
+
+class Command(BaseCommand):
+    help = 'Calculate and save the jhash of the json_files rows that do not have one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=100, help='files loaded at a time')
+
+    def handle(self, *args, **options):
+        done = 0
+        last = 0
+        while True:
+            # files are loaded a chunk at a time (they can be large)
+            rows = list(JsonFiles.objects.filter(jhash__isnull=True, id__gt=last).order_by('id')
+                        .only('id', 'file', 'codec', 'zfile')[:options['chunk']])
+            if not rows:
+                break
+            for row in rows:
+                fid = row.id
+                try:
+                    JsonFiles.objects.filter(id=fid).update(jhash=jsonhash(row.content))
+                    done += 1
+                except ValueError:
+                    self.stderr.write("file " + str(fid) + " is not valid JSON")
+            last = rows[-1].id
+            self.stdout.write(str(done) + " files hashed")
+        self.stdout.write("finished (" + str(done) + " files hashed)")
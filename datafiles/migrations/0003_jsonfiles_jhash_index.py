@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+# index of the content hash of the data files (see df_functions.jsonhash).
+# The json_files table is not managed by django so the index is added here
+jhashindex = models.Index(fields=['jhash'], name='json_files_jhash')
+
+
+def hastable(schema_editor, model):
+    """ check if the table of an unmanaged model exists (it is not created on a new database) """
+    return model._meta.db_table in schema_editor.connection.introspection.table_names()
+
+
+def addindex(apps, schema_editor):
+    model = apps.get_model('datafiles', 'JsonFiles')
+    if hastable(schema_editor, model):
+        schema_editor.add_index(model, jhashindex)
+
+
+def removeindex(apps, schema_editor):
+    model = apps.get_model('datafiles', 'JsonFiles')
+    if hastable(schema_editor, model):
+        schema_editor.remove_index(model, jhashindex)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datafiles', '0002_jsonlookupsubstances'),
+    ]
+
+    operations = [
+        migrations.RunPython(addindex, removeindex),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def hastable(schema_editor, model):
+    """ check if the table of an unmanaged model exists (it is not created on a new database) """
+    return model._meta.db_table in schema_editor.connection.introspection.table_names()
+
+
+def addblob(apps, schema_editor):
+    """ add the blob_id column to the (unmanaged) facet_files table """
+    model = apps.get_model('datafiles', 'FacetFiles')
+    if hastable(schema_editor, model):
+        schema_editor.add_field(model, model._meta.get_field('blob'))
+
+
+def removeblob(apps, schema_editor):
+    model = apps.get_model('datafiles', 'FacetFiles')
+    if hastable(schema_editor, model):
+        schema_editor.remove_field(model, model._meta.get_field('blob'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datafiles', '0003_jsonfiles_jhash_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetBlobs',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jhash', models.CharField(max_length=52, unique=True)),
+                ('file', models.TextField()),
+                ('size', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'facet_blobs',
+            },
+        ),
+        # facet_files is not managed by django so adding the field only changes the migration state
+        migrations.AddField(
+            model_name='facetfiles',
+            name='blob',
+            field=models.ForeignKey(blank=True, db_column='blob_id', null=True,
+                                    on_delete=django.db.models.deletion.PROTECT, to='datafiles.facetblobs'),
+        ),
+        migrations.RunPython(addblob, removeblob),
+    ]
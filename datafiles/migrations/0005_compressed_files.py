@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+# columns of the compressed text of files (see models.CompressedText)
+# json_files and aspect_files are not managed by django so the columns are added here
+unmanaged = ['JsonFiles', 'AspectFiles']
+
+
+def hastable(schema_editor, model):
+    """ check if the table of an unmanaged model exists (it is not created on a new database) """
+    return model._meta.db_table in schema_editor.connection.introspection.table_names()
+
+
+def addcolumns(apps, schema_editor):
+    for name in unmanaged:
+        model = apps.get_model('datafiles', name)
+        if not hastable(schema_editor, model):
+            continue
+        schema_editor.add_field(model, model._meta.get_field('codec'))
+        schema_editor.add_field(model, model._meta.get_field('zfile'))
+
+
+def removecolumns(apps, schema_editor):
+    for name in unmanaged:
+        model = apps.get_model('datafiles', name)
+        if not hastable(schema_editor, model):
+            continue
+        schema_editor.remove_field(model, model._meta.get_field('zfile'))
+        schema_editor.remove_field(model, model._meta.get_field('codec'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datafiles', '0004_facetblobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facetblobs',
+            name='codec',
+            field=models.CharField(blank=True, max_length=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='facetblobs',
+            name='zfile',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        # only change the migration state (the columns are added by addcolumns)
+        migrations.AddField(
+            model_name='jsonfiles',
+            name='codec',
+            field=models.CharField(blank=True, max_length=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='jsonfiles',
+            name='zfile',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aspectfiles',
+            name='codec',
+            field=models.CharField(blank=True, max_length=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='aspectfiles',
+            name='zfile',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(addcolumns, removecolumns),
+    ]
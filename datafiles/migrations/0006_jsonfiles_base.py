@@ -0,0 +1,39 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def hastable(schema_editor, model):
+    """ check if the table of an unmanaged model exists (it is not created on a new database) """
+    return model._meta.db_table in schema_editor.connection.introspection.table_names()
+
+
+def addbase(apps, schema_editor):
+    """ add the base_id column to the (unmanaged) json_files table """
+    model = apps.get_model('datafiles', 'JsonFiles')
+    if hastable(schema_editor, model):
+        schema_editor.add_field(model, model._meta.get_field('base'))
+
+
+def removebase(apps, schema_editor):
+    model = apps.get_model('datafiles', 'JsonFiles')
+    if hastable(schema_editor, model):
+        schema_editor.remove_field(model, model._meta.get_field('base'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datafiles', '0005_compressed_files'),
+    ]
+
+    operations = [
+        # only changes the migration state (the column is added by addbase)
+        migrations.AddField(
+            model_name='jsonfiles',
+            name='base',
+            field=models.ForeignKey(blank=True, db_column='base_id', null=True,
+                                    on_delete=django.db.models.deletion.PROTECT, related_name='deltas',
+                                    to='datafiles.jsonfiles'),
+        ),
+        migrations.RunPython(addbase, removebase),
+    ]
@@ -2,6 +2,32 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from substances.models import Substances
+from datafiles.zip_functions import compress, decompress
+from datafiles.patch_functions import versiontext
+from workflow.settings import filecodec
+
+
+class CompressedText:
+    """ text of a file saved compressed (zfile, compressed with codec) or as plain text (file) """
+
+    @property
+    def stored(self):
+        """ text saved in the row """
+        if self.codec:
+            return decompress(self.codec, self.zfile)
+        return self.file
+
+    @property
+    def content(self):
+        """ text of the file """
+        return self.stored
+
+    def setcontent(self, text, codec=filecodec):
+        """ set the text of the file (compressed with codec unless codec is None) """
+        if codec:
+            self.file, self.codec, self.zfile = '', codec, compress(text, codec)
+        else:
+            self.file, self.codec, self.zfile = text, None, None
 
 
 class References(models.Model):
@@ -62,13 +88,17 @@ class JsonLookup(models.Model):
         db_table = 'json_lookup'
 
 
-class JsonFiles(models.Model):
+class JsonFiles(CompressedText, models.Model):
     """ model for the json_files DB table """
     json_lookup = models.ForeignKey(JsonLookup, on_delete=models.PROTECT)
     file = models.TextField(default='')
     type = models.CharField(max_length=32, default='')
     version = models.IntegerField(default='')
     jhash = models.CharField(max_length=52, blank=True, null=True)
+    codec = models.CharField(max_length=8, blank=True, null=True)
+    zfile = models.BinaryField(blank=True, null=True)
+    base = models.ForeignKey('self', null=True, blank=True, on_delete=models.PROTECT, db_column='base_id',
+                             related_name='deltas')
     comments = models.CharField(max_length=32, blank=True, null=True)
     updated = models.DateTimeField(auto_now=True)
 
@@ -76,6 +106,13 @@ class JsonFiles(models.Model):
         managed = False
         db_table = 'json_files'
 
+    @property
+    def content(self):
+        """ text of the file (rebuilt from the base file if saved as a patch) """
+        if self.base_id:
+            return versiontext(JsonFiles, self.id)
+        return self.stored
+
 
 class JsonErrors(models.Model):
     """ model for the json_errors DB table """
@@ -121,10 +158,24 @@ class FacetLookup(models.Model):
         db_table = 'facet_lookup'
 
 
+class FacetBlobs(CompressedText, models.Model):
+    """ model for the facet_blobs DB table (facet file text stored once per content hash) """
+    jhash = models.CharField(max_length=52, unique=True)
+    file = models.TextField()
+    codec = models.CharField(max_length=8, blank=True, null=True)
+    zfile = models.BinaryField(blank=True, null=True)
+    size = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'facet_blobs'
+
+
 class FacetFiles(models.Model):
     """ model for the facet_files DB table """
     facet_lookup = models.ForeignKey(FacetLookup, on_delete=models.PROTECT)
-    file = models.TextField()
+    file = models.TextField(default='')
+    blob = models.ForeignKey(FacetBlobs, null=True, blank=True, on_delete=models.PROTECT, db_column='blob_id')
     type = models.CharField(max_length=32)
     version = models.IntegerField()
     updated = models.DateTimeField()
@@ -133,6 +184,11 @@ class FacetFiles(models.Model):
         managed = False
         db_table = 'facet_files'
 
+    @property
+    def content(self):
+        """ text of the file (saved in facet_blobs or, for older versions, in the file field) """
+        return self.blob.content if self.blob_id else self.file
+
 
 class FacetActlog(models.Model):
     """ model for the facet_actlog DB table """
@@ -186,10 +242,12 @@ class AspectLookup(models.Model):
         db_table = 'aspect_lookup'
 
 
-class AspectFiles(models.Model):
+class AspectFiles(CompressedText, models.Model):
     """ model for the aspect_files DB table """
     aspect_lookup = models.ForeignKey(AspectLookup, on_delete=models.PROTECT)
     file = models.TextField()
+    codec = models.CharField(max_length=8, blank=True, null=True)
+    zfile = models.BinaryField(blank=True, null=True)
     type = models.CharField(max_length=32)
     version = models.IntegerField()
     updated = models.DateTimeField()
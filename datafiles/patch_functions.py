@@ -0,0 +1,128 @@
+""" versions of data files saved as JSON Patch (RFC 6902) differences from the previous version """
+from collections import OrderedDict
+from workflow.settings import deltacache
+import json
+import threading
+
+# text of recently rebuilt versions (file id -> text), least recently used first
+versioncache = OrderedDict()
+versionlock = threading.Lock()
+
+
+def pointer(path, key):
+    """ add a key to a JSON pointer (escaping ~ and /) """
+    return path + '/' + str(key).replace('~', '~0').replace('/', '~1')
+
+
+def makepatch(old, new, path=''):
+    """
+    list of JSON Patch operations that change one document into another. Lists
+    are compared item by item with items added or removed at the end
+    :param old: previous version (parsed JSON)
+    :param new: new version (parsed JSON)
+    :return: list of operations (add, remove, replace)
+    """
+    if type(old) is not type(new):
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    ops = []
+    if isinstance(old, dict):
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': pointer(path, key)})
+        for key, value in new.items():
+            if key in old:
+                ops.extend(makepatch(old[key], value, pointer(path, key)))
+            else:
+                ops.append({'op': 'add', 'path': pointer(path, key), 'value': value})
+    elif isinstance(old, list):
+        common = min(len(old), len(new))
+        for i in range(common):
+            ops.extend(makepatch(old[i], new[i], pointer(path, i)))
+        for value in new[common:]:
+            ops.append({'op': 'add', 'path': pointer(path, '-'), 'value': value})
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': pointer(path, i)})
+    elif old != new:
+        ops.append({'op': 'replace', 'path': path, 'value': new})
+    return ops
+
+
+def applypatch(doc, ops):
+    """
+    apply JSON Patch operations (add, remove, replace) to a document
+    :param doc: parsed JSON (changed in place)
+    :param ops: list of operations (see makepatch)
+    :return: the changed document
+    """
+    for op in ops:
+        if op['path'] == '':
+            doc = op['value']
+            continue
+        keys = [k.replace('~1', '/').replace('~0', '~') for k in op['path'].split('/')[1:]]
+        parent = doc
+        for key in keys[:-1]:
+            parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+        key = keys[-1]
+        if isinstance(parent, list):
+            if op['op'] == 'add':
+                if key == '-':
+                    parent.append(op['value'])
+                else:
+                    parent.insert(int(key), op['value'])
+            elif op['op'] == 'remove':
+                del parent[int(key)]
+            else:
+                parent[int(key)] = op['value']
+        elif op['op'] == 'remove':
+            del parent[key]
+        else:
+            parent[key] = op['value']
+    return doc
+
+
+def cacheversion(fid, text):
+    """ add the text of a version to the cache of rebuilt versions """
+    with versionlock:
+        versioncache[fid] = text
+        versioncache.move_to_end(fid)
+        while len(versioncache) > deltacache:
+            versioncache.popitem(last=False)
+
+
+def uncacheversions(fids):
+    """ remove versions from the cache of rebuilt versions (e.g. after their text was changed) """
+    with versionlock:
+        for fid in fids:
+            versioncache.pop(fid, None)
+
+
+def versiontext(model, fid):
+    """
+    text of a version of a file, rebuilt by applying the patches saved since
+    the last full copy (snapshot) or cached version
+    :param model: model of the files (e.g. JsonFiles - rows have base_id and stored text)
+    :param fid: id of the file
+    :return: text of the file
+    """
+    patches = []
+    current = fid
+    while True:
+        with versionlock:
+            text = versioncache.get(current)
+            if text is not None:
+                versioncache.move_to_end(current)
+        if text is not None:
+            break
+        row = model.objects.only('id', 'base', 'file', 'codec', 'zfile').get(id=current)
+        if row.base_id is None:
+            text = row.stored
+            break
+        patches.append(row.stored)
+        current = row.base_id
+    if patches:
+        doc = json.loads(text)
+        for patch in reversed(patches):
+            doc = applypatch(doc, json.loads(patch))
+        text = json.dumps(doc, separators=(',', ':'))
+    cacheversion(fid, text)
+    return text
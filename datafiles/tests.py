@@ -1,9 +1,54 @@
 """django unit test file"""
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
 from datafiles.models import *
+from datafiles.df_functions import jsonhash, updatedatafile
+from datafiles.patch_functions import makepatch, applypatch, versioncache
+from datafiles.zip_functions import fileresponse, decompress
+from datafiles import validation
+from unittest import mock
+import copy
+import io
 import json
 
 
+def maketables(*models):
+    """ create the tables of unmanaged models in the test database (migrate does not) """
+    tables = connection.introspection.table_names()
+    with connection.schema_editor() as editor:
+        for model in models:
+            if model._meta.db_table not in tables:
+                editor.create_model(model)
+
+
+def testfile():
+    """ the example data file (datafiles/test.jsonld) """
+    with open('datafiles/test.jsonld') as ld:
+        return json.load(ld)
+
+
+class FileTestCase(TestCase):
+    """ base class of the data file tests (the tables are made and the logs are not saved) """
+    @classmethod
+    def setUpClass(cls):
+        maketables(References, Datasets, JsonLookup, JsonFiles)
+        super().setUpClass()
+
+    def setUp(self):
+        for log in ['actlog', 'errorlog']:
+            patcher = mock.patch('datafiles.df_functions.' + log)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.doc = testfile()
+        ref = References.objects.create(doi='10.0000/test', updated='2020-01-01T00:00:00Z')
+        dset = Datasets.objects.create(name='test')
+        self.lookup = JsonLookup.objects.create(dataset=dset, reference=ref, uniqueid=self.doc['@graph']['uid'],
+                                                title='test', graphname='test', currentversion=0, auth_user_id=1)
+
+
 class AddfileTestCase(TestCase):
     def setUp(self):
         """unittest setup"""
@@ -32,3 +77,166 @@ class AddfileTestCase(TestCase):
         file = JsonFiles.objects.get(json_lookup_id=999)
         self.assertEqual(meta.title, 'pH of cyanide standard')
         self.assertEqual(file.type, 'raw')
+
+
+class HashTestCase(FileTestCase):
+    def test_jsonhash(self):
+        """the hash ignores the order of keys and generatedAt"""
+        doc = self.doc
+        same = json.loads(json.dumps(doc, sort_keys=True))
+        same['generatedAt'] = '2000-01-01T00:00:00'
+        self.assertEqual(jsonhash(doc), jsonhash(same))
+        self.assertEqual(jsonhash(doc), jsonhash(json.dumps(doc)))
+        self.assertEqual(len(jsonhash(doc)), 52)
+        other = copy.deepcopy(doc)
+        other['@graph']['title'] = 'changed'
+        self.assertNotEqual(jsonhash(doc), jsonhash(other))
+
+    def test_dedupe(self):
+        """a file that only differs in generatedAt is not saved again"""
+        first = updatedatafile(self.doc)
+        again = copy.deepcopy(self.doc)
+        again['generatedAt'] = '2000-01-01T00:00:00'
+        self.assertEqual(updatedatafile(again), first)
+        self.assertEqual(JsonFiles.objects.filter(json_lookup=self.lookup).count(), 1)
+        changed = copy.deepcopy(self.doc)
+        changed['@graph']['title'] = 'changed'
+        self.assertNotEqual(updatedatafile(changed)['fid'], first['fid'])
+        self.assertEqual(JsonFiles.objects.filter(json_lookup=self.lookup).count(), 2)
+
+
+class PatchTestCase(SimpleTestCase):
+    def test_roundtrip(self):
+        """applying the patch between two documents gives the second one"""
+        pairs = [
+            ({'a': 1, 'b': [1, 2, 3], 'c': {'d': 'x'}}, {'a': 2, 'b': [1, 5], 'c': {'e': None}, 'f': True}),
+            ({'list': [1]}, {'list': [1, {'x': [2, 3]}, 4]}),
+            ({'a/b': 1, 'm~n': [0]}, {'a/b': 2, 'm~n': [], 'new/~': 'v'}),
+            ({'a': {'b': 1}}, {'a': [1, 2]}),
+            ([1, 2], {'a': 1}),
+            ({'a': 1}, {'a': 1}),
+        ]
+        for old, new in pairs:
+            ops = makepatch(old, new)
+            self.assertEqual(applypatch(copy.deepcopy(old), ops), new)
+            self.assertEqual(applypatch(copy.deepcopy(old), json.loads(json.dumps(ops))), new)
+        self.assertEqual(makepatch({'a': 1}, {'a': 1}), [])
+
+
+class VersionTestCase(FileTestCase):
+    def setUp(self):
+        super().setUp()
+        # versions with one more value each (more than deltasnap so there are two full copies)
+        self.docs = []
+        doc = self.doc
+        for version in range(1, 13):
+            doc = copy.deepcopy(doc)
+            doc['@graph']['title'] = 'version ' + str(version)
+            doc['@graph'].setdefault('versions', []).append(version)
+            self.docs.append(doc)
+            updatedatafile(doc)
+        self.files = list(JsonFiles.objects.filter(json_lookup=self.lookup).order_by('version'))
+        versioncache.clear()
+
+    def test_versions(self):
+        """versions are saved as patches (except every deltasnap versions) and rebuilt"""
+        self.assertEqual([f.version for f in self.files], list(range(1, 13)))
+        self.assertEqual([f.base_id is None for f in self.files], [True] + [False] * 9 + [True, False])
+        for f, doc in zip(reversed(self.files), reversed(self.docs)):
+            self.assertEqual(JsonFiles.objects.get(id=f.id).content, json.dumps(doc, separators=(',', ':')))
+
+    def test_keyorder(self):
+        """a version with a key added in the middle of an object is saved as a full copy (same text)"""
+        doc = {}
+        for key, value in self.docs[-1].items():
+            doc[key] = value
+            if key == 'generatedAt':
+                doc['extra'] = 2
+        fid = updatedatafile(doc)['fid']
+        versioncache.clear()
+        saved = JsonFiles.objects.get(id=fid)
+        self.assertIsNone(saved.base_id)
+        self.assertEqual(saved.content, json.dumps(doc, separators=(',', ':')))
+
+    def test_fileresponse(self):
+        """the text of a version (not the patch) is sent, compressed if the client accepts it"""
+        delta = JsonFiles.objects.get(id=self.files[5].id)
+        self.assertIsNotNone(delta.base_id)
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = fileresponse(request, delta)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(decompress('gzip', response.content)), self.docs[5])
+        response = fileresponse(RequestFactory().get('/'), delta)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content), self.docs[5])
+
+
+class ValidateTestCase(SimpleTestCase):
+    def setUp(self):
+        with open('datafiles/test.jsonld', 'rb') as ld:
+            self.data = ld.read()
+
+    def check(self):
+        """ valid and invalid uploads (with the parser in use) """
+        doc = validation.validate(SimpleUploadedFile('test.jsonld', self.data + b'\n'))
+        self.assertEqual(doc['@graph']['uid'], testfile()['@graph']['uid'])
+        bad = [('test.json', self.data), ('test.jsonld', self.data + b'x'), ('test.jsonld', self.data + self.data),
+               ('test.jsonld', self.data[:-10]), ('test.jsonld', b'{"@graph": {"scidata": {}}}')]
+        for name, data in bad:
+            with self.assertRaises(ValidationError):
+                validation.validate(SimpleUploadedFile(name, data))
+
+    def test_ijson(self):
+        """uploads parsed with ijson (if installed)"""
+        if validation.ijson is None:
+            self.skipTest("ijson is not installed")
+        self.check()
+
+    def test_json(self):
+        """uploads parsed with the json module"""
+        with mock.patch.object(validation, 'ijson', None):
+            self.check()
+
+    def test_parsefile(self):
+        """an upload is parsed once"""
+        upload = SimpleUploadedFile('test.jsonld', self.data)
+        doc = validation.parsefile(upload)
+        self.assertIs(validation.parsefile(upload), doc)
+
+
+class FacetTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        maketables(FacetLookup, FacetFiles)
+        super().setUpClass()
+
+    def test_facetblobs(self):
+        """facet files that are not valid JSON are reported and left without a blob"""
+        lookup = FacetLookup.objects.create(uniqueid='test', title='test', type='test', graphname='test',
+                                            currentversion=3, auth_user_id=1, updated='2020-01-01T00:00:00Z')
+        texts = ['{"@id": "test", "generatedAt": "2020"}', '', '{"@id": "test", "generatedAt": "2021"}']
+        files = [FacetFiles.objects.create(facet_lookup=lookup, file=text, type='raw', version=i + 1,
+                                           updated='2020-01-01T00:00:00Z') for i, text in enumerate(texts)]
+        out, err = io.StringIO(), io.StringIO()
+        call_command('facetblobs', chunk=2, stdout=out, stderr=err)
+        self.assertIn("facet file " + str(files[1].id) + " is not valid JSON", err.getvalue())
+        rows = {fid: (blob, text) for fid, blob, text in FacetFiles.objects.values_list('id', 'blob_id', 'file')}
+        self.assertEqual(rows[files[1].id], (None, ''))
+        self.assertIsNotNone(rows[files[0].id][0])
+        self.assertEqual(rows[files[0].id][0], rows[files[2].id][0])
+        self.assertEqual(FacetBlobs.objects.get(id=rows[files[0].id][0]).content, texts[0])
+
+
+class MigrateTestCase(TransactionTestCase):
+    def test_migrate(self):
+        """the migrations run on a new database (where the unmanaged tables do not exist)"""
+        # remove the data files table made by the other tests (it is made again when needed)
+        if JsonFiles._meta.db_table in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                editor.delete_model(JsonFiles)
+        call_command('migrate', 'datafiles', '0002', verbosity=0)
+        self.assertNotIn(FacetBlobs._meta.db_table, connection.introspection.table_names())
+        call_command('migrate', 'datafiles', verbosity=0)
+        tables = connection.introspection.table_names()
+        self.assertIn(FacetBlobs._meta.db_table, tables)
+        self.assertNotIn(JsonFiles._meta.db_table, tables)
@@ -1,4 +1,113 @@
 """ validation of SciData JSON-LD files """
+from django.core.exceptions import ValidationError
+import json
+
+# a streaming parser is used if installed (pip install ijson) so the file
+# text is not held in memory as well as the parsed document
+try:
+    import ijson
+    parseerrors = (ValueError, StopIteration, ijson.JSONError)
+except ImportError:
+    ijson = None
+    parseerrors = (ValueError, StopIteration)
+
+# structure of a SciData JSON-LD file (checked by validate). Each node has
+# the type of the value and optionally the required keys, the schema of
+# some of the keys (properties) and of the items of a list
+scidataschema = {
+    'type': dict, 'required': ['@context', '@id', 'generatedAt', '@graph'],
+    'properties': {
+        '@graph': {
+            'type': dict, 'required': ['scidata', 'uid'],
+            'properties': {
+                'uid': {'type': str},
+                'scidata': {
+                    'type': dict,
+                    'properties': {
+                        'methodology': {'type': dict, 'properties': {
+                            'aspects': {'type': list, 'items': {'type': dict, 'required': ['@type']}}}},
+                        'system': {'type': dict, 'properties': {
+                            'facets': {'type': list, 'items': {'type': dict, 'required': ['@type']}}}},
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def compileschema(schema):
+    """
+    compile a schema (see scidataschema) into a function that checks a document
+    :return: function(value, path, errors) that adds the problems found to errors
+    """
+    vtype = schema.get('type')
+    required = schema.get('required', [])
+    props = {key: compileschema(sub) for key, sub in schema.get('properties', {}).items()}
+    items = compileschema(schema['items']) if 'items' in schema else None
+
+    def check(value, path, errors):
+        where = path or 'the file'
+        if vtype is not None and not isinstance(value, vtype):
+            errors.append(where + " should be a " + vtype.__name__)
+            return
+        for key in required:
+            if key not in value:
+                errors.append(where + " has no '" + key + "'")
+        for key, subcheck in props.items():
+            if key in value:
+                subcheck(value[key], path + "/" + key, errors)
+        if items is not None:
+            for i, item in enumerate(value):
+                items(item, path + "/" + str(i), errors)
+    return check
+
+
+checkscidata = compileschema(scidataschema)
+
+
+def parsefile(upload):
+    """
+    parse an uploaded JSON-LD file (once - the document is saved on the upload as .scidata)
+    :param upload: uploaded file
+    :return: the parsed document
+    """
+    doc = getattr(upload, 'scidata', None)
+    if doc is not None:
+        return doc
+    upload.seek(0)
+    if ijson is not None:
+        docs = ijson.items(upload, '', use_float=True)
+        doc = next(docs)
+        # read to the end so data after the document (e.g. a second document) is an error
+        if list(docs):
+            raise ValueError("Extra data after the JSON document")
+    else:
+        doc = json.load(upload)
+    upload.scidata = doc
+    return doc
+
+
+def validate(upload):
+    """
+    validate an uploaded SciData JSON-LD file (parsed once, see parsefile)
+    :param upload: uploaded file
+    :return: the parsed document
+    :raises ValidationError: with the problems found
+    """
+    if not str(upload).endswith('.jsonld'):
+        raise ValidationError("Not a valid SciData JSON-LD (the file name should end in .jsonld)")
+    try:
+        doc = parsefile(upload)
+    except parseerrors as exception:
+        raise ValidationError("Not a valid SciData JSON-LD (" + str(exception) + ")")
+    errors = []
+    checkscidata(doc, '', errors)
+    if errors:
+        raise ValidationError("Not a valid SciData JSON-LD: " + "; ".join(errors))
+    return doc
+
+
 # from datasets.ds_functions import *
 # import json
 #
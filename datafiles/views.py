@@ -7,7 +7,7 @@ from datafiles.forms import UploadFileForm
 from workflow.wf_functions import ingest
 from datetime import datetime
 from sciflow import gvars
-from django.http import HttpResponse
+from datafiles.zip_functions import fileresponse
 
 
 def ingestion(request):
@@ -45,7 +45,7 @@ def clean(request, fileid):
 def jsonld(request, fileid):
     """send JSON-LD file to browser"""
     data = JsonFiles.objects.get(id=fileid)
-    return HttpResponse(data.file, content_type="application/ld+json")
+    return fileresponse(request, data)
 
 
 # references related
@@ -0,0 +1,74 @@
+""" compression of the text of stored JSON-LD files (data, facet and aspect files) """
+from django.http import HttpResponse
+from workflow.settings import filecodec, filelevel
+import gzip
+
+# zstd is optional (pip install zstandard)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def codecready(codec):
+    """ check if a codec can be used (zstd needs the zstandard package) """
+    return codec == 'gzip' or (codec == 'zstd' and zstandard is not None)
+
+
+def compress(text, codec=filecodec):
+    """
+    compress the text of a file
+    :param text: file text
+    :param codec: 'gzip' or 'zstd'
+    :return: compressed bytes
+    """
+    data = text.encode('utf-8')
+    if codec == 'gzip':
+        # mtime=0 so the same text always gives the same bytes
+        return gzip.compress(data, compresslevel=filelevel, mtime=0)
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=filelevel).compress(data)
+    raise ValueError("Unknown or unavailable codec '" + str(codec) + "'")
+
+
+def decompress(codec, data):
+    """ text of a file compressed with compress """
+    data = bytes(data)
+    if codec == 'gzip':
+        return gzip.decompress(data).decode('utf-8')
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    raise ValueError("Unknown or unavailable codec '" + str(codec) + "'")
+
+
+def acceptsencoding(request, codec):
+    """ check if a client accepts a content encoding (Accept-Encoding header) """
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for part in accepted.split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() == codec and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            return True
+    return False
+
+
+def fileresponse(request, obj, content_type="application/ld+json"):
+    """
+    response with the text of a stored file. Compressed files are sent as
+    they are saved (with Content-Encoding) if the client accepts the codec.
+    Versions saved as patches (base_id set) are rebuilt and compressed again
+    :param request: the request
+    :param obj: JsonFiles, AspectFiles, FacetBlobs or FacetFiles object
+    :param content_type: content type of the response
+    """
+    codec = getattr(obj, 'codec', None)
+    if codec and acceptsencoding(request, codec):
+        if getattr(obj, 'base_id', None) is None:
+            data = bytes(obj.zfile)
+        else:
+            data = compress(obj.content, codec)
+        response = HttpResponse(data, content_type=content_type)
+        response['Content-Encoding'] = codec
+    else:
+        response = HttpResponse(obj.content, content_type=content_type)
+    response['Vary'] = 'Accept-Encoding'
+    return response
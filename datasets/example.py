@@ -48,22 +48,22 @@ if f6:
 
 f7 = False
 if f7:
-    fids = JsonFiles.objects.filter(
-        type='normalized', version=4, file__contains='herg').\
-        order_by('json_lookup_id').values_list('json_lookup_id', flat=True)
+    # file text may be compressed so it is searched after it is read
+    fids = [f.json_lookup_id for f in JsonFiles.objects.filter(type='normalized', version=4).
+            order_by('json_lookup_id').iterator() if 'herg' in f.content]
     for fid in fids:
         file = JsonFiles.objects.filter(json_lookup_id=fid).order_by('-version')[0]
         if file.comments == 'done':
             print('Done file ' + str(fid))
             continue
-        temp1 = file.file.replace('chalklab:substance:', 'chemtwin_')
+        temp1 = file.content.replace('chalklab:substance:', 'chemtwin_')
         temp2 = temp1.replace('"version":"2","@graph"', '"version":"3","@graph"')
         temp3 = re.sub(r'"generatedAt":".+?"', '"generatedAt":"' + datetime.now().isoformat() + '"', temp2)
         new = JsonFiles()
         new.version = file.version + 1
         new.json_lookup_id = file.json_lookup_id
         new.type = file.type
-        new.file = temp3
+        new.setcontent(temp3)
         new.comments = 'done'
         new.save()
         print(new.id)
@@ -5,3 +5,9 @@ from django.apps import AppConfig
 class SubstancesConfig(AppConfig):
     """config"""
     name = 'substances'
+
+    def ready(self):
+        # connect the signals that clear the template cache and update the identifier and search indexes
+        import substances.tmpl_functions  # noqa: F401
+        import substances.idx_functions  # noqa: F401
+        import substances.srch_functions  # noqa: F401
@@ -0,0 +1,60 @@
+""" consistency checks of the substances table against the identifiers table (grouped queries) """
+from django.core.paginator import Paginator
+from django.db.models import Count, F, Min, Q
+from substances.models import Substances
+from substances.settings import checkspage
+
+# check -> (substances field/identifier type, label, extra filter of the identifiers)
+subchecks = {
+    'inkcheck': ('inchikey', 'InChIKey', ~Q(identifiers__source='comchem')),
+    'cascheck': ('casrn', 'CASRN', Q()),
+}
+
+
+def checkrows(action):
+    """
+    one grouped query of the substances that fail a check. Each substance is
+    joined to its identifiers of the same type and the distinct values counted
+    :param action: name of the check (see subchecks)
+    :return queryset of dictionaries (id, field value, 'found' - number of distinct
+    values in the identifiers table, 'value' - lowest of them), ordered by id
+    """
+    field, label, extra = subchecks[action]
+    ids = Q(identifiers__type=field) & extra
+    rows = Substances.objects.values('id', field).annotate(
+        found=Count('identifiers__value', filter=ids, distinct=True),
+        value=Min('identifiers__value', filter=ids))
+    problems = Q(**{field + '__isnull': True}) | Q(**{field: ''}) | ~Q(found=1) | ~Q(value=F(field))
+    return rows.filter(problems).order_by('id')
+
+
+def checkerror(action, row):
+    """ description of the problem found by a check (see checkrows) """
+    field, label, extra = subchecks[action]
+    subid, key = str(row['id']), row[field]
+    if not key:
+        return 'No ' + label + ' for substance ' + subid
+    if row['found'] == 0:
+        return label + ' ' + key + ' (substance ' + subid + ') not found in Identifiers table'
+    if row['found'] > 1:
+        return 'Multiple ' + label + 's found for ' + key + ' (substance ' + subid + ')'
+    return label + ' ' + key + ' (substance ' + subid + ') does not match'
+
+
+def checkerrors(action, rows=None):
+    """ generator of the problems found by a check as dictionaries (id, check, value, found, error) """
+    field = subchecks[action][0]
+    if rows is None:
+        rows = checkrows(action).iterator(chunk_size=2000)
+    for row in rows:
+        yield {'id': row['id'], 'check': action, field: row[field], 'found': row['found'],
+               'value': row['value'], 'error': checkerror(action, row)}
+
+
+def checkreport(action, page=1, size=checkspage):
+    """
+    one page of the problems found by a check
+    :return tuple of the paginator page and a list of problems (see checkerrors)
+    """
+    page_obj = Paginator(checkrows(action), size).get_page(page)
+    return page_obj, list(checkerrors(action, page_obj.object_list))
@@ -335,7 +335,9 @@ if False:
 
 # fix empty molgraphs in json-ld files
 if False:
-    fixes = FacetFiles.objects.all().filter(file__contains='"atoms":[]').filter(file__contains='chemtwin')
+    # file text is in facet_blobs (maybe compressed) so it is searched after it is read
+    fixes = [f for f in FacetFiles.objects.select_related('blob').iterator()
+             if '"atoms":[]' in f.content and 'chemtwin' in f.content]
     for fix in fixes:
         # just replace the file don't create a new version in facet_files
         sub = Substances.objects.get(facet_lookup_id=fix.facet_lookup_id)
@@ -343,7 +345,8 @@ if False:
             pcid = Identifiers.objects.get(substance_id=sub.id, type='pubchem', source='pubchem')
             jld = createsubjld(sub.id)
             jld["@id"] = sub.graphdb
-            fix.file = json.dumps(jld, separators=(',', ':'))
+            fix.file = ''
+            fix.blob_id = saveblobs([json.dumps(jld, separators=(',', ':'))])[0][0]
             fix.save()
             print('Fixed facet_lookup ' + str(fix.facet_lookup_id))
         except ObjectDoesNotExist:
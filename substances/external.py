@@ -1,12 +1,17 @@
 """functions to get metadata/identifiers/descriptors from external websites"""
 import json
 import re
-import requests
-from qwikidata.sparql import return_sparql_query_results
 from qwikidata.entity import WikidataItem
-from qwikidata.typedefs import ItemId
-from qwikidata.linked_data_interface import get_entity_dict_from_api
 from chembl_webresource_client.new_client import new_client
+from workflow.http_functions import httpget, httppost
+from workflow.cache_functions import cacheget, cacheput, iscacheonly, CacheMissError
+from substances.mol_functions import parsemol, chgcodes
+
+# wikidata properties for chemical identifiers
+wdprops = {'casrn': 'P231', 'atc': 'P267', 'inchi': 'P234', 'inchikey': 'P235', 'chemspider': 'P661',
+           'pubchem': 'P662', 'reaxys': 'P1579', 'gmelin': 'P1578', 'chebi': 'P683', 'chembl': 'P592',
+           'rtecs': 'P657', 'dsstox': 'P3117', 'unii': 'P562', 'drugbank': 'P715', 'csmiles': 'P233',
+           'ismiles': 'P2017', 'mlights': 'P3890', 'mesh': 'P6680', 'massbank': 'P6689', 'ccdc': 'P6852'}
 
 
 def pubchem(identifier, meta, ids, descs, srcs):
@@ -21,14 +26,14 @@ def pubchem(identifier, meta, ids, descs, srcs):
 
     # check to see if compound is in database
     other = None
-    respnse = requests.get(apipath + 'inchikey/' + identifier + '/json')
+    respnse = httpget(apipath + 'inchikey/' + identifier + '/json', 'pubchem')
     if respnse.status_code != 200:
         notes = "InChIKey  " + identifier + " not found"
         srcs["pubchem"].update({"result": 0, "notes": notes})
         return
 
-    # OK compound has been found go get the data
-    jsn = requests.get(apipath + 'inchikey/' + identifier + '/json').json()
+    # OK compound has been found get the data
+    jsn = respnse.json()
     full = jsn["PC_Compounds"][0]
     pcid = full["id"]["id"]["cid"]
     props = full["props"]
@@ -71,6 +76,87 @@ def pubchem(identifier, meta, ids, descs, srcs):
         srcs["pubchem"].update({"result": 1})
 
 
+# pubchem property table columns and where they are put (see pubchem)
+pcprops = {'IUPACName': ('meta', 'iupacname'), 'MolecularFormula': ('meta', 'formula'),
+           'MolecularWeight': ('meta', 'mw'), 'MonoisotopicMass': ('meta', 'mim'),
+           'InChI': ('ids', 'inchi'), 'InChIKey': ('ids', 'inchikey'),
+           'CanonicalSMILES': ('ids', 'csmiles'), 'IsomericSMILES': ('ids', 'ismiles'),
+           'HBondAcceptorCount': ('descs', 'h_bond_acceptor'), 'HBondDonorCount': ('descs', 'h_bond_donor'),
+           'RotatableBondCount': ('descs', 'rotatable_bond'), 'HeavyAtomCount': ('descs', 'heavy_atom'),
+           'AtomStereoCount': ('descs', 'atom_chiral'), 'DefinedAtomStereoCount': ('descs', 'atom_chiral_def'),
+           'UndefinedAtomStereoCount': ('descs', 'atom_chiral_undef'), 'BondStereoCount': ('descs', 'bond_chiral'),
+           'DefinedBondStereoCount': ('descs', 'bond_chiral_def'),
+           'UndefinedBondStereoCount': ('descs', 'bond_chiral_undef'),
+           'IsotopeAtomCount': ('descs', 'isotope_atom'), 'CovalentUnitCount': ('descs', 'covalent_unit')}
+# newer versions of PUG REST return the SMILES under these names
+pcrenamed = {'ConnectivitySMILES': 'CanonicalSMILES', 'SMILES': 'IsomericSMILES'}
+
+
+def pubchembatch(identifiers, chunk=200):
+    """
+    retrieve data from PubChem for many inchikeys using the PUG REST property
+    table. Up to chunk inchikeys are POSTed in each request and the results
+    are cached by inchikey
+    :param identifiers: list of inchikeys
+    :param chunk: number of inchikeys per request
+    :return dictionary of inchikey -> (meta, ids, descs, srcs) (see pubchem)
+    """
+    apipath = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/inchikey/property/"
+    url = apipath + ",".join(pcprops.keys()) + "/JSON"
+    output = {}
+    found = {}
+    keys = []
+    for identifier in dict.fromkeys(identifiers):
+        if re.search('[A-Z]{14}-[A-Z]{10}-[A-Z]', identifier) is None:
+            output[identifier] = ({}, {}, {}, {"pubchem": {"result": 0, "notes": "Not an InChIKey"}})
+            continue
+        hit = cacheget('pubchem', 'props/' + identifier)
+        if hit is not None:
+            found[identifier] = json.loads(hit[1])
+        elif iscacheonly():
+            raise CacheMissError("No cached response for PubChem compound " + identifier)
+        else:
+            keys.append(identifier)
+
+    for i in range(0, len(keys), chunk):
+        batch = keys[i:i + chunk]
+        respnse = httppost(url, retry=True, data={'inchikey': ",".join(batch)})
+        rows = {key: None for key in batch}
+        if respnse.status_code == 200:
+            # the first CID found for an inchikey is used (as in pubchem)
+            for row in respnse.json()['PropertyTable']['Properties']:
+                if row.get('InChIKey') in rows and rows[row['InChIKey']] is None:
+                    rows[row['InChIKey']] = row
+        elif respnse.status_code != 404:  # 404 is returned when none are found
+            respnse.raise_for_status()
+        for key, row in rows.items():
+            cacheput('pubchem', 'props/' + key, 200 if row else 404, json.dumps(row))
+        found.update(rows)
+
+    for identifier, row in found.items():
+        meta, ids, descs, srcs = {}, {}, {}, {"pubchem": {}}
+        if not row:
+            notes = "InChIKey  " + identifier + " not found"
+            srcs["pubchem"].update({"result": 0, "notes": notes})
+        else:
+            data = {'meta': {}, 'ids': {'pubchem': row['CID']}, 'descs': {}}
+            for prop, value in row.items():
+                prop = pcrenamed.get(prop, prop)
+                if prop in pcprops:
+                    part, field = pcprops[prop]
+                    # values are strings in the compound JSON (see pubchem)
+                    if part == 'meta' and field in ['mw', 'mim']:
+                        value = str(value)
+                    data[part][field] = value
+            if 'iupacname' in data['meta']:
+                data['ids']['iupacname'] = data['meta']['iupacname']
+            meta['pubchem'], ids['pubchem'], descs['pubchem'] = data['meta'], data['ids'], data['descs']
+            srcs["pubchem"].update({"result": 1})
+        output[identifier] = (meta, ids, descs, srcs)
+
+    return output
+
+
 def classyfire(identifier, ids, descs, srcs):
     """ get classyfire classification for a specific compound """
     # best to use InChIKey to get the data
@@ -83,16 +169,16 @@ def classyfire(identifier, ids, descs, srcs):
         return
 
     # check to see if compound is in database
-    respnse = requests.get(apipath + identifier + '.json')
+    respnse = httpget(apipath + identifier + '.json', 'classyfire')
     if respnse.status_code != 200:
         notes = "InChIKey  " + identifier + " not found"
         srcs["classyfire"].update({"result": 0, "notes": notes})
         return
 
-    # OK compound has been found go get the data
+    # OK compound has been found get the data
     ids["classyfire"] = {}
     descs["classyfire"] = {}
-    respnse = requests.get(apipath + identifier + '.json').json()
+    respnse = respnse.json()
 
     if 'inchikey' not in respnse.keys():
         # not in classyfire
@@ -130,7 +216,8 @@ def wikidata(identifier, ids, srcs):
     """ retreive data from wikidata using the qwikidata python package"""
     # find wikidata code for a compound based off its inchikey (wdt:P35)
     srcs.update({"wikidata": {}})
-    w = "https://www.wikidata.org/w/api.php?action=wbgetclaims&format=json&entity="
+    sparqlurl = "https://query.wikidata.org/sparql"
+    w = "https://www.wikidata.org/w/api.php?action=wbgetentities&format=json&ids="
 
     # check identifier for inchikey pattern
     if re.search('[A-Z]{14}-[A-Z]{10}-[A-Z]', identifier) is None:
@@ -142,7 +229,7 @@ def wikidata(identifier, ids, srcs):
     q2 = "WHERE { ?compound wdt:P235 \"" + identifier + "\" ."
     q3 = 'SERVICE wikibase:label { bd:serviceParam wikibase:language "en". }}'
     query = q1 + q2 + q3
-    res = return_sparql_query_results(query)
+    res = httpget(sparqlurl, 'wikidata', params={'query': query, 'format': 'json'}).json()
     if 'bindings' in res['results'].keys() and not res['results']['bindings']:
         notes = "InChIKey  " + identifier + " not found"
         srcs["wikidata"].update({"result": 0, "notes": notes})
@@ -152,25 +239,21 @@ def wikidata(identifier, ids, srcs):
     eurl = res['results']['bindings'][0]['compound']['value']
     wdid = str(eurl).replace("http://www.wikidata.org/entity/", "")  # keep no SSL
     mwurl = w + wdid  # 'w' is defined (above)
-    respnse = requests.get(mwurl)
+    respnse = httpget(mwurl, 'wikidata')
     if respnse.status_code == 200:
-        # response contains many props from which we get specific chemical ones
-        ids['wikidata'] = {}
-        jsn = None
+        # response contains the whole entity (claims and aliases) from which
+        # we get specific chemical props
         try:
-            jsn = requests.get(mwurl).json()
+            cdict = respnse.json()['entities'][wdid]
         except ValueError:
             # https://stackoverflow.com/questions/8381193/handle-json-decode-error-when-nothing-returned
-            print('JSONDecodeError!')
-            print(mwurl)
-            exit()
-        claims = jsn['claims']
-        propids = {'casrn': 'P231', 'atc': 'P267', 'inchi': 'P234', 'inchikey': 'P235', 'chemspider': 'P661',
-                   'pubchem': 'P662', 'reaxys': 'P1579', 'gmelin': 'P1578', 'chebi': 'P683', 'chembl': 'P592',
-                   'rtecs': 'P657', 'dsstox': 'P3117', 'unii': 'P562', 'drugbank': 'P715', 'csmiles': 'P233',
-                   'ismiles': 'P2017', 'mlights': 'P3890', 'mesh': 'P6680', 'massbank': 'P6689', 'ccdc': 'P6852'}
-        vals = list(propids.values())
-        keys = list(propids.keys())
+            notes = "Invalid JSON for Wikidata entity '" + wdid + "'"
+            srcs["wikidata"].update({"result": 0, "notes": notes})
+            return
+        ids['wikidata'] = {}
+        claims = cdict['claims']
+        vals = list(wdprops.values())
+        keys = list(wdprops.keys())
         for propid, prop in claims.items():
             if propid in vals:
                 if 'datavalue' in prop[0]['mainsnak'].keys():
@@ -179,7 +262,6 @@ def wikidata(identifier, ids, srcs):
                     ids['wikidata'].update({key: value})
 
         # get aggregated names/tradenames for this compound (and intl names)
-        cdict = get_entity_dict_from_api(ItemId(wdid))
         cmpd = WikidataItem(cdict)
         ids['wikidata']['othername'] = []
         aliases = cmpd.get_aliases()
@@ -193,20 +275,145 @@ def wikidata(identifier, ids, srcs):
         srcs["wikidata"].update({"result": 0, "notes": notes})
 
 
+def wikidatabatch(identifiers, chunk=200):
+    """
+    retrieve data from wikidata for many inchikeys. Up to chunk inchikeys are
+    searched in a single SPARQL query (using VALUES) that returns the chemical
+    identifier properties and english aliases of all the compounds found
+    :param identifiers: list of inchikeys
+    :param chunk: number of inchikeys per query
+    :return dictionary of inchikey -> (meta, ids, descs, srcs) (see wikidata)
+    """
+    sparqlurl = "https://query.wikidata.org/sparql"
+    output = {}
+    keys = []
+    for identifier in dict.fromkeys(identifiers):
+        if re.search('^[A-Z]{14}-[A-Z]{10}-[A-Z]$', identifier) is None:
+            output[identifier] = ({}, {}, {}, {"wikidata": {"result": 0, "notes": "Not an InChIKey"}})
+            continue
+        # previous (batch) results are cached by inchikey
+        hit = cacheget('wikidata', 'batch/' + identifier)
+        if hit is not None:
+            data = json.loads(hit[1])
+            output[identifier] = ({}, data['ids'], {}, data['srcs'])
+        elif iscacheonly():
+            raise CacheMissError("No cached response for Wikidata compound " + identifier)
+        else:
+            keys.append(identifier)
+
+    props = " ".join(["wdt:" + pid for pid in wdprops.values()])
+    names = {v: k for k, v in wdprops.items()}
+    for i in range(0, len(keys), chunk):
+        batch = keys[i:i + chunk]
+        values = " ".join(['"' + key + '"' for key in batch])
+        query = "SELECT ?key ?compound ?prop ?value WHERE { VALUES ?key { " + values + " } " \
+                "?compound wdt:P235 ?key . " \
+                "{ VALUES ?p { " + props + " } ?compound ?p ?value . " \
+                "BIND(STRAFTER(STR(?p), 'direct/') AS ?prop) } UNION " \
+                "{ ?compound skos:altLabel ?value . FILTER(LANG(?value) = 'en') BIND('alias' AS ?prop) } } " \
+                "ORDER BY ?key ?compound ?prop ?value"
+        respnse = httppost(sparqlurl, retry=True, data={'query': query}, headers={'Accept': 'application/sparql-results+json'})
+        respnse.raise_for_status()
+        found = {}
+        for row in respnse.json()['results']['bindings']:
+            key = row['key']['value']
+            compound = row['compound']['value']
+            # like wikidata() only the first compound for an inchikey is used
+            if found.setdefault(key, {'compound': compound, 'ids': {}})['compound'] != compound:
+                continue
+            ids = found[key]['ids']
+            prop, value = row['prop']['value'], row['value']['value']
+            if prop == 'alias':
+                ids.setdefault('othername', []).append(value)
+            elif names[prop] not in ids:
+                ids[names[prop]] = value
+        for key in batch:
+            if key in found:
+                ids = found[key]['ids']
+                ids['othername'] = list(set(ids.get('othername', [])))
+                data = {'ids': {'wikidata': ids}, 'srcs': {'wikidata': {'result': 1}}}
+                cacheput('wikidata', 'batch/' + key, 200, json.dumps(data))
+            else:
+                notes = "InChIKey  " + key + " not found"
+                data = {'ids': {}, 'srcs': {'wikidata': {'result': 0, 'notes': notes}}}
+                cacheput('wikidata', 'batch/' + key, 404, json.dumps(data))
+            output[key] = ({}, data['ids'], {}, data['srcs'])
+
+    return output
+
+
 def chembl(identifier, meta, ids, descs, srcs):
     """ retrieve data from the ChEMBL repository"""
-    molecule = new_client.molecule
     srcs.update({"chembl": {}})
-    found = molecule.filter(molecule_structures__standard_inchi_key=identifier)
+    # the webresource client is not used for cached molecules
+    hit = cacheget('chembl', identifier)
+    if hit is not None:
+        found = json.loads(hit[1])
+    elif iscacheonly():
+        raise CacheMissError("No cached response for ChEMBL molecule " + identifier)
+    else:
+        molecule = new_client.molecule
+        found = list(molecule.filter(molecule_structures__standard_inchi_key=identifier))
+        cacheput('chembl', identifier, 200, json.dumps(found))
     notes = None
     result = 0
     if not found:
         notes = "InChiKey " + identifier + " not found"
         srcs["chembl"].update({"result": 0, "notes": notes})
         return
+    chemblparse(found[0], meta, ids, descs, srcs)
 
-    cmpd = found[0]
 
+def chemblbatch(identifiers, chunk=100):
+    """
+    retrieve data from the ChEMBL repository for many inchikeys. Molecules
+    are searched for chunk inchikeys at a time (the webresource client gets
+    the results a page at a time) and are cached by inchikey (as in chembl)
+    :param identifiers: list of inchikeys
+    :param chunk: number of inchikeys per search
+    :return dictionary of inchikey -> (meta, ids, descs, srcs) (see chembl)
+    """
+    output = {}
+    found = {}
+    keys = []
+    for identifier in dict.fromkeys(identifiers):
+        hit = cacheget('chembl', identifier)
+        if hit is not None:
+            found[identifier] = json.loads(hit[1])
+        elif iscacheonly():
+            raise CacheMissError("No cached response for ChEMBL molecule " + identifier)
+        else:
+            keys.append(identifier)
+
+    molecule = new_client.molecule
+    for i in range(0, len(keys), chunk):
+        batch = keys[i:i + chunk]
+        mols = {key: [] for key in batch}
+        query = molecule.filter(molecule_structures__standard_inchi_key__in=batch)
+        # pages of up to chunk molecules (the client default is 20, ChEMBL allows 1000)
+        query.query.limit = min(max(chunk, 20), 1000)
+        for mol in query:
+            key = (mol.get('molecule_structures') or {}).get('standard_inchi_key')
+            if key in mols:
+                mols[key].append(mol)
+        for key, mol in mols.items():
+            cacheput('chembl', key, 200, json.dumps(mol))
+        found.update(mols)
+
+    for identifier, mols in found.items():
+        meta, ids, descs, srcs = {}, {}, {}, {"chembl": {}}
+        if mols:
+            chemblparse(mols[0], meta, ids, descs, srcs)
+        else:
+            notes = "InChiKey " + identifier + " not found"
+            srcs["chembl"].update({"result": 0, "notes": notes})
+        output[identifier] = (meta, ids, descs, srcs)
+
+    return output
+
+
+def chemblparse(cmpd, meta, ids, descs, srcs):
+    """ get the metadata, identifiers and descriptors from a ChEMBL molecule"""
     # general metadata
     meta['chembl'] = {}
     mprops = ['full_molformula', 'full_mwt', 'mw_freebase', 'mw_monoisotopic']
@@ -282,7 +489,7 @@ def comchem(identifier, meta, ids, srcs):
 
     # search for entries and retrieve casrn for compound if present
     apipath = "https://commonchemistry.cas.org/"
-    respnse = requests.get(apipath + 'api/search?q=InChIKey=' + identifier).json()
+    respnse = httpget(apipath + 'api/search?q=InChIKey=' + identifier, 'comchem').json()
     if respnse['count'] == 0:
         notes = "InChIKey " + identifier + " not found"
         srcs["comchem"].update({"result": 0, "notes": notes})
@@ -290,7 +497,7 @@ def comchem(identifier, meta, ids, srcs):
 
     # even though there may be multiple responses, first is likely correct
     casrn = respnse['results'][0]['rn']
-    res = requests.get(apipath + 'api/detail?cas_rn=' + casrn).json()
+    res = httpget(apipath + 'api/detail?cas_rn=' + casrn, 'comchem').json()
 
     # OK now we have data for the specfic compound
     ids["comchem"] = {}
@@ -317,7 +524,7 @@ def pubchemsyns(identifier):
 
     # retrieve full record if available based on name
     searchpath = 'name/' + identifier + '/synonyms/json'
-    response = requests.get(apipath + searchpath).json()
+    response = httpget(apipath + searchpath, 'pubchem').json()
     syns = response["InformationList"]["Information"][0]["Synonym"]
     inchikey = ""
     for k in syns:
@@ -328,43 +535,75 @@ def pubchemsyns(identifier):
     return inchikey
 
 
-def pubchemmol(pcid):
+def pubchemsdfs(cids, chunk=200):
+    """
+    retrieve SDF files for many compounds from the PugRest API at PubChem.
+    Up to chunk CIDs are POSTed in each request and the SDF of each compound
+    is cached by CID
+    :param cids: list of pubchem ids
+    :param chunk: number of compounds per request
+    :return dictionary of CID (str) -> SDF record (compounds not found are left out)
+    """
+    url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/SDF"
+    output = {}
+    todo = []
+    for cid in dict.fromkeys([str(x) for x in cids]):
+        hit = cacheget('pubchem', 'sdf/' + cid)
+        if hit is not None:
+            if hit[0] == 200:
+                output[cid] = hit[1].decode('utf-8')
+        elif iscacheonly():
+            raise CacheMissError("No cached response for PubChem SDF " + cid)
+        else:
+            todo.append(cid)
+
+    for i in range(0, len(todo), chunk):
+        batch = todo[i:i + chunk]
+        respnse = httppost(url, retry=True, data={'cid': ",".join(batch)})
+        sdfs = {}
+        if respnse.status_code == 200:
+            # records are separated by $$$$ and the first line is the CID
+            for record in respnse.text.split('$$$$'):
+                record = record.lstrip('\r\n')
+                if record.strip():
+                    sdfs[record.splitlines()[0].strip()] = record + '$$$$\n'
+        elif respnse.status_code != 404:
+            respnse.raise_for_status()
+        for cid in batch:
+            if cid in sdfs:
+                cacheput('pubchem', 'sdf/' + cid, 200, sdfs[cid])
+                output[cid] = sdfs[cid]
+            else:
+                cacheput('pubchem', 'sdf/' + cid, 404, '')
+
+    return output
+
+
+def pubchemmol(pcid, sdf=None):
     """
     allows retrieval of SDF file from the PugRest API at PubChem
         with two entries - atoms and bonds.  Each value is a list
                 atoms list is x, y, z coords and element symbol
                 bonds list is atom1, atom2, and bond order
     :param pcid pubchem id for compound
+    :param sdf SDF of the compound (if already retrieved, see pubchemsdfs)
     :return dict dictionary
     """
-    apipath = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/"
-    url = apipath + str(pcid) + '/SDF'
-    response = requests.get(url)
-    sdf = None
-    if response.status_code == 200:
-        sdf = requests.get(url).text
-
-    atoms = []
-    bonds = []
-    chrgs = []
-    for ln in sdf.splitlines():
-        a = re.search(r"([0-9\-.]+)\s+([0-9\-.]+)\s+([0-9\-.]+)\s"
-                      r"([A-Za-z]{1,2})\s+0\s+(\d)\s+0\s+0", ln)
-        if a:
-            atoms.append([a[1], a[2], a[3], a[4], a[5]])
-            continue
-        b = re.search(r"^\s+(\d{1,2})\s+(\d{1,2})\s+(\d)\s+0\s+0\s+0\s+0$", ln)
-        if b:
-            bonds.append([b[1], b[2], b[3]])
-            continue
-        c = re.search(r"^M\s+CHG\s+(\d)", ln)
-        if c:
-            num = int(c[1])
-            rest = ln.replace('M  CHG  ' + str(num), '')
-            parts = re.split(r"\s{2,3}", rest.strip())
-            for idx, val in enumerate(parts):
-                if (idx % 2) != 0:
-                    continue
-                chrgs.append([val, parts[(idx + 1)]])
+    if sdf is None:
+        sdf = pubchemsdfs([pcid]).get(str(pcid), '')
+
+    if not sdf:
+        return {'atoms': [], 'bonds': [], 'chrgs': []}
+    mol = parsemol(sdf)
+
+    # lists of strings (as in the SDF file) used to create the molgraph
+    codes = {v: k for k, v in chgcodes.items() if k != 4}
+    atoms, chrgs = [], []
+    for i, (x, y, z) in enumerate(mol['coords']):
+        chrg = int(mol['charges'][i])
+        atoms.append(['%.4f' % x, '%.4f' % y, '%.4f' % z, mol['symbols'][i], str(codes.get(chrg, 0))])
+        if chrg != 0:
+            chrgs.append([str(i + 1), str(chrg)])
+    bonds = [[str(a1), str(a2), str(order)] for a1, a2, order in mol['bonds'].tolist()]
 
     return {'atoms': atoms, 'bonds': bonds, 'chrgs': chrgs}
@@ -0,0 +1,316 @@
+""" fingerprint index of substance structures for similarity and substructure search """
+from substances.models import Substances, Identifiers, Structures
+from substances.settings import fppath, fpradius, fpbits, fppatbits, fpmerge
+from rdkit import Chem, DataStructs, RDLogger
+from rdkit.Chem import rdFingerprintGenerator
+from contextlib import contextmanager
+import numpy as np
+import threading
+import json
+import os
+import shutil
+import time
+
+# fcntl is not available on Windows (only threads are locked out there)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RDLogger.DisableLog('rdApp.*')
+
+# number of bits set in each byte value
+popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+fplock = threading.Lock()
+fpwrite = threading.Lock()
+# loaded index parts (see fpload) and the folders they were loaded from
+fpparts = {}
+
+
+def fpmol(text):
+    """ make an RDKit molecule from a molfile or SMILES (None if it cannot be read) """
+    if text is None:
+        return None
+    if '\n' in text:
+        return Chem.MolFromMolBlock(text)
+    return Chem.MolFromSmiles(text)
+
+
+def fpcompute(rows):
+    """
+    calculate the fingerprints of substances
+    :param rows: list of (substance id, molfile or SMILES) tuples
+    :return dictionary of arrays (ids, morgan, pattern, counts) and the SMILES of the substances
+    """
+    generator = rdFingerprintGenerator.GetMorganGenerator(radius=fpradius, fpSize=fpbits)
+    ids, morgan, pattern, smiles = [], [], [], []
+    for subid, text in rows:
+        mol = fpmol(text)
+        if mol is None:
+            continue
+        pat = np.zeros((fppatbits,), dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(Chem.PatternFingerprint(mol, fpSize=fppatbits), pat)
+        ids.append(subid)
+        morgan.append(np.packbits(generator.GetFingerprintAsNumPy(mol).astype(np.uint8)))
+        pattern.append(np.packbits(pat))
+        smiles.append(Chem.MolToSmiles(mol))
+    data = {'ids': np.array(ids, dtype=np.int32),
+            'morgan': np.array(morgan, dtype=np.uint8).reshape(-1, fpbits // 8),
+            'pattern': np.array(pattern, dtype=np.uint8).reshape(-1, fppatbits // 8)}
+    data['counts'] = popcount[data['morgan']].sum(axis=1).astype(np.uint16)
+    return data, smiles
+
+
+def fpstructures(subids=None, chunk=5000):
+    """
+    get the structures of substances (molfile from the structures table or
+    the canonical SMILES) a chunk at a time
+    :param subids: list of substance ids (all substances if None)
+    """
+    if subids is None:
+        subids = list(Substances.objects.order_by('id').values_list('id', flat=True))
+    for i in range(0, len(subids), chunk):
+        batch = subids[i:i + chunk]
+        texts = dict(Identifiers.objects.filter(substance_id__in=batch, type='csmiles')
+                     .values_list('substance_id', 'value'))
+        for subid, molfile in Structures.objects.filter(substance_id__in=batch).order_by('updated')\
+                .values_list('substance_id', 'molfile'):
+            texts[subid] = molfile
+        yield [(subid, texts[subid]) for subid in batch if subid in texts]
+
+
+def fpsave(part, data, smiles):
+    """
+    save a part of the index (base or delta) in a new folder - it is used
+    once the manifest is changed to name it (see fpswap)
+    :return name of the folder
+    """
+    folder = part + '.' + str(time.time_ns())
+    path = os.path.join(fppath, folder)
+    os.makedirs(path)
+    for name, array in data.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+    with open(os.path.join(path, 'smiles'), 'w') as f:
+        f.write("\n".join(smiles) + "\n" if smiles else "")
+    return folder
+
+
+def fpmanifest():
+    """ folders of the current parts of the index (part -> folder) - None if not built """
+    try:
+        with open(os.path.join(fppath, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def fpswap(folders):
+    """
+    make saved folders the current parts of the index (one rename so all the
+    parts change together). Folders older than the previous ones are removed
+    (the previous ones are kept for searches that have just read the manifest)
+    :param folders: dictionary of part -> folder (see fpsave)
+    """
+    old = fpmanifest() or {}
+    manifest = dict(old, **folders)
+    with open(os.path.join(fppath, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(fppath, 'manifest.json.tmp'), os.path.join(fppath, 'manifest.json'))
+    keep = set(manifest.values()) | set(old.values())
+    for folder in os.listdir(fppath):
+        if folder.split('.')[0] in ('base', 'delta') and folder not in keep:
+            shutil.rmtree(os.path.join(fppath, folder), ignore_errors=True)
+
+
+@contextmanager
+def fpwritelock():
+    """ lock the index while it is changed (an OS file lock so other processes wait too) """
+    os.makedirs(fppath, exist_ok=True)
+    with open(os.path.join(fppath, 'lock'), 'w') as f:
+        if fcntl is None:
+            with fpwrite:
+                yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def fpload(part, manifest=None):
+    """
+    load a part of the index (arrays are memory mapped) - None if not built
+    :param part: 'base' or 'delta'
+    :param manifest: manifest to use (see fpmanifest - read if not given)
+    """
+    if manifest is None:
+        manifest = fpmanifest()
+    if not manifest or part not in manifest:
+        return None
+    folder = manifest[part]
+    with fplock:
+        cached = fpparts.get(part)
+        if cached is not None and cached['folder'] == folder:
+            return cached
+    loaded = {'folder': folder, 'smiles': None}
+    for name in ['ids', 'morgan', 'pattern', 'counts']:
+        loaded[name] = np.load(os.path.join(fppath, folder, name + '.npy'), mmap_mode='r')
+    with fplock:
+        fpparts[part] = loaded
+    return loaded
+
+
+def fpsmiles(loaded):
+    """ the SMILES of the substances in a loaded part of the index (read when first needed) """
+    if loaded['smiles'] is None:
+        with open(os.path.join(fppath, loaded['folder'], 'smiles')) as f:
+            loaded['smiles'] = f.read().splitlines()
+    return loaded['smiles']
+
+
+def fpbuild():
+    """ build the fingerprint index of all substances (and remove the delta) """
+    datas, smiles = [], []
+    for rows in fpstructures():
+        data, smls = fpcompute(rows)
+        datas.append(data)
+        smiles.extend(smls)
+    if not datas:
+        datas.append(fpcompute([])[0])
+    data = {name: np.concatenate([d[name] for d in datas]) for name in datas[0].keys()}
+    with fpwritelock():
+        fpswap({'base': fpsave('base', data, smiles), 'delta': fpsave('delta', fpcompute([])[0], [])})
+    return len(data['ids'])
+
+
+def fpupdate(subids):
+    """
+    add (or replace) substances in the index. They are added to the delta
+    part which is merged into the base part when it gets big (see fpmerge).
+    The index is locked so updates from other processes are not lost
+    :param subids: list of substance ids
+    :return number of substances added
+    """
+    if fpmanifest() is None:
+        return 0
+    new, newsmiles = fpcompute([row for rows in fpstructures(list(subids)) for row in rows])
+    with fpwritelock():
+        manifest = fpmanifest()
+        if manifest is None:
+            return 0
+        delta = fpload('delta', manifest)
+        if delta is not None and len(delta['ids']):
+            keep = ~np.isin(delta['ids'], new['ids'])
+            oldsmiles = [s for s, k in zip(fpsmiles(delta), keep) if k]
+            new = {name: np.concatenate([np.asarray(delta[name])[keep], new[name]]) for name in new.keys()}
+            newsmiles = oldsmiles + newsmiles
+        if len(new['ids']) >= fpmerge:
+            base = fpload('base', manifest)
+            keep = ~np.isin(base['ids'], new['ids'])
+            merged = {name: np.concatenate([np.asarray(base[name])[keep], new[name]]) for name in new.keys()}
+            smiles = [s for s, k in zip(fpsmiles(base), keep) if k] + newsmiles
+            fpswap({'base': fpsave('base', merged, smiles), 'delta': fpsave('delta', fpcompute([])[0], [])})
+        else:
+            fpswap({'delta': fpsave('delta', new, newsmiles)})
+    return len(new['ids'])
+
+
+def fpquery(text):
+    """ fingerprints of a query structure (molfile or SMILES) - None if it cannot be read """
+    mol = fpmol(text)
+    if mol is None:
+        return None, None
+    return mol, fpcompute([(0, text)])[0]
+
+
+def fpactive():
+    """
+    the loaded index parts with the base rows replaced by the delta masked out
+    (both parts from the same manifest)
+    """
+    parts = []
+    manifest = fpmanifest()
+    try:
+        base, delta = fpload('base', manifest), fpload('delta', manifest)
+    except FileNotFoundError:
+        # the index was changed twice since the manifest was read
+        manifest = fpmanifest()
+        base, delta = fpload('base', manifest), fpload('delta', manifest)
+    if base is None:
+        return parts
+    if delta is not None and len(delta['ids']):
+        parts.append(('base', base, ~np.isin(base['ids'], delta['ids'])))
+        parts.append(('delta', delta, None))
+    else:
+        parts.append(('base', base, None))
+    return parts
+
+
+def similar(text, k=10, minsim=0.0, chunk=100000):
+    """
+    find the substances most similar to a structure (Tanimoto similarity of
+    morgan fingerprints)
+    :param text: molfile or SMILES of the query structure
+    :param k: number of substances returned
+    :param minsim: minimum similarity
+    :return list of (substance id, similarity) tuples (most similar first)
+    """
+    mol, query = fpquery(text)
+    if mol is None:
+        raise ValueError("Structure could not be read")
+    qfp, qcount = query['morgan'][0], int(query['counts'][0])
+    ids, sims = [], []
+    for name, part, mask in fpactive():
+        for i in range(0, len(part['ids']), chunk):
+            fps = part['morgan'][i:i + chunk]
+            common = popcount[fps & qfp].sum(axis=1)
+            union = part['counts'][i:i + chunk].astype(np.int32) + qcount - common
+            sim = np.where(union > 0, common / np.maximum(union, 1), 0.0)
+            if mask is not None:
+                sim = np.where(mask[i:i + chunk], sim, -1.0)
+            # keep the top k of each chunk
+            top = np.argpartition(-sim, min(k, len(sim)) - 1)[:k] if len(sim) > k else np.arange(len(sim))
+            ids.append(np.asarray(part['ids'][i:i + chunk])[top])
+            sims.append(sim[top])
+    if not ids:
+        return []
+    ids, sims = np.concatenate(ids), np.concatenate(sims)
+    order = np.argsort(-sims, kind='stable')[:k]
+    return [(int(ids[i]), round(float(sims[i]), 4)) for i in order if sims[i] >= minsim and sims[i] >= 0]
+
+
+def substructure(text, limit=100, chunk=100000):
+    """
+    find the substances that contain a substructure. Substances are screened
+    with pattern fingerprints and only those that pass are matched with RDKit
+    :param text: molfile or SMILES (or SMARTS) of the substructure
+    :param limit: maximum number of substances returned
+    :return list of substance ids
+    """
+    mol, query = fpquery(text)
+    if mol is None:
+        mol = Chem.MolFromSmarts(text)
+        if mol is None:
+            raise ValueError("Substructure could not be read")
+        pat = np.zeros((fppatbits,), dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(Chem.PatternFingerprint(mol, fpSize=fppatbits), pat)
+        qpat = np.packbits(pat)
+    else:
+        qpat = query['pattern'][0]
+    found = []
+    for name, part, mask in fpactive():
+        smiles = None
+        for i in range(0, len(part['ids']), chunk):
+            screen = ((part['pattern'][i:i + chunk] & qpat) == qpat).all(axis=1)
+            if mask is not None:
+                screen &= mask[i:i + chunk]
+            for row in np.nonzero(screen)[0]:
+                if smiles is None:
+                    smiles = fpsmiles(part)
+                cand = Chem.MolFromSmiles(smiles[i + row])
+                if cand is not None and cand.HasSubstructMatch(mol):
+                    found.append(int(part['ids'][i + row]))
+                    if len(found) >= limit:
+                        return found
+    return found
@@ -0,0 +1,159 @@
+""" in memory index of identifier values -> substance ids """
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from substances.models import Identifiers, Substances
+from substances.settings import idxsize, idxtypes
+from collections import OrderedDict
+import threading
+
+# normalized identifier value -> substance id (least recently used first)
+subindex = OrderedDict()
+idxlock = threading.RLock()
+idxstate = {'built': False}
+
+
+def idxnorm(value):
+    """
+    normalize an identifier value for the index. Only whitespace is removed as
+    case matters in SMILES, InChIs and InChIKeys (e.g. c1ccccc1 and C1CCCCC1)
+    """
+    return str(value).strip()
+
+
+def idxput(value, subid, replace=False):
+    """
+    add an identifier value to the index
+    :param replace: replace the substance id of a value already in the index
+    (otherwise the first substance found - lowest identifier id - is kept)
+    """
+    key = idxnorm(value)
+    with idxlock:
+        if key in subindex:
+            subindex.move_to_end(key)
+            if not replace:
+                return
+        subindex[key] = subid
+        while len(subindex) > idxsize:
+            subindex.popitem(last=False)
+
+
+def idxbuild():
+    """ load the most used identifier types into the index (once per process) """
+    with idxlock:
+        if idxstate['built']:
+            return
+        idxstate['built'] = True
+        rows = Identifiers.objects.filter(type__in=idxtypes).order_by('id').values_list('value', 'substance_id')
+        for value, subid in rows[:idxsize].iterator(chunk_size=10000):
+            idxput(value, subid)
+
+
+def resolvemany(values):
+    """
+    find the substance ids of many identifier values. Values not in the
+    index are found in the identifiers table (in a few queries) and added
+    :param values: list of identifier values
+    :return dictionary of value -> substance id (values not found are left out)
+    """
+    idxbuild()
+    found, missing = {}, {}
+    with idxlock:
+        for value in values:
+            key = idxnorm(value)
+            if key in subindex:
+                subindex.move_to_end(key)
+                found[value] = subindex[key]
+            else:
+                missing.setdefault(key, []).append(value)
+    if missing:
+        misses = list(missing.keys())
+        for i in range(0, len(misses), 1000):
+            rows = Identifiers.objects.filter(value__in=misses[i:i + 1000]).order_by('id')\
+                .values_list('value', 'substance_id')
+            for value, subid in rows:
+                key = idxnorm(value)
+                idxput(value, subid)
+                for orig in missing.get(key, []):
+                    found.setdefault(orig, subid)
+    return found
+
+
+def idxcheck(found):
+    """
+    check that the substances found in the index still exist. The index is kept
+    per process so entries of substances deleted (or merged) by another process
+    are stale - these are removed and the values looked up again in the table
+    :param found: dictionary of value -> substance id (from resolvemany)
+    :return dictionary of value -> substance id (values not found are left out)
+    """
+    subids = list(set(found.values()))
+    existing = set()
+    for i in range(0, len(subids), 1000):
+        existing.update(Substances.objects.filter(id__in=subids[i:i + 1000]).values_list('id', flat=True))
+    stale = [value for value, subid in found.items() if subid not in existing]
+    if not stale:
+        return found
+    idxrefresh(stale)
+    checked = {value: subid for value, subid in found.items() if subid in existing}
+    checked.update(resolvemany(stale))
+    return checked
+
+
+def resolve(value):
+    """ find the substance id of an identifier value (False if not found) """
+    return idxcheck(resolvemany([value])).get(value, False)
+
+
+def idxrefresh(values):
+    """
+    set the index entries of identifier values from the identifiers table (as
+    in idxbuild the lowest identifier id of a value is used). Values no longer
+    in the table are removed from the index
+    :param values: list of identifier values
+    """
+    keys = list(dict.fromkeys([idxnorm(value) for value in values]))
+    for i in range(0, len(keys), 1000):
+        part = keys[i:i + 1000]
+        rows = Identifiers.objects.filter(value__in=part).order_by('-id').values_list('value', 'substance_id')
+        # in reverse id order so the lowest id of each value is set last
+        subids = {}
+        for value, subid in rows:
+            subids[idxnorm(value)] = subid
+        with idxlock:
+            for key in part:
+                if key in subids:
+                    idxput(key, subids[key], replace=True)
+                else:
+                    subindex.pop(key, None)
+
+
+def idxaddrows(rows):
+    """ add identifier rows saved with bulk_create (no signals are sent) """
+    idxrefresh([row.value for row in rows])
+
+
+def idxremove(values):
+    """
+    remove identifier values from the index (e.g. after a bulk delete). Values
+    still in the identifiers table (for other substances) are kept
+    """
+    idxrefresh(values)
+
+
+def idxclear():
+    """ empty the index (it is built again when next used) """
+    with idxlock:
+        subindex.clear()
+        idxstate['built'] = False
+
+
+@receiver(post_save, sender=Identifiers)
+def idxsaved(sender, instance, **kwargs):
+    """ an identifier was saved so update its entry in the index """
+    idxrefresh([instance.value])
+
+
+@receiver(post_delete, sender=Identifiers)
+def idxdeleted(sender, instance, **kwargs):
+    """ an identifier was deleted so remove it from the index """
+    idxremove([instance.value])
@@ -0,0 +1,100 @@
+""" 3D models and 2D depictions of substances made with RDKit (cached on disk) """
+from substances.models import Identifiers, Structures
+from substances.settings import imgpath, imgsize
+from rdkit import Chem, RDLogger
+from rdkit.Chem import AllChem
+from rdkit.Chem.Draw import rdMolDraw2D
+import glob
+import os
+
+RDLogger.DisableLog('rdApp.*')
+
+# file extension and content type of each kind of image
+imgtypes = {'3d': ('sdf', 'chemical/x-mdl-sdfile'), 'svg': ('svg', 'image/svg+xml')}
+
+
+def imgsource(subid):
+    """
+    get the structure of a substance (latest molfile or the canonical SMILES)
+    :return tuple of (molfile or SMILES, updated timestamp) or (None, None)
+    """
+    struc = Structures.objects.filter(substance_id=subid).order_by('-updated').values_list('molfile', 'updated').first()
+    if struc is None:
+        struc = Identifiers.objects.filter(substance_id=subid, type='csmiles').order_by('-updated').\
+            values_list('value', 'updated').first()
+    if struc is None:
+        return None, None
+    return struc[0], int(struc[1].timestamp()) if struc[1] else 0
+
+
+def hasstructure(subid):
+    """ check if a 3D model/depiction of a substance can be made (without making it) """
+    return Structures.objects.filter(substance_id=subid).exists() or \
+        Identifiers.objects.filter(substance_id=subid, type='csmiles').exists()
+
+
+def imgmol(text):
+    """ RDKit molecule from a molfile or SMILES (None if it cannot be read) """
+    if text is None:
+        return None
+    if '\n' in text:
+        return Chem.MolFromMolBlock(text)
+    return Chem.MolFromSmiles(text)
+
+
+def make3d(mol):
+    """ 3D conformer of a molecule (with hydrogens) as a molfile or None if it cannot be embedded """
+    mol = Chem.AddHs(mol)
+    params = AllChem.ETKDGv3()
+    params.randomSeed = 42
+    if AllChem.EmbedMolecule(mol, params) != 0:
+        return None
+    if AllChem.MMFFHasAllMoleculeParams(mol):
+        AllChem.MMFFOptimizeMolecule(mol)
+    else:
+        AllChem.UFFOptimizeMolecule(mol)
+    return Chem.MolToMolBlock(mol) + "$$$$\n"
+
+
+def makesvg(mol, size=imgsize):
+    """ 2D depiction of a molecule as SVG """
+    mol = Chem.Mol(mol)
+    if mol.GetNumConformers() == 0 or mol.GetConformer().Is3D():
+        AllChem.Compute2DCoords(mol)
+    drawer = rdMolDraw2D.MolDraw2DSVG(size, size)
+    rdMolDraw2D.PrepareAndDrawMolecule(drawer, mol)
+    drawer.FinishDrawing()
+    return drawer.GetDrawingText()
+
+
+def subimage(subid, kind):
+    """
+    get the 3D model ('3d') or 2D depiction ('svg') of a substance. Images
+    are saved as <subid>.<structure updated>.<ext> so they are made again
+    when the structure changes
+    :param subid: substance id
+    :param kind: '3d' or 'svg'
+    :return text of the image or None if the substance has no (usable) structure
+    """
+    ext = imgtypes[kind][0]
+    text, updated = imgsource(subid)
+    if text is None:
+        return None
+    fname = os.path.join(imgpath, str(subid) + '.' + str(updated) + '.' + ext)
+    if os.path.exists(fname):
+        with open(fname) as f:
+            return f.read()
+    mol = imgmol(text)
+    if mol is None:
+        return None
+    image = make3d(mol) if kind == '3d' else makesvg(mol)
+    if image is None:
+        return None
+    # remove images of older versions of the structure
+    for old in glob.glob(os.path.join(imgpath, str(subid) + '.*.' + ext)):
+        os.remove(old)
+    os.makedirs(imgpath, exist_ok=True)
+    with open(fname + '.tmp', 'w') as f:
+        f.write(image)
+    os.replace(fname + '.tmp', fname)
+    return image
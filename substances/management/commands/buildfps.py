@@ -0,0 +1,18 @@
+""" build the fingerprint index of substance structures """
+from django.core.management.base import BaseCommand
+from substances.fp_functions import fpbuild, fpupdate
+
+
+class Command(BaseCommand):
+    help = 'Build the fingerprint index used for similarity and substructure search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', help='only add/update these substances (comma separated ids)')
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            count = fpupdate([int(x) for x in options['ids'].split(',')])
+            self.stdout.write("updated the fingerprints of " + str(count) + " substances")
+        else:
+            count = fpbuild()
+            self.stdout.write("fingerprint index built (" + str(count) + " substances)")
@@ -0,0 +1,18 @@
+""" build the search index of substance names and identifiers """
+from django.core.management.base import BaseCommand
+from substances.srch_functions import searchbuild, searchids, usefts
+
+
+class Command(BaseCommand):
+    help = 'Build (or rebuild) the substance search index used by subsearch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--test', help='search for this text after the index is built')
+
+    def handle(self, *args, **options):
+        self.stdout.write("building the search index (" + ("FTS5" if usefts() else "token table") + ")")
+        searchbuild()
+        if options['test']:
+            subids, total = searchids(options['test'])
+            self.stdout.write(str(total) + " substances found " + str(subids))
+        self.stdout.write("search index built")
@@ -0,0 +1,86 @@
+""" refresh the substance data from the external sources, stalest first """
+from django.core.management.base import BaseCommand
+from substances.sub_functions import *
+from datetime import datetime
+import json
+import os
+import time
+
+
+def loadstate():
+    """ load the refresh progress (reset each day) """
+    state = {'date': str(date.today()), 'used': {}, 'totals': {}}
+    if os.path.exists(refreshstate):
+        with open(refreshstate) as f:
+            saved = json.load(f)
+        if saved.get('date') == state['date']:
+            state = saved
+    return state
+
+
+def savestate(state):
+    """ save the refresh progress (written to a temp file first) """
+    os.makedirs(os.path.dirname(refreshstate), exist_ok=True)
+    with open(refreshstate + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(refreshstate + '.tmp', refreshstate)
+
+
+def allowance(source, state, spread):
+    """
+    number of substances that can still be refreshed from a source today. If
+    spread is True the daily budget is released evenly through the day
+    """
+    budget = refreshbudget.get(source, 0)
+    if spread:
+        now = datetime.now()
+        elapsed = (now.hour * 3600 + now.minute * 60 + now.second) / 86400
+        budget = int(budget * elapsed)
+    return max(budget - state['used'].get(source, 0), 0)
+
+
+class Command(BaseCommand):
+    help = 'Add queued substances and refresh the stalest substances from each source (within the daily budget)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', default=','.join(subsources), help='comma separated list of sources')
+        parser.add_argument('--workers', type=int, default=subworkers, help='substances searched at the same time')
+        parser.add_argument('--batch', type=int, default=refreshbatch, help='substances refreshed per batch')
+        parser.add_argument('--maxage', type=int, default=refreshage, help='refresh data older than this (days)')
+        parser.add_argument('--worker', action='store_true', help='keep running, spreading the budget over the day')
+        parser.add_argument('--sleep', type=int, default=300, help='seconds to wait when there is nothing to do')
+
+    def handle(self, *args, **options):
+        sources = options['sources'].split(',')
+        while True:
+            state = loadstate()
+            done = 0
+            # add the substances queued by the resolve API
+            queued = takequeue()
+            if queued:
+                added = addsubstances(queued)
+                donequeue()
+                done += len(queued)
+                new = sum(1 for x in added.values() if x['status'] == 'new')
+                self.stdout.write("added " + str(len(queued)) + " queued substances (" + str(new) + " new)")
+            for source in sources:
+                count = min(allowance(source, state, options['worker']), options['batch'])
+                if count == 0:
+                    continue
+                subs = stalesubs(source, count, options['maxage'])
+                if not subs:
+                    continue
+                totals = refreshsource(source, subs, options['workers'])
+                # save progress after every batch so a restart resumes here
+                state['used'][source] = state['used'].get(source, 0) + len(subs)
+                state['last'] = {'source': source, 'substance': subs[-1][0], 'time': str(datetime.now())}
+                for k, v in totals.items():
+                    state['totals'][k] = state['totals'].get(k, 0) + v
+                savestate(state)
+                done += len(subs)
+                self.stdout.write(source + ": refreshed " + str(len(subs)) + " substances " + str(totals))
+            if done == 0:
+                if not options['worker']:
+                    break
+                time.sleep(options['sleep'])
+        self.stdout.write("refresh finished " + json.dumps(state['used']))
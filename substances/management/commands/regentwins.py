@@ -0,0 +1,120 @@
+""" regenerate the chemtwins (substance JSON-LD files) of many substances """
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import OuterRef, Subquery
+from substances.sub_functions import *
+from datafiles.models import JsonFacets, JsonLookupSubstances
+from workflow.jena_functions import jenaadd
+from workflow.admin_functions import uploadfile
+from concurrent.futures import ProcessPoolExecutor
+import django
+import os
+
+# compiled substance template (set in each worker process by twininit)
+twintmpl = None
+
+
+def twininit(tmpl):
+    """ save the template in a worker process (so it is only sent once) """
+    global twintmpl
+    django.setup()  # needed when processes are spawned not forked
+    twintmpl = tmpl
+
+
+def buildtwin(item):
+    """ create the JSON-LD file of a substance in a worker process """
+    substance, ids, descs, sdf = item
+    try:
+        return substance, buildsubjld(twintmpl, substance, ids, descs, sdf), None
+    except Exception as exception:
+        return substance, None, str(exception)
+
+
+def loadtwin(sub, upload):
+    """ load a chemtwin into the graph (and upload it) as in newjld """
+    luid = str(sub.facet_lookup_id).zfill(8)
+    result = jenaadd("https://sds.coas.unf.edu/sciflow/files/facet/" + luid, '', 'chemtwin')
+    if upload:
+        lpath = 'uploads/tranche/chalklab/chemtwin/' + sub.inchikey + '.jsonld'
+        uploadfile('https://sds.coas.unf.edu/sciflow/files/facet/', lpath, sub.id)
+    return result
+
+
+def selectsubs(options, tmpl):
+    """ get the ids of the substances selected by the command options """
+    subs = Substances.objects.exclude(inchikey=None)
+    if options['ids']:
+        parts = options['ids'].split('-')
+        if len(parts) == 2:
+            subs = subs.filter(id__gte=int(parts[0]), id__lte=int(parts[1]))
+        else:
+            subs = subs.filter(id__in=[int(x) for x in options['ids'].split(',')])
+    if options['dataset']:
+        name = options['dataset']
+        viafiles = JsonLookupSubstances.objects.filter(json_lookup__dataset__datasetname=name)\
+            .values_list('substance_id', flat=True)
+        viafacets = JsonFacets.objects.filter(json_lookup__dataset__datasetname=name)\
+            .values_list('facet_lookup_id', flat=True)
+        subs = subs.filter(Q(id__in=viafiles) | Q(facet_lookup_id__in=viafacets))
+    if options['stale']:
+        # no file, or the latest file is older than the template or the substance
+        last = FacetFiles.objects.filter(facet_lookup_id=OuterRef('facet_lookup_id')).order_by('-version')
+        subs = subs.annotate(lastfile=Subquery(last.values('updated')[:1]))
+        subs = subs.filter(Q(lastfile=None) | Q(lastfile__lt=tmpl['updated']) | Q(lastfile__lt=F('updated')))
+    return list(subs.order_by('id').values_list('id', flat=True))
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the chemtwins of a selection of substances (all, stale, by dataset or by id)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='all substances')
+        parser.add_argument('--stale', action='store_true', help='substances with a chemtwin older than the template')
+        parser.add_argument('--dataset', help='substances in a dataset (datasetname)')
+        parser.add_argument('--ids', help='substance id range (e.g. 100-200) or comma separated ids')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes creating chemtwins')
+        parser.add_argument('--batch', type=int, default=500, help='chemtwins saved per transaction')
+        parser.add_argument('--loaders', type=int, default=4, help='chemtwins loaded into the graph at the same time')
+        parser.add_argument('--noload', action='store_true', help='do not load the chemtwins into the graph')
+        parser.add_argument('--upload', action='store_true', help='also upload the chemtwins (see uploadfile)')
+
+    def handle(self, *args, **options):
+        if not (options['all'] or options['stale'] or options['dataset'] or options['ids']):
+            raise CommandError("select substances with --all, --stale, --dataset or --ids")
+        tmpl = gettemplate("substance", "substance")
+        subids = selectsubs(options, tmpl)
+        self.stdout.write("regenerating " + str(len(subids)) + " chemtwins")
+
+        # the worker processes must not share the database connections
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=twininit, initargs=(tmpl,))
+        loader = ThreadPoolExecutor(max_workers=options['loaders'])
+        loads, errors, saved = [], {}, 0
+        for i in range(0, len(subids), options['batch']):
+            items = twindata(subids[i:i + options['batch']])
+            twins = []
+            for sub, jld, error in pool.map(buildtwin, items, chunksize=10):
+                if error:
+                    errors[sub.id] = error
+                else:
+                    twins.append((sub, jld))
+            savetwins(twins)
+            saved += len(twins)
+            # graph loads run in the background while the next batch is created
+            if not options['noload']:
+                for sub, jld in twins:
+                    loads.append((sub.id, loader.submit(loadtwin, sub, options['upload'])))
+            self.stdout.write("saved " + str(saved) + " of " + str(len(subids)) + " chemtwins")
+        pool.shutdown()
+
+        for subid, future in loads:
+            try:
+                result = future.result()
+            except Exception as exception:
+                result = str(exception)
+            if result != "success":
+                errors[subid] = "graph load failed: " + str(result)
+        loader.shutdown()
+        for subid, error in errors.items():
+            self.stderr.write("substance " + str(subid) + ": " + error)
+        self.stdout.write("regenerated " + str(saved) + " chemtwins (" + str(len(errors)) + " errors)")
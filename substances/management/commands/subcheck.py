@@ -0,0 +1,31 @@
+""" check the substances table against the identifiers table """
+from django.core.management.base import BaseCommand
+from substances.chk_functions import subchecks, checkerrors
+import json
+
+
+class Command(BaseCommand):
+    help = 'Check the InChIKeys and CASRNs of the substances against the identifiers table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('checks', nargs='*', default=list(subchecks), help='checks to run ' + str(list(subchecks)))
+        parser.add_argument('--json', help='write the problems to this file (one per line)')
+        parser.add_argument('--quiet', action='store_true', help='only show the number of problems')
+
+    def handle(self, *args, **options):
+        out = open(options['json'], 'w') if options['json'] else None
+        for action in options['checks']:
+            if action not in subchecks:
+                self.stderr.write("unknown check '" + action + "'")
+                continue
+            count = 0
+            # problems are streamed from the database (not loaded all at once)
+            for problem in checkerrors(action):
+                count += 1
+                if out:
+                    out.write(json.dumps(problem) + "\n")
+                if not options['quiet']:
+                    self.stdout.write(problem['error'])
+            self.stdout.write(action + ": " + str(count) + " problems")
+        if out:
+            out.close()
@@ -0,0 +1,33 @@
+""" report the substances that share an InChIKey skeleton (possible duplicates) """
+from django.core.management.base import BaseCommand
+from substances.skel_functions import alldups
+import json
+
+
+class Command(BaseCommand):
+    help = 'Report the substances that share an InChIKey skeleton (stereoisomers, isotopologues, duplicates)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--protonation', action='store_true', help='group by the protonation flag as well')
+        parser.add_argument('--exact', action='store_true', help='only report groups with identical InChIKeys')
+        parser.add_argument('--json', help='write the report to this file (one group per line)')
+
+    def handle(self, *args, **options):
+        out = open(options['json'], 'w') if options['json'] else None
+        groups = 0
+        subs = 0
+        for group in alldups(options['protonation']):
+            if options['exact']:
+                group['substances'] = [s for s in group['substances'] if s['variant'] == 'duplicate']
+                if len(group['substances']) < 2:
+                    continue
+            groups += 1
+            subs += len(group['substances'])
+            if out:
+                out.write(json.dumps(group) + "\n")
+            else:
+                self.stdout.write(group['skeleton'] + ": " + ", ".join(
+                    str(s['id']) + " " + s['inchikey'] + " (" + s['variant'] + ")" for s in group['substances']))
+        if out:
+            out.close()
+        self.stdout.write(str(groups) + " groups (" + str(subs) + " substances)")
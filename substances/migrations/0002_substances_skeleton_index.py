@@ -0,0 +1,58 @@
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+# index of the InChIKey skeleton (connectivity block) and protonation flag
+# used to group stereoisomers/isotopologues (see skel_functions). The
+# substances table is not managed by django so the index is added here
+indexname = 'substances_inchikey_skel'
+
+
+def hastable(schema_editor, model):
+    """ check if the table of an unmanaged model exists (it is not created on a new database) """
+    return model._meta.db_table in schema_editor.connection.introspection.table_names()
+
+
+def skelindex(connection):
+    """ expression index if the database supports it, otherwise an index of the whole InChIKey """
+    if connection.features.supports_expression_indexes:
+        return models.Index(Substr('inchikey', 1, 14), Substr('inchikey', 27, 1), name=indexname)
+    return models.Index(fields=['inchikey'], name=indexname)
+
+
+def addindex(apps, schema_editor):
+    model = apps.get_model('substances', 'Substances')
+    if hastable(schema_editor, model):
+        schema_editor.add_index(model, skelindex(schema_editor.connection))
+
+
+def removeindex(apps, schema_editor):
+    model = apps.get_model('substances', 'Substances')
+    if hastable(schema_editor, model):
+        schema_editor.remove_index(model, skelindex(schema_editor.connection))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substances', '0001_initial'),
+    ]
+
+    operations = [
+        # fields added to the (unmanaged) table since 0001 - only changes the migration state
+        migrations.AddField(
+            model_name='substances',
+            name='inchikey',
+            field=models.CharField(max_length=27, null=True),
+        ),
+        migrations.AddField(
+            model_name='substances',
+            name='lastcheck',
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='substances',
+            name='available',
+            field=models.CharField(default='yes', max_length=3),
+        ),
+        migrations.RunPython(addindex, removeindex),
+    ]
@@ -0,0 +1,213 @@
+""" functions to read molfiles/SDF files (V2000 and V3000) into arrays """
+from substances.models import Structures
+from functools import lru_cache
+import numpy as np
+import json
+import os
+
+# V2000 atom block charge codes (4 is a doublet radical, not a charge)
+chgcodes = {0: 0, 1: 3, 2: 2, 3: 1, 4: 0, 5: -1, 6: -2, 7: -3}
+chgtable = np.array([chgcodes[code] for code in range(8)], dtype=np.int8)
+
+
+@lru_cache(maxsize=None)
+def periodictable():
+    """
+    load the periodic table (static/files/elements.json) once into arrays
+    indexed by atomic number (index 0 is used for unknown atoms, e.g. R, *)
+    :return dictionary of column name -> numpy array (and 'index' symbol -> atomic number)
+    """
+    basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(basedir + '/static/files/elements.json') as f:
+        j = json.load(f)
+    fields = j['Table']['Columns']['Column']
+    rows = [[''] * len(fields)] + [row['Cell'] for row in j['Table']['Row']]
+    table = {}
+    for i, field in enumerate(fields):
+        table[field] = np.array([row[i] for row in rows], dtype=object)
+    table['index'] = {symbol: z for z, symbol in enumerate(table['Symbol']) if symbol}
+    return table
+
+
+def parsemol(text):
+    """
+    parse a molfile (V2000 or V3000) into arrays
+    :param text: molfile (or a single SDF record)
+    :return dictionary with 'coords' (atoms x 3 float array), 'elements'
+    (atomic numbers), 'charges' (int array), 'bonds' (bonds x 3 int array of
+    atom1, atom2, order - atoms numbered from 1), 'symbols' (list of atom
+    symbols), 'name' (first line) and 'version' (V2000/V3000)
+    """
+    lines = text.splitlines()
+    if len(lines) < 4:
+        raise ValueError("Not a molfile (no counts line)")
+    if 'V3000' in lines[3]:
+        mol = parsev3000(lines)
+    else:
+        mol = parsev2000(lines)
+    # look up each different symbol once
+    index = periodictable()['index']
+    uniq, inv = np.unique(np.array(mol['symbols'], dtype=str), return_inverse=True)
+    mol['elements'] = np.array([index.get(s, 0) for s in uniq], dtype=np.int16)[inv].reshape(-1)
+    mol['name'] = lines[0].strip()
+    return mol
+
+
+def columns(lines, width):
+    """ fixed width lines as a (lines x width) array of single bytes """
+    buf = ''.join([ln[:width].ljust(width) for ln in lines]).encode('ascii', 'replace')
+    return np.frombuffer(buf, dtype='S1').reshape(-1, width)
+
+
+def column(table, start, end):
+    """ one column (characters start to end) of a table from columns() """
+    return np.ascontiguousarray(table[:, start:end]).view('S' + str(end - start)).ravel()
+
+
+def parsev2000(lines):
+    """ parse the atom, bond and property blocks of a V2000 molfile (by column) """
+    natoms, nbonds = int(lines[3][0:3]), int(lines[3][3:6])
+    alines = lines[4:4 + natoms]
+    blines = lines[4 + natoms:4 + natoms + nbonds]
+    if len(alines) != natoms or len(blines) != nbonds:
+        raise ValueError("Molfile is truncated")
+    atab = columns(alines, 39)
+    coords = np.stack([column(atab, i, i + 10).astype(float) for i in (0, 10, 20)], axis=1)
+    symbols = np.char.strip(column(atab, 31, 34)).astype(str).tolist()
+    codes = np.char.strip(column(atab, 36, 39))
+    codes[codes == b''] = b'0'
+    charges = chgtable[codes.astype(np.int8).clip(0, 7)]
+    btab = columns(blines, 9)
+    bonds = np.stack([column(btab, i, i + 3).astype(np.int32) for i in (0, 3, 6)], axis=1)
+
+    # charges in 'M  CHG' lines replace all those in the atom block
+    chglines = [ln for ln in lines[4 + natoms + nbonds:] if ln.startswith('M  CHG')]
+    if chglines:
+        charges[:] = 0
+        for ln in chglines:
+            for i in range(int(ln[6:9])):
+                start = 9 + i * 8
+                charges[int(ln[start:start + 4]) - 1] = int(ln[start + 4:start + 8])
+    return {'coords': coords, 'symbols': symbols, 'charges': charges, 'bonds': bonds, 'version': 'V2000'}
+
+
+def parsev3000(lines):
+    """ parse the atom and bond blocks of a V3000 molfile """
+    # join continuation lines (ending in '-') and remove the 'M  V30 ' prefix
+    v30 = []
+    for ln in lines:
+        if not ln.startswith('M  V30 '):
+            continue
+        if v30 and v30[-1].endswith('-'):
+            v30[-1] = v30[-1][:-1] + ln[7:]
+        else:
+            v30.append(ln[7:])
+    block = None
+    atoms, bonds = [], []
+    for ln in v30:
+        if ln.startswith('BEGIN '):
+            block = ln.split()[1]
+        elif ln.startswith('END '):
+            block = None
+        elif block == 'ATOM':
+            atoms.append(ln.split())
+        elif block == 'BOND':
+            bonds.append(ln.split()[1:4])
+    coords = np.array([atom[2:5] for atom in atoms], dtype=float).reshape(-1, 3)
+    symbols = [atom[1] for atom in atoms]
+    charges = np.zeros(len(atoms), dtype=np.int8)
+    for i, atom in enumerate(atoms):
+        for prop in atom[6:]:
+            if prop.startswith('CHG='):
+                charges[i] = int(prop[4:])
+    # bonds are listed as type, atom1, atom2
+    bonds = np.array([(b[1], b[2], b[0]) for b in bonds], dtype=np.int32).reshape(-1, 3)
+    return {'coords': coords, 'symbols': symbols, 'charges': charges, 'bonds': bonds, 'version': 'V3000'}
+
+
+def parsesdf(text):
+    """
+    parse all the records in an SDF file
+    :param text: SDF file contents
+    :return list of dictionaries (see parsemol)
+    """
+    mols = []
+    for i, record in enumerate(text.split('$$$$')):
+        # remove the end of the $$$$ line of the previous record (the first
+        # line of a molfile - the title - can be blank)
+        if i > 0:
+            record = record[1:] if record.startswith('\n') else record
+            record = record[2:] if record.startswith('\r\n') else record
+        if record.strip():
+            mols.append(parsemol(record))
+    return mols
+
+
+def structuremol(subid):
+    """
+    parse the molfile of a substance in the structures table
+    :param subid: substance id
+    :return dictionary (see parsemol) or None if the substance has no structure
+    """
+    struc = Structures.objects.filter(substance_id=subid).order_by('-updated').first()
+    if struc is None:
+        return None
+    return parsemol(struc.molfile)
+
+
+def molgraph(mol):
+    """
+    create the elements, atoms and bonds sections of the molgraph of a
+    substance JSON-LD file in one pass over arrays from parsemol
+    :param mol: dictionary from parsemol (or None for an empty molgraph)
+    :return dictionary with 'elements', 'atoms', 'bonds' and 'chebi' (ChEBI ids of the elements)
+    """
+    graph = {'elements': [], 'atoms': [], 'bonds': [], 'chebi': []}
+    if mol is None or len(mol['symbols']) == 0:
+        return graph
+    table = periodictable()
+    natoms = len(mol['symbols'])
+    bonds = mol['bonds']
+
+    # elements in the order they first appear in the atoms
+    symbols, first, inv = np.unique(np.array(mol['symbols'], dtype=str), return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order))
+    eidx = rank[inv.reshape(-1)] + 1
+    for i, j in enumerate(order):
+        z = table['index'].get(str(symbols[j]), 0)
+        # unknown symbols are False (as elementdata)
+        name = table['Name'][z] if z else False
+        chebi = table['ChEBI'][z] if z else False
+        graph['chebi'].append(chebi)
+        graph['elements'].append({"@id": "element/" + str(i + 1) + "/", "@type": "obo:NCIT_C1940",
+                                  "name": name, "element": chebi})
+
+    # number of single, double and triple bonds of each atom
+    counts = np.zeros((natoms + 1, 4), dtype=np.int32)
+    if len(bonds):
+        valid = (bonds[:, 2] >= 1) & (bonds[:, 2] <= 3)
+        np.add.at(counts, (bonds[valid, 0], bonds[valid, 2]), 1)
+        np.add.at(counts, (bonds[valid, 1], bonds[valid, 2]), 1)
+    counts = counts.tolist()
+
+    coords = ['%.4f' % c for c in mol['coords'].ravel()]
+    charges = mol['charges'].tolist()
+    eidx = eidx.tolist()
+    bondnames = [None, "singlebonds", "doublebonds", "triplebonds"]
+    for i in range(natoms):
+        idx = str(i + 1)
+        atm = {"@id": "atom/" + idx + "/", "@type": "obo:CHEBI_33250", "element": "element/" + str(eidx[i]) + "/",
+               "xcoord": coords[i * 3], "ycoord": coords[i * 3 + 1], "zcoord": coords[i * 3 + 2]}
+        for o in (1, 2, 3):
+            if counts[i + 1][o]:
+                atm[bondnames[o]] = counts[i + 1][o]
+        if charges[i]:
+            atm["charge"] = str(charges[i])
+        graph['atoms'].append(atm)
+
+    for i, (a1, a2, o) in enumerate(bonds.tolist()):
+        graph['bonds'].append({"@id": "bond/" + str(i + 1) + "/", "@type": "ss:SIO_011118", "order": str(o),
+                               "atoms": ["atom/" + str(a1) + "/", "atom/" + str(a2) + "/"]})
+    return graph
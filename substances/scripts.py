@@ -24,7 +24,7 @@ def addsub(key):
     else:
         fid = sub.graphdb.replace('https://scidata.unf.edu/facet/','')
         facet = FacetFiles.objects.filter(facet_lookup_id=fid).order_by('-version')[0]
-        f.write(facet.file)
+        f.write(facet.content)
     f.close()
     print(sub.graphdb)
 
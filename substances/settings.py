@@ -0,0 +1,70 @@
+""" settings for the substances app """
+import os
+
+# external sources of substance data (in the order their data is merged)
+subsources = ['pubchem', 'classyfire', 'wikidata', 'chembl', 'comchem']
+
+# time (in seconds) to wait for each source before giving up on it
+subtimeouts = {'pubchem': 30, 'classyfire': 30, 'wikidata': 45, 'chembl': 60, 'comchem': 30}
+
+# bulk ingestion (addsubstances): substances saved per transaction and
+# number of substances fetched from the sources at the same time
+subchunk = 100
+subworkers = 4
+# sources that can be searched for many inchikeys in one request and the
+# number of inchikeys sent in each request
+subbatch = {'pubchem': 200, 'wikidata': 200, 'chembl': 100}
+
+# scheduled refresh of substance data (manage.py refreshsubs)
+# maximum number of substances refreshed from each source per day
+refreshbudget = {'pubchem': 5000, 'classyfire': 1000, 'wikidata': 2000, 'chembl': 2000, 'comchem': 1000}
+# substances are only refreshed from a source if not checked for this many days
+refreshage = 90
+# number of substances refreshed (and progress saved) at a time
+refreshbatch = 20
+# file where the progress of the refresh is saved
+refreshstate = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'refresh.json')
+
+# identifier -> substance index (idx_functions)
+# maximum number of identifier values kept in memory (least recently used are removed)
+idxsize = 200000
+# identifier types loaded when the index is built (others are added when looked up)
+idxtypes = ['inchikey', 'casrn', 'chembl', 'dsstox']
+
+# identifier resolution API (views.resolveapi)
+# maximum number of identifiers in a request
+resolvemax = 10000
+# file where unknown identifiers are queued to be added (by manage.py refreshsubs)
+resolvequeue = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'queue.jsonl')
+# maximum number of identifiers in the queue (only logged in users can add to it)
+queuemax = 50000
+
+# substance search index (srch_functions, built with manage.py buildsearch)
+# identifier types not added to the index (not useful to search by words)
+searchskip = ['inchi', 'csmiles', 'ismiles']
+# number of results per page
+searchpage = 20
+
+# structure fingerprint index (fp_functions, built with manage.py buildfps)
+# directory of the fingerprint files
+fppath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'fp')
+# morgan fingerprint radius and size (bits) and pattern (substructure screen) size
+fpradius = 2
+fpbits = 2048
+fppatbits = 2048
+# substances added/updated since the last build are kept in a small delta
+# index which is merged into the main index when it has this many substances
+fpmerge = 5000
+
+# duplicate report (skel_functions, manage.py subdups)
+# number of InChIKey skeleton groups per page
+dupspage = 50
+
+# substance checks (chk_functions, manage.py subcheck)
+# number of problems per page
+checkspage = 100
+
+# 3D models and 2D depictions of substances (img_functions)
+# directory where they are saved and size of the depictions (pixels)
+imgpath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'img')
+imgsize = 300
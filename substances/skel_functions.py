@@ -0,0 +1,117 @@
+""" group substances by InChIKey skeleton (connectivity block) to find variants and duplicates """
+from django.core.paginator import Paginator
+from django.db.models import Count
+from django.db.models.functions import Substr
+from substances.models import Substances
+from substances.settings import dupspage
+
+# an InChIKey is <connectivity (14)>-<stereo/isotope (8), standard flag, version>-<protonation>
+# the skeleton expressions below match the index added in migration 0002
+skelexpr = Substr('inchikey', 1, 14)
+protexpr = Substr('inchikey', 27, 1)
+
+
+def skeleton(inchikey):
+    """ connectivity block (first 14 characters) of an InChIKey """
+    return inchikey[:14] if inchikey else None
+
+
+def variantof(inchikey, other):
+    """
+    how an InChIKey with the same skeleton differs from another
+    :return 'duplicate' (same InChIKey), 'protonation' (only the protonation
+    flag differs) or 'stereo/isotope' (second block differs)
+    """
+    if inchikey == other:
+        return 'duplicate'
+    if inchikey[15:25] == other[15:25]:
+        return 'protonation'
+    return 'stereo/isotope'
+
+
+def skelsubs():
+    """ substances (with an InChIKey) annotated with the skeleton and protonation flag """
+    return Substances.objects.exclude(inchikey=None).annotate(skeleton=skelexpr, protonation=protexpr)
+
+
+def subvariants(subid):
+    """
+    get the other substances with the same InChIKey skeleton as a substance
+    (stereoisomers, isotopologues, protonation states and duplicates)
+    :param subid: substance id
+    :return tuple of the substance and a list of dictionaries (id, name, inchikey, variant)
+    """
+    sub = Substances.objects.get(id=subid)
+    if not sub.inchikey:
+        return sub, []
+    rows = skelsubs().filter(skeleton=skeleton(sub.inchikey)).exclude(id=sub.id).\
+        order_by('inchikey').values('id', 'name', 'inchikey')
+    variants = []
+    for row in rows:
+        row['variant'] = variantof(sub.inchikey, row['inchikey'])
+        variants.append(row)
+    return sub, variants
+
+
+def dupgroups(protonation=False, minsize=2):
+    """
+    grouped query of the InChIKey skeletons shared by more than one substance
+    :param protonation: group by the protonation flag as well as the skeleton
+    :param minsize: minimum number of substances in a group
+    :return queryset of dictionaries (skeleton, [protonation,] count), largest first
+    """
+    fields = ['skeleton', 'protonation'] if protonation else ['skeleton']
+    return skelsubs().values(*fields).annotate(count=Count('id')).filter(count__gte=minsize).\
+        order_by('-count', *fields)
+
+
+def dupmembers(groups, protonation=False):
+    """
+    add the substances in each group from dupgroups (one query for all the groups)
+    :param groups: list of group dictionaries
+    :param protonation: groups include the protonation flag
+    :return the groups with a 'substances' list of dictionaries (id, name, inchikey, variant) where
+    variant is 'duplicate' (InChIKey shared with another substance in the group), 'protonation'
+    (only the protonation flag differs from another) or 'stereo/isotope'
+    """
+    groups = [dict(group, substances=[]) for group in groups]
+    lookup = {}
+    for group in groups:
+        lookup[(group['skeleton'], group.get('protonation'))] = group
+    rows = skelsubs().filter(skeleton__in=set(g['skeleton'] for g in groups)).\
+        order_by('inchikey', 'id').values('id', 'name', 'inchikey', 'skeleton', 'protonation')
+    for row in rows:
+        group = lookup.get((row['skeleton'], row['protonation'] if protonation else None))
+        if group is not None:
+            group['substances'].append({'id': row['id'], 'name': row['name'], 'inchikey': row['inchikey']})
+    for group in groups:
+        keys = [sub['inchikey'] for sub in group['substances']]
+        blocks = [key[:25] for key in keys]
+        for sub in group['substances']:
+            if keys.count(sub['inchikey']) > 1:
+                sub['variant'] = 'duplicate'
+            elif blocks.count(sub['inchikey'][:25]) > 1:
+                sub['variant'] = 'protonation'
+            else:
+                sub['variant'] = 'stereo/isotope'
+    return groups
+
+
+def dupreport(page=1, protonation=False, size=dupspage):
+    """
+    one page of the duplicate report (substances that share an InChIKey skeleton)
+    :param page: page number
+    :param protonation: group by the protonation flag as well as the skeleton
+    :param size: number of groups per page
+    :return tuple of the paginator page and the groups on the page (see dupmembers)
+    """
+    page_obj = Paginator(dupgroups(protonation), size).get_page(page)
+    return page_obj, dupmembers(page_obj.object_list, protonation)
+
+
+def alldups(protonation=False, chunk=1000):
+    """ generator of all the groups in the duplicate report (members found a chunk of groups at a time) """
+    groups = dupgroups(protonation)
+    for start in range(0, groups.count(), chunk):
+        for group in dupmembers(groups[start:start + chunk], protonation):
+            yield group
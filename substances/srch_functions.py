@@ -0,0 +1,185 @@
+""" full text search index of substance names and identifier values """
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from substances.models import Substances, Identifiers
+from substances.settings import searchskip
+import re
+
+# the index is an FTS5 table on SQLite and a token table on other databases
+# (MySQL FULLTEXT ignores the short tokens in CASRNs and InChIKeys)
+ftstable = 'search_fts'
+toktable = 'search_tokens'
+searchstate = {}
+
+
+def usefts():
+    """ check if the database supports SQLite FTS5 """
+    return connection.vendor == 'sqlite'
+
+
+def searchready():
+    """
+    check if the search index has been built. Only a built index is remembered
+    as it can be built (manage.py buildsearch) while this process is running
+    """
+    if not searchstate.get('ready'):
+        table = ftstable if usefts() else toktable
+        searchstate['ready'] = table in connection.introspection.table_names()
+    return searchstate['ready']
+
+
+def tokens(text):
+    """ split text into (casefolded) search tokens """
+    return [t[:64] for t in re.findall(r'[^\W_]+', str(text).casefold())]
+
+
+def searchcreate():
+    """ create (or empty) the search index table """
+    with connection.cursor() as cursor:
+        if usefts():
+            cursor.execute("DROP TABLE IF EXISTS " + ftstable)
+            cursor.execute("CREATE VIRTUAL TABLE " + ftstable + " USING fts5(value, substance_id UNINDEXED)")
+        else:
+            cursor.execute("DROP TABLE IF EXISTS " + toktable)
+            cursor.execute("CREATE TABLE " + toktable + " (token VARCHAR(64) NOT NULL, substance_id INT NOT NULL, "
+                           "PRIMARY KEY (token, substance_id), KEY substance_id (substance_id))")
+    searchstate['ready'] = True
+
+
+def searchrows(subids=None):
+    """ get the (substance id, text) rows to index (all substances if subids is None) """
+    subs = Substances.objects.all()
+    idents = Identifiers.objects.exclude(type__in=searchskip)
+    if subids is not None:
+        subs = subs.filter(id__in=subids)
+        idents = idents.filter(substance_id__in=subids)
+    for subid, name in subs.values_list('id', 'name').iterator(chunk_size=10000):
+        if name:
+            yield subid, name
+    for subid, value in idents.values_list('substance_id', 'value').iterator(chunk_size=10000):
+        yield subid, value
+
+
+def searchinsert(rows):
+    """ add (substance id, text) rows to the search index """
+    with connection.cursor() as cursor:
+        batch = []
+        for subid, text in rows:
+            if usefts():
+                batch.append((text, subid))
+            else:
+                batch.extend([(token, subid) for token in set(tokens(text))])
+            if len(batch) >= 5000:
+                searchwrite(cursor, batch)
+                batch = []
+        if batch:
+            searchwrite(cursor, batch)
+
+
+def searchwrite(cursor, batch):
+    """ write a batch of rows to the search index table """
+    if usefts():
+        cursor.executemany("INSERT INTO " + ftstable + " (value, substance_id) VALUES (%s, %s)", batch)
+    else:
+        # duplicate tokens of a substance are ignored
+        cursor.executemany("INSERT IGNORE INTO " + toktable + " (token, substance_id) VALUES (%s, %s)", batch)
+
+
+def searchbuild():
+    """ create the search index for all substances """
+    with transaction.atomic():
+        searchcreate()
+        searchinsert(searchrows())
+
+
+def searchupdate(subids):
+    """ index substances again after their name or identifiers changed """
+    if not searchready():
+        return
+    subids = list(set(subids))
+    if not subids:
+        return
+    table = ftstable if usefts() else toktable
+    with connection.cursor() as cursor:
+        for i in range(0, len(subids), 500):
+            chunk = subids[i:i + 500]
+            cursor.execute("DELETE FROM " + table + " WHERE substance_id IN (" + ",".join(["%s"] * len(chunk)) + ")",
+                           chunk)
+    searchinsert(searchrows(subids))
+
+
+def searchids(query, offset=0, limit=20):
+    """
+    find substances whose name or identifiers contain all the words in a
+    query (the last word can be the start of a word) ordered by relevance
+    :param query: search text
+    :param offset: number of results to skip
+    :param limit: maximum number of results
+    :return tuple of (list of substance ids, total number of results)
+    """
+    words = tokens(query)
+    if not words:
+        return [], 0
+    with connection.cursor() as cursor:
+        if usefts():
+            # all tokens (as prefixes) in any order, ranked by bm25 (rank)
+            match = " AND ".join(['"' + word + '"*' for word in words])
+            inner = "SELECT substance_id, MIN(score) AS score FROM (SELECT substance_id, rank AS score FROM " + \
+                    ftstable + " WHERE " + ftstable + " MATCH %s) AS hits GROUP BY substance_id"
+            params = [match]
+            order = "score ASC"
+        else:
+            # each query word must match a token (exact matches score higher)
+            parts, params = [], []
+            for i, word in enumerate(words):
+                parts.append("SELECT substance_id, " + str(i) + " AS word, MAX(CASE WHEN token = %s THEN 2 ELSE 1 END) "
+                             "AS score FROM " + toktable + " WHERE token LIKE %s GROUP BY substance_id")
+                params.extend([word, word.replace('_', '\\_') + '%'])
+            inner = "SELECT substance_id, SUM(score) AS score FROM (" + " UNION ALL ".join(parts) + ") AS hits " \
+                    "GROUP BY substance_id HAVING COUNT(*) = " + str(len(words))
+            order = "score DESC"
+        cursor.execute("SELECT COUNT(*) FROM (" + inner + ") AS results", params)
+        total = cursor.fetchone()[0]
+        sql = "SELECT substance_id FROM (" + inner + ") AS results ORDER BY " + order + ", substance_id"
+        cursor.execute(sql + " LIMIT %s OFFSET %s", params + [limit, offset])
+        subids = [row[0] for row in cursor.fetchall()]
+    return subids, total
+
+
+class SearchResults:
+    """ lazy list of the substances found by a search (for use with Paginator) """
+
+    def __init__(self, query):
+        self.query = query
+        self.total = None
+
+    def count(self):
+        if self.total is None:
+            self.total = searchids(self.query, 0, 1)[1]
+        return self.total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        subids, self.total = searchids(self.query, start, max(stop - start, 0))
+        subs = Substances.objects.in_bulk(subids)
+        return [subs[subid] for subid in subids if subid in subs]
+
+
+@receiver(post_save, sender=Identifiers)
+@receiver(post_delete, sender=Identifiers)
+def searchidentifier(sender, instance, **kwargs):
+    """ an identifier was saved/deleted so index its substance again """
+    searchupdate([instance.substance_id])
+
+
+@receiver(post_save, sender=Substances)
+def searchsubstance(sender, instance, **kwargs):
+    """ a substance was saved (its name may have changed) so index it again """
+    searchupdate([instance.id])
@@ -1,15 +1,31 @@
 """ functions for use with the substances and related tables..."""
-from django.db.models import Q
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F, Max, Q
 from substances.external import *
 from substances.models import *
+from substances.settings import *
+from substances.mol_functions import *
+from substances.tmpl_functions import *
+from substances.idx_functions import *
+from substances.srch_functions import *
+from substances.fp_functions import *
+from substances.skel_functions import *
+from substances.chk_functions import *
+from substances.img_functions import *
 from contexts.models import *
-from datetime import datetime, date
+from datafiles.models import FacetLookup, FacetFiles
+from datafiles.df_functions import saveblobs
+from datetime import datetime, date, timedelta
 from workflow.log_functions import *
 from inspect import currentframe, getframeinfo
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import numpy as np
 import json
 import os
 import random
 import string
+import time
 import re
 
 dt = date.today()
@@ -27,13 +43,12 @@ def addsubstance(identifier, output='meta'):
     """
 
     # check for substance in the database
-    found = Identifiers.objects.values().filter(value=identifier).values_list('value', 'substance_id')
-    found = dict(found)
-    if found:
-        meta = Substances.objects.get(id=found[identifier])
-        ids = Identifiers.objects.values().filter(substance_id=found[identifier])
-        descs = Descriptors.objects.values().filter(substance_id=found[identifier])
-        srcs = Sources.objects.values().filter(substance_id=found[identifier])
+    subid = resolve(identifier)
+    if subid:
+        meta = Substances.objects.get(id=subid)
+        ids = Identifiers.objects.values().filter(substance_id=subid)
+        descs = Descriptors.objects.values().filter(substance_id=subid)
+        srcs = Sources.objects.values().filter(substance_id=subid)
         if output == 'all':
             return meta, ids, descs, srcs
         else:
@@ -55,6 +70,45 @@ def addsubstance(identifier, output='meta'):
     meta, ids, descs, srcs = getsubdata(key)
 
     # save metadata to the substances table
+    frameinfo = getframeinfo(currentframe())
+    print("saving substance " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+    sub = newsubstance(key, meta, ids)
+    sub.save()
+    subid = sub.id
+
+    frameinfo = getframeinfo(currentframe())
+    print("saving identifiers " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+    # save ids to the identifiers table
+    saveids(subid, ids)
+
+    frameinfo = getframeinfo(currentframe())
+    print("saving descriptors " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+    # save descs to the descriptors table
+    savedescs(subid, descs)
+
+    # savesrcs to sources table
+    frameinfo = getframeinfo(currentframe())
+    print("saving sources " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+    savesrcs(subid, srcs)
+
+    print(meta)
+
+    if not meta:
+        meta = False
+
+    if output == 'all':
+        return meta, ids, descs, srcs
+    elif output == 'sub':
+        return sub
+    else:
+        return meta
+
+
+def newsubstance(key, meta, ids):
+    """
+    create (but not save) an entry for the substances table using the data
+    found for the substance in the external sources
+    """
     fm = 'unknown'
     nm = 'unknown'
     mw = 0
@@ -84,40 +138,153 @@ def addsubstance(identifier, output='meta'):
         if "casrn" in ids['wikidata']:
             casrn = ids['wikidata']['casrn']
 
-    frameinfo = getframeinfo(currentframe())
-    print("saving substance " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
     sub = Substances(name=nm, formula=fm, molweight=mw, monomass=mm, casrn=casrn, inchikey=key, lastcheck=date.today())
-    sub.save()
-    subid = sub.id
+    if not meta:
+        sub.available = 'no'
+    return sub
 
-    frameinfo = getframeinfo(currentframe())
-    print("saving identifiers " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
-    # save ids to the identifiers table
-    saveids(subid, ids)
 
-    frameinfo = getframeinfo(currentframe())
-    print("saving descriptors " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
-    # save descs to the descriptors table
-    savedescs(subid, descs)
+def subkey(identifier):
+    """find the inchikey for an identifier (using pubchem if needed)"""
+    if getidtype(identifier) != "inchikey":
+        return pubchemsyns(identifier)
+    return identifier
 
-    # savesrcs to sources table
-    frameinfo = getframeinfo(currentframe())
-    print("saving sources " + key + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
-    savesrcs(subid, srcs)
 
-    print(meta)
+def trykey(identifier):
+    """ subkey for the workers of addsubstances - an error gives no key so the other identifiers are still added """
+    try:
+        return subkey(identifier)
+    except Exception as exception:
+        frameinfo = getframeinfo(currentframe())
+        print("no inchikey for '" + str(identifier) + "': " + repr(exception) + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+        return None
 
-    if not meta:
-        sub.available = 'no'
-        sub.save()
-        meta = False
 
-    if output == 'all':
-        return meta, ids, descs, srcs
-    elif output == 'sub':
-        return sub
-    else:
-        return meta
+def fetchsubstance(identifier, key=None, prefetched=None):
+    """find the inchikey for an identifier and get the substance data from the sources"""
+    if key is None:
+        key = subkey(identifier)
+    meta, ids, descs, srcs = getsubdata(key, prefetched=prefetched)
+    return key, meta, ids, descs, srcs
+
+
+def addsubstances(identifiers, chunk=subchunk):
+    """
+    add many substances to the database (see addsubstance). Data for the new
+    substances is fetched (subworkers at a time, batch sources in a few large
+    requests) and saved a chunk of substances at a time using bulk inserts in
+    a single transaction
+    :param identifiers: list of identifiers (any chemical metadata)
+    :param chunk: number of substances saved in each transaction
+    :return dictionary of identifier -> {'id': substance id, 'status': 'present'/'new'/'error'}
+    """
+    output = {}
+    identifiers = list(dict.fromkeys(identifiers))  # deduplicate, keep order
+
+    # substances already in the database
+    for value, subid in idxcheck(resolvemany(identifiers)).items():
+        output[value] = {'id': subid, 'status': 'present'}
+    newids = [x for x in identifiers if x not in output]
+
+    pool = ThreadPoolExecutor(max_workers=subworkers)
+    for i in range(0, len(newids), chunk):
+        batch = newids[i:i + chunk]
+        keys = dict(zip(batch, pool.map(trykey, batch)))
+
+        # the inchikey of a new identifier may already be in the database
+        known = dict(Substances.objects.filter(inchikey__in=[k for k in keys.values() if k])
+                     .values_list('inchikey', 'id'))
+        todo = []
+        for identifier, key in keys.items():
+            if not key:
+                output[identifier] = {'id': False, 'status': 'error'}
+            elif key in known:
+                output[identifier] = {'id': known[key], 'status': 'present'}
+            else:
+                todo.append(identifier)
+
+        frameinfo = getframeinfo(currentframe())
+        print("fetching " + str(len(todo)) + " substances (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+        prefetched = batchsubdata(list(dict.fromkeys([keys[x] for x in todo])))
+        fetched = {}
+        for identifier in todo:
+            key = keys[identifier]
+            fetched[identifier] = pool.submit(fetchsubstance, identifier, key, prefetched.get(key))
+        for identifier, future in list(fetched.items()):
+            try:
+                fetched[identifier] = future.result()
+            except Exception as exception:
+                frameinfo = getframeinfo(currentframe())
+                print("error fetching '" + identifier + "': " + repr(exception) + " (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+                output[identifier] = {'id': False, 'status': 'error'}
+                del fetched[identifier]
+
+        subs = {}
+        for identifier, (key, meta, ids, descs, srcs) in fetched.items():
+            if key not in subs:
+                subs[key] = newsubstance(key, meta, ids)
+
+        frameinfo = getframeinfo(currentframe())
+        print("saving " + str(len(subs)) + " substances (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
+        with transaction.atomic():
+            Substances.objects.bulk_create(subs.values())
+            # bulk_create does not return ids on MySQL so get them by inchikey
+            subids = {}
+            for key, subid in Substances.objects.filter(inchikey__in=subs.keys()).values_list('inchikey', 'id'):
+                subids[key] = subid
+            idents, dscs, sources = [], [], []
+            saved = []
+            for identifier, (key, meta, ids, descs, srcs) in fetched.items():
+                output[identifier] = {'id': subids[key], 'status': 'new'}
+                if key in saved:
+                    continue  # another identifier for the same substance
+                idents.extend(idrows(subids[key], ids))
+                dscs.extend(descrows(subids[key], descs))
+                sources.extend(srcrows(subids[key], srcs))
+                saved.append(key)
+            Identifiers.objects.bulk_create(idents, batch_size=1000)
+            idxaddrows(idents)
+            searchupdate(subids.values())
+            Descriptors.objects.bulk_create(dscs, batch_size=1000)
+            Sources.objects.bulk_create(sources, batch_size=1000)
+        addstructures(subids.values())
+        fpupdate(subids.values())
+    pool.shutdown()
+
+    return output
+
+
+def subsdfs(subids):
+    """
+    get the PubChem SDFs for many substances (a few requests for all of them)
+    :param subids: list of substance ids
+    :return dictionary of substance id -> SDF (substances without one are left out)
+    """
+    pcids = dict(Identifiers.objects.filter(substance_id__in=subids, type='pubchem', source='pubchem')
+                 .values_list('substance_id', 'value'))
+    sdfs = pubchemsdfs(pcids.values(), subbatch.get('pubchem', 200))
+    return {subid: sdfs[str(pcid)] for subid, pcid in pcids.items() if str(pcid) in sdfs}
+
+
+def addstructures(subids):
+    """
+    add the PubChem molfiles of substances to the structures table
+    (substances that already have a structure are skipped)
+    :param subids: list of substance ids
+    :return number of structures added
+    """
+    done = Structures.objects.filter(substance_id__in=subids).values_list('substance_id', flat=True)
+    todo = set(subids) - set(done)
+    if not todo:
+        return 0
+    strucs = []
+    for subid, sdf in subsdfs(todo).items():
+        # the molfile is the SDF record up to the data items
+        molfile = sdf.split('M  END')[0] + 'M  END\n'
+        strucs.append(Structures(substance_id=subid, molfile=molfile, updated=datetime.now()))
+    Structures.objects.bulk_create(strucs, batch_size=500)
+    return len(strucs)
 
 
 def updsubstance(identifier, output='meta'):
@@ -208,52 +375,13 @@ def updsubstance(identifier, output='meta'):
     sub.lastcheck = date.today()
     sub.save()
 
-    # IDENTIFIERS
-    for s, idents in ids.items():
-        for t, v in idents.items():
-            if v is None or v == []:
-                continue
-            if isinstance(v, list):
-                for x in v:
-                    hit, created = Identifiers.objects.update_or_create(substance_id=subid, type=t, value=x, source=s)
-                    hit.lastcheck = dt
-                    hit.save()
-            else:
-                hit, created = Identifiers.objects.update_or_create(substance_id=subid, type=t, value=v, source=s)
-                hit.lastcheck = dt
-                hit.save()
-                print(s + ":" + t + ":" + str(v))
-
-    # DESCRIPTORS
-    for s, desc in descs.items():
-        for t, v in desc.items():
-            if v is None or v == []:
-                continue
-            if isinstance(v, list):
-                for x in v:
-                    hit, created = Descriptors.objects.update_or_create(substance_id=subid, type=t, value=x, source=s)
-                    hit.lastcheck = dt
-                    hit.save()
-            else:
-                hit, created = Descriptors.objects.update_or_create(substance_id=subid, type=t, value=v, source=s)
-                hit.lastcheck = dt
-                hit.save()
-                print(s + ":" + t + ":" + str(v))
-
-    # SOURCES (where the data was obtained from)
-    for s, src in srcs.items():
-        result, notes = '', ''
-        for t, v in src.items():
-            if t == 'result':
-                result = v
-            elif t == 'notes':
-                notes = v
-        hit, created = Sources.objects.update_or_create(substance_id=subid, source=s)
-        hit.result = result
-        hit.notes = notes
-        hit.lastcheck = dt
-        hit.save()
-        print(s + ":" + str(result) + ":" + notes)
+    # IDENTIFIERS, DESCRIPTORS and SOURCES (only rows that changed are written)
+    counts = syncrows(Identifiers, subid, idrows(subid, ids), srcs)
+    print("identifiers: " + str(counts))
+    counts = syncrows(Descriptors, subid, descrows(subid, descs), srcs)
+    print("descriptors: " + str(counts))
+    counts = syncsrcs(subid, srcs)
+    print("sources: " + str(counts))
 
     if output == 'all':
         return meta, ids, descs, srcs
@@ -263,6 +391,125 @@ def updsubstance(identifier, output='meta'):
         return meta
 
 
+def syncrows(model, subid, rows, srcs):
+    """
+    update the identifiers/descriptors of a substance using freshly fetched
+    data. The existing rows are loaded once and compared to the new rows so
+    that only new rows are inserted, unchanged rows get a new lastcheck date
+    (one update) and rows no longer found in a source are deleted
+    :param model: Identifiers or Descriptors
+    :param subid: substance id
+    :param rows: new (unsaved) rows (from idrows or descrows)
+    :param srcs: sources dictionary from getsubdata
+    :return dictionary of the number of rows added, checked and deleted
+    """
+    today = date.today()
+    # only sources that were searched are compared and rows are only deleted
+    # when the source was successfully searched
+    searched = list(srcs.keys())
+    found = [src for src, info in srcs.items() if str(info.get('result')) == '1']
+    existing = {}
+    for rowid, rtype, value, source, lastcheck in model.objects.filter(substance_id=subid, source__in=searched).\
+            values_list('id', 'type', 'value', 'source', 'lastcheck'):
+        existing.setdefault((rtype, value, source), []).append((rowid, lastcheck))
+
+    adds, keys = [], set()
+    for row in rows:
+        if row.value is None:
+            continue
+        key = (row.type, str(row.value), row.source)
+        if key in keys:
+            continue
+        keys.add(key)
+        if key not in existing:
+            adds.append(row)
+    checks, deletes = [], []
+    for key, hits in existing.items():
+        if key in keys:
+            checks.extend([rowid for rowid, lastcheck in hits if lastcheck != today])
+        elif key[2] in found:
+            deletes.extend([rowid for rowid, lastcheck in hits])
+
+    with transaction.atomic():
+        model.objects.bulk_create(adds, batch_size=1000)
+        if model is Identifiers:
+            idxaddrows(adds)
+            if adds:
+                searchupdate([subid])
+        for i in range(0, len(checks), 1000):
+            model.objects.filter(id__in=checks[i:i + 1000]).update(lastcheck=today)
+        for i in range(0, len(deletes), 1000):
+            model.objects.filter(id__in=deletes[i:i + 1000]).delete()
+    return {'added': len(adds), 'checked': len(checks), 'deleted': len(deletes)}
+
+
+def syncsrcs(subid, srcs):
+    """ update the entries in the sources table for a substance (see syncrows) """
+    today = date.today()
+    existing = {}
+    for src in Sources.objects.filter(substance_id=subid, source__in=list(srcs.keys())):
+        existing[src.source] = src
+    adds, changes = [], []
+    for row in srcrows(subid, srcs):
+        notes = None if row.notes is None else str(row.notes)
+        if row.source not in existing:
+            adds.append(row)
+            continue
+        hit = existing[row.source]
+        if str(hit.result) != str(row.result) or hit.notes != notes or hit.lastcheck != today:
+            hit.result = row.result
+            hit.notes = notes
+            hit.lastcheck = today
+            changes.append(hit)
+    with transaction.atomic():
+        Sources.objects.bulk_create(adds)
+        Sources.objects.bulk_update(changes, ['result', 'notes', 'lastcheck'])
+    return {'added': len(adds), 'updated': len(changes)}
+
+
+def stalesubs(source, limit, maxage=0):
+    """
+    get the substances whose data from a source was checked longest ago
+    (substances never checked against the source are first)
+    :param source: name of the source (e.g. pubchem)
+    :param limit: maximum number of substances to return
+    :param maxage: only substances not checked in this many days are returned
+    :return list of (substance id, inchikey) tuples
+    """
+    checked = Max('sources__lastcheck', filter=Q(sources__source=source))
+    subs = Substances.objects.filter(inchikey__isnull=False).annotate(checked=checked)
+    if maxage:
+        cutoff = date.today() - timedelta(days=maxage)
+        subs = subs.filter(Q(checked__isnull=True) | Q(checked__lt=cutoff))
+    subs = subs.order_by(F('checked').asc(nulls_first=True), 'id').values_list('id', 'inchikey')
+    return list(subs[:limit])
+
+
+def refreshsource(source, subs, workers=subworkers):
+    """
+    refresh the data for a list of substances from one source. The source is
+    searched for workers substances at a time and the identifiers/descriptors
+    from the source are updated using syncrows
+    :param source: name of the source (e.g. pubchem)
+    :param subs: list of (substance id, inchikey) tuples (see stalesubs)
+    :param workers: number of substances searched at the same time
+    :return dictionary of counts of rows added, checked and deleted
+    """
+    totals = {'added': 0, 'checked': 0, 'deleted': 0}
+    prefetched = batchsubdata([sub[1] for sub in subs], [source])
+    pool = ThreadPoolExecutor(max_workers=workers)
+    fetched = pool.map(lambda sub: getsubdata(sub[1], [source], prefetched.get(sub[1])), subs)
+    for (subid, key), (meta, ids, descs, srcs) in zip(subs, fetched):
+        for model, rows in [(Identifiers, idrows(subid, ids)), (Descriptors, descrows(subid, descs))]:
+            counts = syncrows(model, subid, rows, srcs)
+            for k, v in counts.items():
+                totals[k] += v
+        syncsrcs(subid, srcs)
+        Substances.objects.filter(id=subid).update(lastcheck=date.today())
+    pool.shutdown()
+    return totals
+
+
 def addunksub(sub):
     """add the metadata for substance that cannot be found online"""
 
@@ -322,29 +569,92 @@ def getidtype(identifier):
     return "other"
 
 
-def getsubdata(identifier):
-    """searches for cmpd in DB and gets data or adds new cmpd with data"""
+def getsource(source, identifier):
+    """get the data for a substance from a single external source"""
     meta, ids, descs, srcs = {}, {}, {}, {}
     try:
-        pubchem(identifier, meta, ids, descs, srcs)
+        if source == 'pubchem':
+            pubchem(identifier, meta, ids, descs, srcs)
+        elif source == 'classyfire':
+            classyfire(identifier, ids, descs, srcs)
+        elif source == 'wikidata':
+            wikidata(identifier, ids, srcs)
+        elif source == 'chembl':
+            chembl(identifier, meta, ids, descs, srcs)
+        elif source == 'comchem':
+            comchem(identifier, meta, ids, srcs)
     except Exception as exception:
-        srcs.update({"pubchem": {"result": 0, "notes": exception}})
-    try:
-        classyfire(identifier, ids, descs, srcs)
-    except Exception as exception:
-        srcs.update({"classyfire": {"result": 0, "notes": exception}})
-    try:
-        wikidata(identifier, ids, srcs)
-    except Exception as exception:
-        srcs.update({"wikidata": {"result": 0, "notes": exception}})
-    try:
-        chembl(identifier, meta, ids, descs, srcs)
-    except Exception as exception:
-        srcs.update({"chembl": {"result": 0, "notes": exception}})
-    try:
-        comchem(identifier, meta, ids, srcs)
-    except Exception as exception:
-        srcs.update({"comchem": {"result": 0, "notes": exception}})
+        srcs.update({source: {"result": 0, "notes": exception}})
+    return meta, ids, descs, srcs
+
+
+def batchsubdata(keys, sources=None):
+    """
+    get the data for many substances from the sources that can be searched
+    in batches (see subbatch). If a batch search fails the substances are
+    left out so getsubdata searches for them one at a time
+    :param keys: list of inchikeys
+    :param sources: list of sources to search (default is all in subsources)
+    :return dictionary of inchikey -> {source: (meta, ids, descs, srcs)}
+    """
+    if sources is None:
+        sources = subsources
+    output = {}
+    for source in sources:
+        if source not in subbatch or not keys:
+            continue
+        try:
+            if source == 'pubchem':
+                found = pubchembatch(keys, subbatch[source])
+            elif source == 'wikidata':
+                found = wikidatabatch(keys, subbatch[source])
+            elif source == 'chembl':
+                found = chemblbatch(keys, subbatch[source])
+        except Exception as exception:
+            print("batch search of " + source + " failed: " + str(exception))
+            continue
+        for key, data in found.items():
+            output.setdefault(key, {})[source] = data
+    return output
+
+
+def getsubdata(identifier, sources=None, prefetched=None):
+    """
+    searches for cmpd in DB and gets data or adds new cmpd with data
+    all sources are queried at the same time (each in its own thread) and the
+    data is merged in the order of the sources list so output is the same
+    regardless of which source responds first
+    :param identifier: inchikey of the substance
+    :param sources: list of sources to search (default is all in subsources)
+    :param prefetched: data already found for some sources (see batchsubdata)
+    """
+    if sources is None:
+        sources = subsources
+    if prefetched is None:
+        prefetched = {}
+    meta, ids, descs, srcs = {}, {}, {}, {}
+    pool = ThreadPoolExecutor(max_workers=len(sources))
+    started = time.monotonic()
+    futures = {}
+    for source in sources:
+        if source not in prefetched:
+            futures[source] = pool.submit(getsource, source, identifier)
+    for source in sources:
+        if source in prefetched:
+            m, i, d, s = prefetched[source]
+        else:
+            wait = subtimeouts.get(source, 30) - (time.monotonic() - started)
+            try:
+                m, i, d, s = futures[source].result(timeout=max(wait, 0))
+            except TimeoutError:
+                notes = "No response in " + str(subtimeouts.get(source, 30)) + " seconds"
+                m, i, d, s = {}, {}, {}, {source: {"result": 0, "notes": notes}}
+        meta.update(m)
+        ids.update(i)
+        descs.update(d)
+        srcs.update(s)
+    # don't wait on sources that timed out (their data is discarded)
+    pool.shutdown(wait=False, cancel_futures=True)
 
     return meta, ids, descs, srcs
 
@@ -355,33 +665,46 @@ def getmeta(subid):
     return meta
 
 
-def createsubjld(subid):
+def createsubjld(subid, sdf=None):
     """
     create SciData JSON-LD file for substance,
     ingest in graph and update DB with graphname
+    :param subid: substance id
+    :param sdf: PubChem SDF of the substance (if already retrieved, see subsdfs)
     """
+    # get the substance info (metadata, identifiers, descriptors)
+    substance = Substances.objects.get(id=subid)
+    ids = dict(substance.identifiers_set.all().values_list('type', 'value'))
+    descs = list(substance.descriptors_set.all().values_list('type', 'value'))
+    if sdf is None and "pubchem" in ids.keys():
+        sdf = pubchemsdfs([ids['pubchem']]).get(str(ids['pubchem']), '')
+    print(ids)
 
-    # get the latest version of the substance template file from the database
-    tmpl = Templates.objects.filter(type="substance").order_by('-version')[0]
-    sd = json.loads(tmpl.json)
-    print(sd)
+    # get the latest version of the substance template (see gettemplate)
+    tmpl = gettemplate("substance", "substance")
+    return buildsubjld(tmpl, substance, ids, descs, sdf)
 
-    cmpd = sd['@graph']['scidata']['system']['facets'][0]
 
-    # get the metadata fields from the DB that need to be included in the file
-    # fields = Metadata.objects.filter(sdsubsection="compound") [old]
-    fields = Metadata.objects.filter(sdsubsection="substance")
+def buildsubjld(tmpl, substance, ids, descs, sdf=None):
+    """
+    create the SciData JSON-LD file for a substance from data already retrieved
+    (no database queries so it can be run in other processes, see regentwins)
+    :param tmpl: compiled substance template (see gettemplate)
+    :param substance: substance object
+    :param ids: dictionary of identifier type -> value
+    :param descs: list of (descriptor type, value) tuples
+    :param sdf: PubChem SDF of the substance
+    """
+    sd = tmplcopy(tmpl['skeleton'])
+    cmpd = sd['@graph']['scidata']['system']['facets'][0]
 
-    # get the substance info (metadata, identifiers, descriptors)
-    substance = Substances.objects.get(id=subid)
-    ids = dict(substance.identifiers_set.all().values_list('type', 'value'))
-    descs = substance.descriptors_set.all().values_list('type', 'value')
+    # the metadata fields that need to be included in the file
+    fields = tmpl['fields']
 
     # add general metadata
     sd['generatedAt'] = str(datetime.now())
     title = sd['@graph']['title'].replace("<iupacname>", substance.name)
     sd['@graph']['title'] = title
-    print(ids)
 
     # add general compound metadata
     if 'iupacname' not in ids:
@@ -400,17 +723,15 @@ def createsubjld(subid):
 
     # loop through fields to add them to the appropriate sections
     for field in fields:
-        label = field.label
-        section = field.sdsubsubsection
+        label = field['label']
+        section = field['section']
         value = []
         if section == 'identifiers':
             # if identifier=inchikey then populate other locations in json file
             value = get_item(ids, label)
             if label == 'inchikey':
                 if value is None:
-                    print(subid)
-                    print(ids)
-                    exit()
+                    raise ValueError("Substance " + str(substance.id) + " has no inchikey identifier")
                 last = len(sd['@context']) - 1
                 base = sd['@context'][last]['@base'].replace("<inchikey>", value)
                 sd['@context'][last]['@base'] = base
@@ -420,7 +741,7 @@ def createsubjld(subid):
                 uid = sd['@graph']['uid'].replace("<inchikey>", value)
                 sd['@graph']['uid'] = uid
         elif section == 'descriptors':
-            if field.group is None:
+            if field['groups'] is None:
                 # expecting only one value in list
                 vlst = get_items(descs, label)
                 if len(vlst) == 1:
@@ -428,121 +749,98 @@ def createsubjld(subid):
                 else:
                     value = vlst
             else:
-                gflds = field.group.split(',')
-                for gfld in gflds:
+                for gfld in field['groups']:
                     vlst = get_items(descs, gfld)
                     if vlst is not None:
                         for val in vlst:
-                            if field.datatype == "xsd:string":
+                            if field['datatype'] == "xsd:string":
                                 value.append(val)
-                            elif field.datatype == "xsd:integer" or \
-                                    field.datatype == "xsd:nonNegativeInteger":
+                            elif field['datatype'] == "xsd:integer" or \
+                                    field['datatype'] == "xsd:nonNegativeInteger":
                                 value.append(int(val))
         # add field to cmpd
-        if field.output == "datum" and value is not None and value is not []:
+        if field['output'] == "datum" and value is not None and value is not []:
             cmpd[section].update({label: value})
-        elif field.output == "array" and value is not None and value is not []:
+        elif field['output'] == "array" and value is not None and value is not []:
             cmpd[section][label] = value
 
     # add molecular graph
     # get molfile from pubchem (if available)
     if "pubchem" in ids.keys():
-        pcid = ids['pubchem']
-        mol = pubchemmol(pcid)
-        atoms = mol['atoms']
-        bonds = mol['bonds']
-        chrgs = mol['chrgs']
-
-        # get list of elements in the compound
-        elements = []
-        for atom in atoms:
-            if atom[3] not in elements:
-                elements.append(atom[3])
-
-        # create element section for file
-        els = []
-        ids = list(sd['@graph']['ids'])
-        for i, symbol in enumerate(elements):
-            idx = str(i + 1)
-            name = elementdata(symbol, 'Symbol', 'Name')
-            chebi = elementdata(symbol, 'Symbol', 'ChEBI')
-            ids.append(chebi)
-            el = {}
-            el.update({"@id": "element/" + idx + "/"})
-            el.update({"@type": "obo:NCIT_C1940"})
-            el.update({"name": name})
-            el.update({"element": chebi})
-            els.append(el)
-        sd['@graph']['ids'] = ids
-
-        # add elements to the cmpd
-        cmpd['molgraph']['elements'] = els
-
-        # create stats on bonds - # of each bond order per atom (number)
-        bstats = {}
-        for idx, bond in enumerate(bonds):
-            if bond[0] not in bstats:
-                bstats.update({str(bond[0]): {}})
-            if bond[1] not in bstats:
-                bstats.update({str(bond[1]): {}})
-            if bond[2] not in bstats[bond[0]]:
-                bstats[bond[0]].update({str(bond[2]): 0})
-            if bond[2] not in bstats[bond[1]]:
-                bstats[bond[1]].update({str(bond[2]): 0})
-            bstats[bond[0]][bond[2]] += 1
-            bstats[bond[1]][bond[2]] += 1
-
-        # create atom section for file
-        atms = []
-        for i, atom in enumerate(atoms):
-            idx = str(i + 1)
-            atm = {}
-            atm.update({"@id": "atom/" + idx + "/"})
-            atm.update({"@type": "obo:CHEBI_33250"})
-            eidx = None
-            for key, value in enumerate(elements):
-                if value == atom[3]:
-                    eidx = str(key + 1)
-                    break
-            atm.update({"element": "element/" + eidx + "/"})
-            atm.update({"xcoord": atom[0]})
-            atm.update({"ycoord": atom[1]})
-            atm.update({"zcoord": atom[2]})
-            if idx in bstats.keys():
-                if '1' in bstats[idx].keys():
-                    atm.update({"singlebonds": bstats[idx]['1']})
-                if '2' in bstats[idx].keys():
-                    atm.update({"doublebonds": bstats[idx]['2']})
-                if '3' in bstats[idx].keys():
-                    atm.update({"triplebonds": bstats[idx]['3']})
-            for chrg in chrgs:
-                if chrg[0] == idx:
-                    atm.update({"charge": chrg[1]})
-            atms.append(atm)
-
-        # add atoms to the cmpd
-        cmpd['molgraph']['atoms'] = atms
-
-        # create bond seection for file
-        bnds = []
-        for i, bond in enumerate(bonds):
-            idx = str(i + 1)
-            bnd = {}
-            bnd.update({"@id": "bond/" + idx + "/"})
-            bnd.update({"@type": "ss:SIO_011118"})
-            bnd.update({"order": bond[2]})
-            atms = ["atom/" + str(bond[0]) + "/", "atom/" + str(bond[1]) + "/"]
-            bnd.update({"atoms": atms})
-            bnds.append(bnd)
-
-        # add bonds to the cmpd
-        cmpd['molgraph']['bonds'] = bnds
+        graph = molgraph(parsemol(sdf) if sdf else None)
+
+        # add elements to the file ids and the cmpd
+        sd['@graph']['ids'] = list(sd['@graph']['ids']) + graph['chebi']
+        cmpd['molgraph']['elements'] = graph['elements']
+        # add atoms and bonds to the cmpd
+        cmpd['molgraph']['atoms'] = graph['atoms']
+        cmpd['molgraph']['bonds'] = graph['bonds']
 
     # add compound data into sd template file
     sd['@graph']['scidata']['system']['facets'][0] = cmpd
     return sd
 
 
+def twindata(subids):
+    """
+    get the data needed to create the JSON-LD files of many substances using
+    a few bulk queries (and batched PubChem SDF requests)
+    :param subids: list of substance ids
+    :return list of (substance, ids, descs, sdf) tuples (see buildsubjld)
+    """
+    subs = Substances.objects.filter(id__in=subids).order_by('id')
+    ids, descs = {}, {}
+    for subid, typ, value in Identifiers.objects.filter(substance_id__in=subids).order_by('id')\
+            .values_list('substance_id', 'type', 'value'):
+        ids.setdefault(subid, {})[typ] = value
+    for subid, typ, value in Descriptors.objects.filter(substance_id__in=subids).order_by('id')\
+            .values_list('substance_id', 'type', 'value'):
+        descs.setdefault(subid, []).append((typ, value))
+    sdfs = subsdfs(subids)
+    return [(sub, ids.get(sub.id, {}), descs.get(sub.id, []), sdfs.get(sub.id, '')) for sub in subs]
+
+
+def savetwins(twins, user=2):
+    """
+    save new versions of the JSON-LD files of many substances (see newjld)
+    facet_lookup entries are added for substances that do not have one and
+    the files are saved in bulk
+    :param twins: list of (substance, json-ld dictionary) tuples
+    :param user: id of the user saving the files
+    :return list of the facet_lookup ids of the files saved
+    """
+    now = datetime.now()
+    with transaction.atomic():
+        for sub, jld in twins:
+            if sub.graphdb is None:
+                lookup = FacetLookup(uniqueid=jld["@graph"]["uid"], title=jld["@graph"]["title"], type='substance',
+                                     currentversion=0, auth_user_id=user, updated=now)
+                lookup.save()
+                lookup.graphname = 'https://scidata.unf.edu/facet/' + str(lookup.id).zfill(8)
+                lookup.save()
+                sub.graphdb = lookup.graphname
+                sub.facet_lookup_id = lookup.id
+                sub.save()
+        lids = [sub.facet_lookup_id for sub, jld in twins]
+        lookups = FacetLookup.objects.in_bulk(lids)
+        versions = dict(FacetFiles.objects.filter(facet_lookup_id__in=lids).values('facet_lookup_id')
+                        .annotate(last=Max('version')).values_list('facet_lookup_id', 'last'))
+        for sub, jld in twins:
+            jld["@id"] = sub.graphdb
+        # the text of the files is saved once per content hash (see saveblobs)
+        blobs = saveblobs([json.dumps(jld, separators=(',', ':')) for sub, jld in twins])
+        files = []
+        for (sub, jld), (blobid, jhash) in zip(twins, blobs):
+            newver = versions.get(sub.facet_lookup_id, 0) + 1
+            versions[sub.facet_lookup_id] = newver
+            files.append(FacetFiles(facet_lookup_id=sub.facet_lookup_id, blob_id=blobid, type='raw', version=newver,
+                                    updated=now))
+            lookups[sub.facet_lookup_id].currentversion = newver
+        FacetFiles.objects.bulk_create(files, batch_size=100)
+        FacetLookup.objects.bulk_update(lookups.values(), ['currentversion'], batch_size=500)
+    return lids
+
+
 def get_item(d, key):
     """extracts value of dictionary using the key variable as field name"""
     return d.get(key)
@@ -557,25 +855,32 @@ def get_items(tpls, key):
     return lst
 
 
-def saveids(subid, ids):
-    """ save identifier metadata """
+def idrows(subid, ids):
+    """ create (unsaved) entries for the identifiers table from source data """
+    today = date.today()
+    rows = []
     for source, e in ids.items():
         for k, v in e.items():
             # check if value is list or string
             if isinstance(v, list):
                 for x in v:
-                    ident = Identifiers(substance_id=subid, type=k, value=x, source=source)
-                    ident.save()
+                    rows.append(Identifiers(substance_id=subid, type=k, value=x, source=source, lastcheck=today))
             else:
                 # add random str in iso field to make csmiles pseudo 'unique'
                 if k == 'csmiles':
                     chars = string.ascii_uppercase + string.digits
                     rstr = ''.join(random.choice(chars) for _ in range(5))
-                    ident = Identifiers(substance_id=subid, type=k, value=v, iso=rstr, source=source)
+                    rows.append(Identifiers(substance_id=subid, type=k, value=v, iso=rstr, source=source, lastcheck=today))
                 else:
-                    ident = Identifiers(substance_id=subid, type=k, value=v, source=source)
-                ident.lastcheck = dt
-                ident.save()
+                    rows.append(Identifiers(substance_id=subid, type=k, value=v, source=source, lastcheck=today))
+    return rows
+
+
+def saveids(subid, ids):
+    """ save identifier metadata """
+    rows = Identifiers.objects.bulk_create(idrows(subid, ids), batch_size=1000)
+    idxaddrows(rows)
+    searchupdate([subid])
 
 
 def getsubids(identifier):
@@ -622,38 +927,126 @@ def getsubsrcs(identifier):
     return dict(ids)
 
 
-def savedescs(subid, descs):
-    """ save descriptor metadata """
+def descrows(subid, descs):
+    """ create (unsaved) entries for the descriptors table from source data """
+    today = date.today()
+    rows = []
     for source, e in descs.items():
         for k, v in e.items():
             # check if value is list or string
             if isinstance(v, list):
                 for x in v:
-                    desc = Descriptors(substance_id=subid, type=k, value=x, source=source)
-                    desc.lastcheck = dt
-
-                    desc.save()
+                    rows.append(Descriptors(substance_id=subid, type=k, value=x, source=source, lastcheck=today))
             else:
-                desc = Descriptors(substance_id=subid, type=k, value=v, source=source)
-                desc.save()
+                rows.append(Descriptors(substance_id=subid, type=k, value=v, source=source, lastcheck=today))
+    return rows
 
 
-def savesrcs(subid, srcs):
-    """ save sources data """
+def savedescs(subid, descs):
+    """ save descriptor metadata """
+    Descriptors.objects.bulk_create(descrows(subid, descs), batch_size=1000)
+
+
+def srcrows(subid, srcs):
+    """ create (unsaved) entries for the sources table from source data """
     # srcs = {"pubchem": {"result":1, "notes":None}
+    today = date.today()
+    rows = []
     for x, y in srcs.items():
-        src = Sources(substance_id=subid, source=x, result=y["result"], notes=y.get("notes", "Null"))
-        src.lastcheck = dt
-        src.save()
+        rows.append(Sources(substance_id=subid, source=x, result=y["result"], notes=y.get("notes", "Null"), lastcheck=today))
+    return rows
+
+
+def savesrcs(subid, srcs):
+    """ save sources data """
+    Sources.objects.bulk_create(srcrows(subid, srcs))
 
 
 def getsubid(identifier):
     """get substance id for substance identifier - return false if not found"""
-    sub = Substances.objects.all().filter(identifiers__value__exact=identifier)
-    if sub:
-        return sub[0].id
-    else:
-        return False
+    return resolve(identifier)
+
+
+def resolveids(identifiers, queue=False):
+    """
+    find the substances for many identifiers (of any type) using a few
+    set based queries (see resolvemany)
+    :param identifiers: list of identifiers
+    :param queue: add unknown identifiers to the queue of substances to be added
+    :return dictionary of identifier -> {'type', 'id', 'inchikey', 'status' ('found', 'unknown' or 'queued')}
+    """
+    identifiers = list(dict.fromkeys([str(x).strip() for x in identifiers if str(x).strip()]))
+    types = {x: getidtype(x) for x in identifiers}
+    found = idxcheck(resolvemany(identifiers))
+    # substances can be found by their inchikey even without an identifier row
+    keys = [x for x in identifiers if x not in found and types[x] == 'inchikey']
+    for i in range(0, len(keys), 1000):
+        for subid, key in Substances.objects.filter(inchikey__in=keys[i:i + 1000]).values_list('id', 'inchikey'):
+            found[key] = subid
+    inchikeys = {}
+    subids = list(set(found.values()))
+    for i in range(0, len(subids), 1000):
+        inchikeys.update(dict(Substances.objects.filter(id__in=subids[i:i + 1000]).values_list('id', 'inchikey')))
+
+    output, unknown = {}, []
+    for x in identifiers:
+        if x in found:
+            output[x] = {'type': types[x], 'id': found[x], 'inchikey': inchikeys.get(found[x]), 'status': 'found'}
+        else:
+            output[x] = {'type': types[x], 'id': None, 'inchikey': None, 'status': 'unknown'}
+            unknown.append(x)
+    if queue and unknown:
+        for x in queuesubs(unknown):
+            output[x]['status'] = 'queued'
+    return output
+
+
+def queuesubs(identifiers):
+    """
+    add identifiers to the queue of substances to be added (see takequeue).
+    Identifiers already queued are not added again and no more are added
+    once the queue has queuemax identifiers
+    :return list of the identifiers that are in the queue
+    """
+    os.makedirs(os.path.dirname(resolvequeue), exist_ok=True)
+    queued = set()
+    if os.path.exists(resolvequeue):
+        with open(resolvequeue) as f:
+            for line in f:
+                if line.strip():
+                    queued.add(json.loads(line)['identifier'])
+    new = [x for x in identifiers if x not in queued][:max(queuemax - len(queued), 0)]
+    lines = "".join([json.dumps({'identifier': x, 'queued': str(datetime.now())}) + "\n" for x in new])
+    with open(resolvequeue, 'a') as f:
+        f.write(lines)
+    queued.update(new)
+    return [x for x in identifiers if x in queued]
+
+
+def takequeue():
+    """
+    take all the identifiers from the queue of substances to be added. The
+    queue file is renamed first so identifiers queued meanwhile are kept
+    :return list of identifiers
+    """
+    if not os.path.exists(resolvequeue):
+        return []
+    work = resolvequeue + '.work'
+    if not os.path.exists(work):
+        os.replace(resolvequeue, work)
+    identifiers = []
+    with open(work) as f:
+        for line in f:
+            if line.strip():
+                identifiers.append(json.loads(line)['identifier'])
+    return list(dict.fromkeys(identifiers))
+
+
+def donequeue():
+    """ remove the queue file taken by takequeue (after the substances are added) """
+    work = resolvequeue + '.work'
+    if os.path.exists(work):
+        os.remove(work)
 
 
 def subingraph(subid):
@@ -688,32 +1081,32 @@ def getinchikey(subid):
     return False
 
 
-def subsearch(query):
-    """search based on value field in identifiers and returns all substances"""
+def subsearch(query, page=1):
+    """
+    search substance names and identifiers (see searchids) and return a page
+    of the substances found. Without the search index (manage.py buildsearch)
+    the identifiers table is searched with icontains
+    """
     if query is not None:
-        lookups = Q(value__icontains=query)
-        subids = Identifiers.objects.filter(lookups).values_list('substance_id').distinct()
-        results = Substances.objects.filter(id__in=subids).order_by('name')
-        context = {'results': results, "query": query}
+        if searchready():
+            results = SearchResults(query)
+        else:
+            lookups = Q(value__icontains=query)
+            subids = Identifiers.objects.filter(lookups).values_list('substance_id').distinct()
+            results = Substances.objects.filter(id__in=subids).order_by('name')
+        page_obj = Paginator(results, searchpage).get_page(page)
+        context = {'results': page_obj, 'page_obj': page_obj, "query": query}
         return context
+    return {'results': [], "query": query}
 
 
 def elementdata(strng, field1, field2):
-    """generate elements dictionary"""
-    basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    path = basedir + '/static/files/elements.json'
-    f = open(path)
-    j = json.loads(f.read())
-    rows = j['Table']['Row']
-    fields = j['Table']['Columns']['Column']
-    sidx = fields.index(field1)
-    didx = fields.index(field2)
-    answer = False
-    for row in rows:
-        if row['Cell'][sidx] == strng:
-            answer = row['Cell'][didx]
-            break
-    return answer
+    """get field2 of the element where field1 is strng (see periodictable)"""
+    table = periodictable()
+    found = np.nonzero(table[field1][1:] == strng)[0]
+    if not len(found):
+        return False
+    return table[field2][found[0] + 1]
 
 
 searchterms = {'compound': ['^[A-Z]{14}-[A-Z]{10}-[A-Z]$', '^InChI=', '^[0-9]{2,7}-[0-9]{2}-[0-9]$']}
@@ -1 +1,306 @@
 """django unittest definition file"""
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from unittest import mock
+from substances.models import *
+from substances.mol_functions import parsemol, parsesdf
+from substances.idx_functions import idxclear, resolve, resolvemany
+from substances.sub_functions import addsubstance, resolveids
+from django.contrib.auth.models import AnonymousUser
+from substances.chk_functions import checkrows, checkerrors
+from substances import srch_functions
+from substances.srch_functions import searchcreate, searchids, searchready
+from substances.skel_functions import dupgroups, dupmembers
+from substances import fp_functions
+from substances.fp_functions import fpbuild, fpupdate, similar, substructure
+from substances.views import resolveapi, similarapi, substructureapi
+from rdkit import Chem
+import json
+import os
+import tempfile
+
+
+def maketables(*models):
+    """ create the tables of unmanaged models in the test database (migrate does not) """
+    tables = connection.introspection.table_names()
+    with connection.schema_editor() as editor:
+        for model in models:
+            if model._meta.db_table not in tables:
+                editor.create_model(model)
+
+
+def addsub(name, key=None, **ids):
+    """ add a substance (name, InChIKey) and its identifiers (type=value) """
+    sub = Substances.objects.create(name=name, inchikey=key)
+    for idtype, value in ids.items():
+        Identifiers.objects.create(substance=sub, type=idtype, value=value, iso='', source='pubchem')
+    return sub
+
+
+def molblock(smiles, name='', v3000=False):
+    """ molfile of a SMILES string made with RDKit (title line is the name) """
+    mol = Chem.MolFromSmiles(smiles)
+    mol.SetProp('_Name', name)
+    return Chem.MolToMolBlock(mol, forceV3000=v3000)
+
+
+class MolTestCase(SimpleTestCase):
+    def test_v2000(self):
+        """atoms, charges and bonds of a V2000 molfile"""
+        mol = parsemol(molblock('CC(=O)[O-]', 'acetate'))
+        self.assertEqual(mol['version'], 'V2000')
+        self.assertEqual(mol['name'], 'acetate')
+        self.assertEqual(mol['symbols'], ['C', 'C', 'O', 'O'])
+        self.assertEqual(mol['elements'].tolist(), [6, 6, 8, 8])
+        self.assertEqual(mol['charges'].tolist(), [0, 0, 0, -1])
+        self.assertEqual(mol['coords'].shape, (4, 3))
+        self.assertEqual(mol['bonds'].tolist(), [[1, 2, 1], [2, 3, 2], [2, 4, 1]])
+
+    def test_v3000(self):
+        """a V3000 molfile gives the same arrays as V2000"""
+        mol = parsemol(molblock('CC(=O)[O-]', 'acetate', v3000=True))
+        self.assertEqual(mol['version'], 'V3000')
+        self.assertEqual(mol['symbols'], ['C', 'C', 'O', 'O'])
+        self.assertEqual(mol['charges'].tolist(), [0, 0, 0, -1])
+        self.assertEqual(mol['bonds'].tolist(), [[1, 2, 1], [2, 3, 2], [2, 4, 1]])
+
+    def test_large(self):
+        """more than 99 atoms (atom numbers fill the three character columns)"""
+        mol = parsemol(molblock('C' * 120 + 'Cl'))
+        self.assertEqual(len(mol['symbols']), 121)
+        self.assertEqual(mol['elements'][-1], 17)
+        self.assertEqual(mol['bonds'].shape, (120, 3))
+        self.assertEqual(mol['bonds'][-1].tolist(), [120, 121, 1])
+
+    def test_sdf(self):
+        """records of an SDF file, the first with a blank title line"""
+        sdf = molblock('CCO') + '$$$$\n' + molblock('CC(=O)[O-]', 'acetate') + '$$$$\n'
+        self.assertTrue(sdf.startswith('\n'))
+        mols = parsesdf(sdf)
+        self.assertEqual(len(mols), 2)
+        self.assertEqual([mol['name'] for mol in mols], ['', 'acetate'])
+        self.assertEqual(mols[0]['symbols'], ['C', 'C', 'O'])
+        self.assertEqual(mols[1]['charges'].tolist(), [0, 0, 0, -1])
+
+
+class IndexTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        maketables(Substances, Identifiers)
+        super().setUpClass()
+
+    def setUp(self):
+        idxclear()
+        self.benzene = addsub('benzene', csmiles='c1ccccc1')
+        self.hexane = addsub('cyclohexane', csmiles='C1CCCCC1')
+
+    def test_case(self):
+        """SMILES that only differ in case are different substances"""
+        self.assertEqual(resolve('C1CCCCC1'), self.hexane.id)
+        self.assertEqual(resolve('c1ccccc1'), self.benzene.id)
+        self.assertEqual(resolve(' C1CCCCC1 '), self.hexane.id)
+        self.assertFalse(resolve('C1CCCCc1'))
+        self.assertEqual(resolvemany(['c1ccccc1', 'C1CCCCC1', 'CCO']),
+                         {'c1ccccc1': self.benzene.id, 'C1CCCCC1': self.hexane.id})
+
+    def test_resolveids(self):
+        """resolveids finds each identifier once (from the index the second time)"""
+        for i in range(2):
+            found = resolveids(['C1CCCCC1', 'c1ccccc1', 'CCO'])
+            self.assertEqual(found['C1CCCCC1']['id'], self.hexane.id)
+            self.assertEqual(found['c1ccccc1']['id'], self.benzene.id)
+            self.assertEqual(found['CCO']['status'], 'unknown')
+
+    def test_shared(self):
+        """a value shared by two substances stays in the index until both rows are deleted"""
+        first = Identifiers.objects.create(substance=self.benzene, type='othername', value='solvent', iso='')
+        second = Identifiers.objects.create(substance=self.hexane, type='othername', value='solvent', iso='')
+        self.assertEqual(resolve('solvent'), self.benzene.id)
+        first.delete()
+        self.assertEqual(resolve('solvent'), self.hexane.id)
+        second.delete()
+        self.assertFalse(resolve('solvent'))
+
+    def test_stale(self):
+        """index entries of substances deleted by another process (no signals here) are looked up again"""
+        Identifiers.objects.create(substance=self.benzene, type='othername', value='solvent', iso='')
+        self.assertEqual(resolve('solvent'), self.benzene.id)
+        Identifiers.objects.filter(value='solvent').update(substance=self.hexane)
+        Identifiers.objects.filter(substance=self.benzene)._raw_delete(Identifiers.objects.db)
+        Substances.objects.filter(id=self.benzene.id)._raw_delete(Substances.objects.db)
+        self.assertEqual(resolve('solvent'), self.hexane.id)
+        self.assertEqual(resolveids(['solvent'])['solvent']['id'], self.hexane.id)
+        self.assertEqual(addsubstance('solvent', 'meta').id, self.hexane.id)
+        Identifiers.objects.filter(substance=self.hexane)._raw_delete(Identifiers.objects.db)
+        Substances.objects.filter(id=self.hexane.id)._raw_delete(Substances.objects.db)
+        self.assertEqual(resolveids(['solvent'])['solvent']['status'], 'unknown')
+
+    def test_queue(self):
+        """only logged in users can queue identifiers and the queue is limited to queuemax"""
+        def post(user, identifiers):
+            request = RequestFactory().post('/substances/api/resolve/', json.dumps(
+                {'identifiers': identifiers, 'queue': True}), content_type='application/json')
+            request.user = user
+            return resolveapi(request)
+
+        with tempfile.TemporaryDirectory() as path, \
+                mock.patch('substances.sub_functions.resolvequeue', os.path.join(path, 'queue.jsonl')), \
+                mock.patch('substances.sub_functions.queuemax', 2):
+            self.assertEqual(post(AnonymousUser(), ['CCO']).status_code, 403)
+            self.assertFalse(os.path.exists(os.path.join(path, 'queue.jsonl')))
+            user = mock.Mock(is_authenticated=True)
+            results = json.loads(post(user, ['CCO', 'c1ccccc1']).content)['results']
+            self.assertEqual([results['CCO']['status'], results['c1ccccc1']['status']], ['queued', 'found'])
+            results = json.loads(post(user, ['CCO', 'CCN', 'CCC']).content)['results']
+            self.assertEqual([results[x]['status'] for x in ['CCO', 'CCN', 'CCC']], ['queued', 'queued', 'unknown'])
+            with open(os.path.join(path, 'queue.jsonl')) as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+
+class CheckTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        maketables(Substances, Identifiers)
+        super().setUpClass()
+
+    def test_inkcheck(self):
+        """substances without an InChIKey or whose InChIKey is missing, repeated or different in identifiers"""
+        key = 'UHOVQNZJYSORNB-UHFFFAOYSA-N'
+        good = addsub('benzene', key, inchikey=key)
+        nokey = addsub('no key')
+        notfound = addsub('not found', 'XLYOFNOQVPJJNP-UHFFFAOYSA-N')
+        multiple = addsub('multiple', 'LFQSCWFLJHTTHZ-UHFFFAOYSA-N', inchikey='LFQSCWFLJHTTHZ-UHFFFAOYSA-N')
+        Identifiers.objects.create(substance=multiple, type='inchikey', value='LFQSCWFLJHTTHZ-UHFFFAOYSA-O', iso='')
+        different = addsub('different', 'VNWKTOKETHGBQD-UHFFFAOYSA-N', inchikey='VNWKTOKETHGBQD-UHFFFAOYSA-O')
+        # identifiers from comchem are not checked
+        Identifiers.objects.create(substance=good, type='inchikey', value='UHOVQNZJYSORNB-UHFFFAOYSA-O',
+                                   iso='', source='comchem')
+        rows = list(checkrows('inkcheck'))
+        self.assertEqual([row['id'] for row in rows], [nokey.id, notfound.id, multiple.id, different.id])
+        self.assertEqual([row['found'] for row in rows], [0, 0, 2, 1])
+        errors = [error['error'] for error in checkerrors('inkcheck')]
+        self.assertEqual(errors[0], 'No InChIKey for substance ' + str(nokey.id))
+        self.assertTrue(errors[1].endswith('not found in Identifiers table'))
+        self.assertTrue(errors[2].startswith('Multiple InChIKeys found'))
+        self.assertTrue(errors[3].endswith('does not match'))
+
+
+class DuplicateTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        maketables(Substances, Identifiers)
+        super().setUpClass()
+
+    def setUp(self):
+        self.skel = 'BSYNRYMUTXBXSQ'
+        for name, key in [('aspirin', 'BSYNRYMUTXBXSQ-UHFFFAOYSA-N'), ('aspirin copy', 'BSYNRYMUTXBXSQ-UHFFFAOYSA-N'),
+                          ('aspirin anion', 'BSYNRYMUTXBXSQ-UHFFFAOYSA-M'), ('aspirin d3', 'BSYNRYMUTXBXSQ-FIBGUPNXSA-N'),
+                          ('benzene', 'UHOVQNZJYSORNB-UHFFFAOYSA-N'), ('no key', None)]:
+            addsub(name, key)
+
+    def test_groups(self):
+        """substances are grouped by InChIKey skeleton (and protonation flag)"""
+        self.assertEqual(list(dupgroups()), [{'skeleton': self.skel, 'count': 4}])
+        self.assertEqual(list(dupgroups(protonation=True)), [{'skeleton': self.skel, 'protonation': 'N', 'count': 3}])
+        self.assertEqual(list(dupgroups(minsize=1))[1], {'skeleton': 'UHOVQNZJYSORNB', 'count': 1})
+
+    def test_members(self):
+        """each substance in a group is a duplicate, protonation state or stereoisomer/isotopologue"""
+        group = dupmembers(dupgroups())[0]
+        variants = {sub['name']: sub['variant'] for sub in group['substances']}
+        self.assertEqual(variants, {'aspirin': 'duplicate', 'aspirin copy': 'duplicate',
+                                    'aspirin anion': 'protonation', 'aspirin d3': 'stereo/isotope'})
+        group = dupmembers(dupgroups(protonation=True), protonation=True)[0]
+        self.assertEqual(len(group['substances']), 3)
+
+
+class FingerprintTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        maketables(Substances, Identifiers, Structures)
+        super().setUpClass()
+
+    def setUp(self):
+        # the index is saved in a temporary folder
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(fp_functions, 'fppath', folder.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        fp_functions.fpparts.clear()
+        self.subs = {}
+        for name, smiles in [('benzene', 'c1ccccc1'), ('toluene', 'Cc1ccccc1'), ('cyclohexane', 'C1CCCCC1'),
+                             ('ethanol', 'CCO')]:
+            self.subs[name] = addsub(name, csmiles=smiles).id
+        self.assertEqual(fpbuild(), 4)
+
+    def test_similar(self):
+        """most similar substances first"""
+        found = similar('Cc1ccccc1', k=2)
+        self.assertEqual(found[0], (self.subs['toluene'], 1.0))
+        self.assertEqual(found[1][0], self.subs['benzene'])
+        self.assertEqual(similar('CCO', k=10, minsim=0.5), [(self.subs['ethanol'], 1.0)])
+        with self.assertRaises(ValueError):
+            similar('not a smiles')
+
+    def test_substructure(self):
+        """substances found by substructure (SMILES or SMARTS), including those added since the index was built"""
+        self.assertEqual(sorted(substructure('c1ccccc1')), [self.subs['benzene'], self.subs['toluene']])
+        self.assertEqual(substructure('[OX2H]'), [self.subs['ethanol']])
+        phenol = addsub('phenol', csmiles='Oc1ccccc1').id
+        self.assertEqual(fpupdate([phenol]), 1)
+        self.assertEqual(sorted(substructure('c1ccccc1')), sorted([self.subs['benzene'], self.subs['toluene'], phenol]))
+        self.assertEqual(sorted(substructure('[OX2H]')), sorted([self.subs['ethanol'], phenol]))
+
+    def test_api(self):
+        """structure search requests (a substance id that is not a number is a bad request)"""
+        factory = RequestFactory()
+        response = similarapi(factory.get('/', {'subid': self.subs['toluene'], 'k': 1}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['results'][0]['id'], self.subs['toluene'])
+        response = substructureapi(factory.get('/', {'q': 'c1ccccc1'}))
+        self.assertEqual(len(json.loads(response.content)['results']), 2)
+        for view in [similarapi, substructureapi]:
+            self.assertEqual(view(factory.get('/', {'subid': 'abc'})).status_code, 400)
+            self.assertEqual(view(factory.get('/', {'q': 'not a smiles'})).status_code, 400)
+            self.assertEqual(view(factory.get('/')).status_code, 400)
+
+    def test_updates(self):
+        """updates add to the delta (merged into the base when big) and old folders are removed"""
+        added = []
+        for i in range(5):
+            added.append(addsub('alkane ' + str(i), csmiles='C' * (i + 2)).id)
+            fpupdate([added[-1]])
+        self.assertTrue(set(added) <= set(substructure('CC', limit=100)))
+        with mock.patch.object(fp_functions, 'fpmerge', 3):
+            self.assertEqual(fpupdate([self.subs['benzene']]), 6)
+        manifest = fp_functions.fpmanifest()
+        self.assertEqual(len(fp_functions.fpload('delta', manifest)['ids']), 0)
+        self.assertEqual(len(fp_functions.fpload('base', manifest)['ids']), 9)
+        folders = [f for f in os.listdir(fp_functions.fppath) if f.startswith(('base.', 'delta.'))]
+        self.assertLessEqual(len(folders), 4)
+        self.assertTrue(set(manifest.values()) <= set(folders))
+
+
+class SearchTestCase(TransactionTestCase):
+    def setUp(self):
+        maketables(Substances, Identifiers)
+        self.addCleanup(self.droptable)
+        self.droptable()
+
+    def droptable(self):
+        """ remove the search index and forget that it was built """
+        table = srch_functions.ftstable if srch_functions.usefts() else srch_functions.toktable
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS " + table)
+        srch_functions.searchstate.clear()
+
+    def test_ready(self):
+        """an index built after the process started (e.g. by another process) is found and kept up to date"""
+        self.assertFalse(searchready())
+        # another process builds the index (this one had found it was not built)
+        searchcreate()
+        srch_functions.searchstate['ready'] = False
+        sub = addsub('benzene', casrn='71-43-2')
+        self.assertEqual(searchids('benzene'), ([sub.id], 1))
+        self.assertEqual(searchids('71 43'), ([sub.id], 1))
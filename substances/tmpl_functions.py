@@ -0,0 +1,66 @@
+""" cache of the (compiled) SciData JSON-LD templates used to create twins """
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from substances.models import Templates
+from contexts.models import Metadata
+import json
+import threading
+
+# compiled templates keyed by (type, version, sdsubsection) and the latest
+# version of each template type
+tmplcache = {}
+tmpllatest = {}
+tmpllock = threading.Lock()
+
+
+def gettemplate(tmpltype, subsection=None):
+    """
+    get the compiled version of the latest template of a type. The template
+    and metadata tables are only queried the first time (or after a change)
+    :param tmpltype: type of template (e.g. substance, target)
+    :param subsection: sdsubsection of the metadata fields used with the template
+    :return dictionary with 'version', 'updated', 'skeleton' (parsed template - see
+    tmplcopy) and 'fields' (list of field dictionaries)
+    """
+    version = tmpllatest.get(tmpltype)
+    compiled = tmplcache.get((tmpltype, version, subsection))
+    if compiled is not None:
+        return compiled
+    with tmpllock:
+        tmpl = Templates.objects.filter(type=tmpltype).order_by('-version').first()
+        if tmpl is None:
+            raise Templates.DoesNotExist("No template of type '" + tmpltype + "'")
+        fields = []
+        if subsection is not None:
+            for field in Metadata.objects.filter(sdsubsection=subsection):
+                groups = field.group.split(',') if field.group is not None else None
+                fields.append({'label': field.label, 'section': field.sdsubsubsection, 'datatype': field.datatype,
+                               'output': field.output, 'groups': groups})
+        compiled = {'version': tmpl.version, 'updated': tmpl.updated, 'skeleton': json.loads(tmpl.json),
+                    'fields': fields}
+        tmplcache[(tmpltype, tmpl.version, subsection)] = compiled
+        tmpllatest[tmpltype] = tmpl.version
+    return compiled
+
+
+def tmplcopy(obj):
+    """ copy of a (parsed) template that can be changed (faster than deepcopy) """
+    if isinstance(obj, dict):
+        return {k: tmplcopy(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [tmplcopy(v) for v in obj]
+    return obj
+
+
+def tmplclear():
+    """ remove all compiled templates (they are compiled again when next used) """
+    with tmpllock:
+        tmplcache.clear()
+        tmpllatest.clear()
+
+
+@receiver([post_save, post_delete], sender=Templates)
+@receiver([post_save, post_delete], sender=Metadata)
+def tmplchanged(sender, **kwargs):
+    """ a template or metadata row was saved/deleted so the cache is out of date """
+    tmplclear()
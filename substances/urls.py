@@ -8,10 +8,13 @@ urlpatterns = [
     path("list/", views.list, name='list'),
     re_path(r'^search/(?:(?P<query>.+)/)?$', views.search, name='search'),
     path("molfile/<subid>", views.molfile, name='molfile'),
+    path("structure/<subid>/<kind>", views.structure, name='structure'),
     path("check/<action>", views.subcheck, name='subcheck'),
     path("view/<subid>", views.subview, name='subview'),
     path("view/<subid>/subids", views.subids, name='subids'),
     path("view/<subid>/subdescs", views.subdescs, name='subdescs'),
+    path("view/<subid>/variants", views.variants, name='variants'),
+    path("duplicates/", views.duplicates, name='duplicates'),
     path("add/<identifier>/<mode>", views.add, name='add'),
     path("newjld/<subid>", views.newjld, name='newjld'),
     path("showfacet/<facetid>", views.showfacet, name='showfacet'),
@@ -21,4 +24,7 @@ urlpatterns = [
     path("sublist/", views.sublist, name='sublist'),
     path("ingestlist/", views.ingestlist, name='ingestlist'),
     path("normalize/<identifier>", views.normalize, name='normalize'),
+    path("api/resolve/", views.resolveapi, name='resolveapi'),
+    path("api/similar/", views.similarapi, name='similarapi'),
+    path("api/substructure/", views.substructureapi, name='substructureapi'),
 ]
@@ -6,10 +6,9 @@ from workflow.jena_functions import *
 from substances.sub_functions import *
 from sciflow.settings import BASE_DIR
 from zipfile import ZipFile
-from django.http import HttpResponse
-from os import path
+from django.http import HttpResponse, JsonResponse
+from datafiles.zip_functions import fileresponse
 from inspect import currentframe, getframeinfo
-import requests
 
 
 def molfile(request, subid):
@@ -49,9 +48,9 @@ def newjld(request, subid):
             lastver = FacetFiles.objects.filter(facet_lookup_id=sub.facet_lookup_id).order_by('-version')[0]
             newver = lastver.version + 1
 
-        # load into facet_files
-        file = FacetFiles(facet_lookup_id=sub.facet_lookup_id,
-                          file=json.dumps(jld, separators=(',', ':')), type='raw', version=newver)
+        # load into facet_files (the text is saved in facet_blobs)
+        blobid, jhash = saveblobs([json.dumps(jld, separators=(',', ':'))])[0]
+        file = FacetFiles(facet_lookup_id=sub.facet_lookup_id, blob_id=blobid, type='raw', version=newver)
         file.save()
         print(sub.graphdb)
 
@@ -107,31 +106,14 @@ def subview(request, subid):
     descs = substance.descriptors_set.values_list('type', 'value', 'source')
     srcs = substance.sources_set.all()
     inchikey = getinchikey(substance.id)
-    baseimage = 'https://cactus.nci.nih.gov/chemical/structure/{}/file?format=sdf&get3d=true'
-
-    image_url = baseimage.format(inchikey)
-    testvar = path.exists("/static/Jsmol/JSmol.min.js")
-    print(substance)
-    print('js path is ' + str(testvar))
-    print(inchikey)
-
-    r = requests.get(image_url)
-    print(str(r.status_code))
-    if r.status_code == 200:
+    # the 3D model is made locally (see structure) so no external request is needed
+    if hasstructure(substance.id):
+        image_url = '/substances/structure/' + str(substance.id) + '/3d'
         image_found = ''
     else:
-        image_found = 'Error Model not Found'
         image_url = ''
-    print(image_found)
-    print(image_url)
-    if not descs:
-        key = ""
-        for i in ids:
-            if i[0] == 'inchikey':  # tuple not dictionary
-                key = i[1]
-                break
-        m, i, descs, srcs = getsubdata(key)
-        savedescs(subid, descs)
+        image_found = 'Error Model not Found'
+    # missing descriptors are fetched by manage.py refreshsubs or the descriptors page (subdescs)
     idlist = {}
     for idtype, value, src in ids:
         if idtype not in idlist.keys():
@@ -158,6 +140,16 @@ def subview(request, subid):
                    "image_url": image_url, "image_found": image_found, "inchikey": inchikey})
 
 
+def structure(request, subid, kind='3d'):
+    """ get the 3D model (kind '3d', SDF) or 2D depiction (kind 'svg') of a substance """
+    if kind not in imgtypes:
+        return HttpResponse("Unknown structure format '" + kind + "'", status=404, content_type="text/plain")
+    image = subimage(subid, kind)
+    if image is None:
+        return HttpResponse("No structure for substance " + str(subid), status=404, content_type="text/plain")
+    return HttpResponse(image, content_type=imgtypes[kind][1])
+
+
 def subids(request, subid):
     """present an overview page about the substance in sciflow"""
     substance = Substances.objects.get(id=subid)
@@ -185,7 +177,7 @@ def subdescs(request, subid):
 def add(request, identifier, mode='add'):
     """ check identifier to see if compound already in system and if not add """
     # id the compound in the database?
-    hits = Substances.objects.all().filter(identifiers__value=identifier).count()
+    hits = 1 if getsubid(identifier) else 0
     if hits == 0:
         meta, ids, descs, srcs = addsubstance(identifier, 'all')
         if mode == 'addoffline' or not meta:
@@ -211,9 +203,9 @@ def ingest(request):
             print("uploading single substance (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
             inchikey = request.POST.get('ingest')
             matchgroup = re.findall('[A-Z]{14}-[A-Z]{10}-[A-Z]', inchikey)
+            found = idxcheck(resolvemany(matchgroup))
             for match in matchgroup:
-                hits = Substances.objects.all().filter(identifiers__value__exact=match).count()
-                if hits == 0:
+                if match not in found:
                     frameinfo = getframeinfo(currentframe())
                     print("new substance (" + frameinfo.filename + ":" + str(frameinfo.lineno) + ")")
                     addsubstance(match, 'all')
@@ -228,16 +220,14 @@ def ingest(request):
             subs = []
             if fname.endswith('.json'):
                 jdict = json.loads(file.read())
+                added = addsubstances(jdict['keys'])
+                subids = [x['id'] for x in added.values() if x['id']]
+                names = dict(Substances.objects.filter(id__in=subids).values_list('id', 'name'))
                 for key in jdict['keys']:
-                    subid = getsubid(key)
-                    stat = 'present'
-                    if not subid:
-                        stat = 'new'
-                        sub = addsubstance(key, 'sub')
-                        subid = sub.id
-                    meta = getmeta(subid)
-                    subs.append({'id': meta['id'], 'name': meta['name'], 'status': stat})
-                    request.session['subs'] = subs
+                    if added[key]['id']:
+                        subid = added[key]['id']
+                        subs.append({'id': subid, 'name': names[subid], 'status': added[key]['status']})
+                request.session['subs'] = subs
                 return redirect("/substances/list/")
             elif fname.endswith('.zip'):
                 with ZipFile(file) as zfile:
@@ -264,20 +254,119 @@ def ingestlist(request):
     qset = Identifiers.objects.all().filter(
         type__exact='chembl').values_list(
         'value', flat=True)
-    chemblids = sublist(qset)
-    count = 0
-    names = []
+    chemblids = set(qset)
+    identifiers = []
     for identifier in lines:
         identifier = identifier.rstrip("\n")
         if identifier not in chemblids:
-            meta, ids, descs, srcs = addsubstance(identifier, 'all')
-            names.append(ids['pubchem']['iupacname'])
-        count += 1
-        if count == 1:
-            break
+            identifiers.append(identifier)
+    added = addsubstances(identifiers)
+    subids = [x['id'] for x in added.values() if x['status'] == 'new']
+    names = list(Substances.objects.filter(id__in=subids).values_list('name', flat=True))
     return names
 
 
+def resolveapi(request):
+    """
+    find the substances for many identifiers (POST JSON {"identifiers": [...],
+    "queue": true/false}). Unknown identifiers are queued to be added if queue
+    is true (logged in users only). Returns {"results": {identifier: {type, id,
+    inchikey, status}}, "counts": {...}}
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST a JSON object with a list of identifiers"}, status=405)
+    try:
+        data = json.loads(request.body)
+        identifiers = data['identifiers']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "request body must be JSON with an 'identifiers' list"}, status=400)
+    if not isinstance(identifiers, type([])):  # list is a view in this module
+        return JsonResponse({"error": "'identifiers' must be a list"}, status=400)
+    if len(identifiers) > resolvemax:
+        return JsonResponse({"error": "too many identifiers (max " + str(resolvemax) + ")"}, status=400)
+    queue = bool(data.get('queue', False))
+    if queue and not request.user.is_authenticated:
+        return JsonResponse({"error": "login to queue identifiers to be added"}, status=403)
+    results = resolveids(identifiers, queue)
+    counts = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return JsonResponse({"results": results, "counts": counts}, status=200)
+
+
+def structurequery(request):
+    """
+    get the query structure of a search (q=SMILES/molfile or subid=substance id)
+    :raises ValueError: if the subid is not a number
+    """
+    if request.GET.get('subid'):
+        if not request.GET.get('subid').isdigit():
+            raise ValueError("subid should be a substance id (number)")
+        sub = int(request.GET.get('subid'))
+        smiles = Identifiers.objects.filter(substance_id=sub, type='csmiles').values_list('value', flat=True)
+        struc = Structures.objects.filter(substance_id=sub).order_by('-updated').first()
+        return struc.molfile if struc else (smiles[0] if smiles else None)
+    return request.GET.get('q')
+
+
+def structureresults(hits):
+    """ add the name and inchikey of the substances found in a structure search """
+    subs = Substances.objects.in_bulk([hit[0] for hit in hits])
+    results = []
+    for subid, score in hits:
+        if subid in subs:
+            result = {'id': subid, 'name': subs[subid].name, 'inchikey': subs[subid].inchikey}
+            if score is not None:
+                result['similarity'] = score
+            results.append(result)
+    return results
+
+
+def similarapi(request):
+    """ find substances similar to a structure (GET q or subid, k, min) """
+    try:
+        query = structurequery(request)
+        if not query:
+            return JsonResponse({"error": "no structure given (q or subid)"}, status=400)
+        hits = similar(query, int(request.GET.get('k', 10)), float(request.GET.get('min', 0.0)))
+    except ValueError as exception:
+        return JsonResponse({"error": str(exception)}, status=400)
+    return JsonResponse({"results": structureresults(hits)}, status=200)
+
+
+def substructureapi(request):
+    """ find substances that contain a substructure (GET q or subid, limit) """
+    try:
+        query = structurequery(request)
+        if not query:
+            return JsonResponse({"error": "no structure given (q or subid)"}, status=400)
+        hits = substructure(query, int(request.GET.get('limit', 100)))
+    except ValueError as exception:
+        return JsonResponse({"error": str(exception)}, status=400)
+    return JsonResponse({"results": structureresults([(hit, None) for hit in hits])}, status=200)
+
+
+def variants(request, subid):
+    """ list the stereo/isotopic variants of a substance (same InChIKey skeleton) """
+    sub, found = subvariants(subid)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({"id": sub.id, "name": sub.name, "inchikey": sub.inchikey,
+                             "skeleton": skeleton(sub.inchikey), "variants": found}, status=200)
+    return render(request, "substances/variants.html", {"substance": sub, "variants": found,
+                                                        "skeleton": skeleton(sub.inchikey)})
+
+
+def duplicates(request):
+    """ report of the substances that share an InChIKey skeleton (page, protonation and format=json) """
+    protonation = request.GET.get('protonation') == '1'
+    page_obj, groups = dupreport(request.GET.get('page'), protonation)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({"page": page_obj.number, "pages": page_obj.paginator.num_pages,
+                             "total": page_obj.paginator.count, "groups": groups}, status=200)
+    return render(request, "substances/duplicates.html", {"page_obj": page_obj, "groups": groups,
+                                                          "protonation": protonation})
+
+
 def normalize(request, identifier):
     """
     create a SciData JSON-LD file for a compound, ingest in the graph
@@ -302,56 +391,33 @@ def list(request):
     return render(request, "substances/list.html", {"page_obj": page_obj, "facet": "Substances"})
 
 
-def search(request, qry):
+def search(request, query=None):
     """ search for a substance """
-    context = subsearch(query)
     if request.method == "POST":
         qry = request.POST.get('q')
-        return redirect('/substances/search/' + str(qry))
+        return redirect('/substances/search/' + str(qry) + '/')
 
+    context = subsearch(query, request.GET.get('page'))
     return render(request, "substances/search.html", context)
 
 
 def subcheck(request, action="view"):
-    errors = []
-    if action == "inkcheck":  # checks identifiers table for the presence of CASRN and InChIKey
-        subs = Substances.objects.all().values_list('id', 'inchikey')
-        for subid, key in subs:
-            gotkey = Identifiers.objects.filter(substance_id=subid, type='inchikey').exclude(source='comchem').\
-                values_list('value', flat=True).distinct()
-            if gotkey:
-                if len(gotkey) == 1:
-                    if str(gotkey[0]) != key:
-                        errors.append('InChIKey ' + key + ' (substance ' + str(subid) + ') does not match')
-                else:
-                    errors.append('Multiple InChIKeys found for ' + key + ' (substance ' + str(subid) + ')')
-            else:
-                errors.append('InChIKey ' + key + ' (substance ' + str(subid) + ') not found in Identifiers table')
-    elif action == "cascheck":
-        subs = Substances.objects.all().values_list('id', 'casrn')
-        for subid, casrn in subs:
-            if casrn:
-                gotcas = Identifiers.objects.filter(substance_id=subid, type='casrn').\
-                    values_list('value', flat=True).distinct()
-                if gotcas:
-                    if len(gotcas) == 1:
-                        if str(gotcas[0]) != casrn:
-                            errors.append('CASRN ' + casrn + ' (substance ' + str(subid) + ') does not match')
-                    else:
-                        errors.append('Multiple CASRNs found for ' + casrn + ' (substance ' + str(subid) + ')')
-                else:
-                    errors.append('CASRN ' + casrn + ' (substance ' + str(subid) + ') not found in Identifiers table')
-            else:
-                errors.append('No CASRN for substance ' + str(subid))
-
-    return render(request, "substances/check.html", {"errors": errors})
+    """ check the substances table against the identifiers table (page and format=json) """
+    if action not in subchecks:
+        return render(request, "substances/check.html", {"errors": []})
+    page_obj, problems = checkreport(action, request.GET.get('page'))
+    if request.GET.get('format') == 'json':
+        return JsonResponse({"check": action, "page": page_obj.number, "pages": page_obj.paginator.num_pages,
+                             "total": page_obj.paginator.count, "problems": problems}, status=200)
+    errors = [problem['error'] for problem in problems]
+    return render(request, "substances/check.html", {"errors": errors, "page_obj": page_obj, "action": action})
 
 
 def showfacet(request, facetid):
-    latest = FacetFiles.objects.filter(facet_lookup_id=facetid).latest('updated')
-    return HttpResponse(latest.file, content_type="application/ld+json")
+    latest = FacetFiles.objects.filter(facet_lookup_id=facetid).select_related('blob').latest('updated')
+    return fileresponse(request, latest.blob if latest.blob_id else latest)
 
 
 def showdata(request, dataid):
     latest = JsonFiles.objects.filter(json_lookup_id=dataid, type='normalized').latest('updated')
-    return HttpResponse(latest.file, content_type="application/ld+json")
+    return fileresponse(request, latest)
@@ -1,5 +1,5 @@
 """functions to get metadata/identifiers/descriptors from external websites"""
-import requests
+from workflow.http_functions import httpget
 import json
 
 # def search_uniprot(identifier, meta, ids, descs, srcs): TODO
@@ -13,14 +13,14 @@ def search_chembl(identifier, meta, ids, descs, srcs):
     srcs.update({"chembl": {}})
 
     # check to see if compound is in database
-    respnse = requests.get(apipath + identifier + ".json")
+    respnse = httpget(apipath + identifier + ".json")
     if respnse.status_code != 200:
         notes = "ChemblID not found"
         srcs["chembl"].update({"result": 0, "notes": notes})
         return
 
-    # OK target has been found go get the data
-    reqdata = requests.get(apipath + identifier + ".json").json()
+    # OK target has been found get the data
+    reqdata = respnse.json()
     target_components = reqdata['target_components']
     chembl_target_components = []
     chembl_target_component_synonyms = []
@@ -4,6 +4,7 @@ from targets.external import *
 from datetime import datetime
 from targets.models import *
 from substances.models import *
+from substances.tmpl_functions import gettemplate, tmplcopy
 
 
 def getgenedata(identifier):
@@ -41,13 +42,13 @@ def createtargjld(addedtarg):
     create SciData JSON-LD file for a target
     """
 
-    # get the substance template file from the database
-    tmpl = Templates.objects.get(type="target")
+    # get the latest version of the target template (see gettemplate)
+    tmpl = gettemplate("target")
     meta = addedtarg[0]['chembl']
     ids = addedtarg[1]['chembl']
     descs = addedtarg[2]['chembl']
     srcs = addedtarg[3]['chembl']
-    sd = json.loads(json.dumps(tmpl))
+    sd = tmplcopy(tmpl['skeleton'])
     # print(sd)
 
     gene = sd['@graph']['scidata']['system']['facets'][0]
@@ -0,0 +1,107 @@
+""" persistent (sqlite) cache of the responses from external sources """
+from workflow import settings
+import os
+import sqlite3
+import threading
+import time
+
+# one connection per thread (sqlite connections cannot be shared)
+local = threading.local()
+lock = threading.Lock()
+saves = 0
+
+
+class CacheMissError(Exception):
+    """ raised in cache only mode when a response is not in the cache """
+
+
+def cacheonly(only=True):
+    """ turn cache only (offline) mode on or off """
+    settings.httpcacheonly = only
+
+
+def iscacheonly():
+    """ check if cache only (offline) mode is on """
+    return settings.httpcacheonly
+
+
+def cachedb():
+    """ get the connection to the cache database for this thread """
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(settings.httpcachepath), exist_ok=True)
+        conn = sqlite3.connect(settings.httpcachepath, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS responses (source TEXT, key TEXT, status INTEGER, "
+                     "content BLOB, size INTEGER, saved REAL, used REAL, PRIMARY KEY (source, key))")
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        local.conn = conn
+    return conn
+
+
+def cacheget(source, key):
+    """
+    get a response from the cache
+    :param source: name of the external source (e.g. pubchem)
+    :param key: identifier of the resource (InChIKey, CID, url, ...)
+    :return tuple of (status code, content) or None if not present/expired
+    """
+    db = cachedb()
+    row = db.execute("SELECT status, content, saved FROM responses WHERE source=? AND key=?",
+                     (source, key)).fetchone()
+    if row is None:
+        return None
+    status, content, saved = row
+    if status == 200:
+        ttl = settings.httpcachettl.get(source, settings.httpcachettl['default'])
+    else:
+        ttl = settings.httpcachemissttl
+    # in cache only mode expired responses are better than nothing
+    if not settings.httpcacheonly and time.time() - saved > ttl * 86400:
+        return None
+    db.execute("UPDATE responses SET used=? WHERE source=? AND key=?", (time.time(), source, key))
+    return status, content
+
+
+def cacheput(source, key, status, content):
+    """ add (or replace) a response in the cache """
+    global saves
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    now = time.time()
+    cachedb().execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (source, key, status, content, len(content), now, now))
+    with lock:
+        saves += 1
+        check = saves % 100 == 0
+    if check:
+        cacheevict()
+
+
+def cacheevict():
+    """ remove the least recently used responses when the cache is too big """
+    db = cachedb()
+    limit = settings.httpcachesize * 1024 * 1024
+    total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= limit:
+        return 0
+    # remove responses until the cache is at 90% of the limit
+    excess = total - int(limit * 0.9)
+    rowids = []
+    for rowid, size in db.execute("SELECT rowid, size FROM responses ORDER BY used"):
+        rowids.append(rowid)
+        excess -= size
+        if excess <= 0:
+            break
+    for i in range(0, len(rowids), 500):
+        chunk = rowids[i:i + 500]
+        db.execute("DELETE FROM responses WHERE rowid IN (" + ",".join("?" * len(chunk)) + ")", chunk)
+    return len(rowids)
+
+
+def cacheclear(source=None):
+    """ remove all responses (or those for one source) from the cache """
+    if source is None:
+        cachedb().execute("DELETE FROM responses")
+    else:
+        cachedb().execute("DELETE FROM responses WHERE source=?", (source,))
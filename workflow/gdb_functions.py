@@ -5,8 +5,8 @@ from substances.models import *
 from django.db import *
 from workflow.log_functions import *
 from sciflow.settings import *
+from workflow.http_functions import httpget, httppost, httpput, httpdelete
 import json
-import requests
 
 
 def addgraph(ftype, fid, locale='local', replace=""):
@@ -23,10 +23,10 @@ def addgraph(ftype, fid, locale='local', replace=""):
     # locale = "local"  # force saving to local machine (remove to direct to SDS)
     r = None
     if locale == "local":
-        r = requests.post(graphlocalurl, data=data, headers=jsonhrs)
+        r = httppost(graphlocalurl, data=data, headers=jsonhrs)
         actlog("GDB_A01: Added local graph (" + str(r) + ")")
     elif locale == 'remote':
-        r = requests.post(graphsdsurl, data=data, headers=jsonhrs)
+        r = httppost(graphsdsurl, data=data, headers=jsonhrs)
         actlog("GDB_A02: Added remote graph (" + str(r) + ")")
     else:
         actlog("GDB_A03: Locale not one of 'local' or 'remote'")
@@ -46,7 +46,7 @@ def isgraph(name, locale='local'):
         url = graphsparqllocalurl
     elif locale == 'remote':
         url = graphsparqlsdsurl
-    response = requests.get(url, headers=headers, params=params).json()
+    response = httpget(url, headers=headers, params=params).json()
     if response['boolean']:
         return True
     else:
@@ -63,7 +63,7 @@ def getgraphname(identifier, locale='local'):
     url = graphsparqlsdsurl  # default to Graph DB on SDS
     if locale == 'local':
         url = graphsparqllocalurl
-    response = requests.get(url, headers=headers, params=params).json()
+    response = httpget(url, headers=headers, params=params).json()
     return response['results']['bindings'][0]['g']['value']
 
 
@@ -72,7 +72,7 @@ def graphsize(repo):
     """ get /rest/repositories/{repositoryID}/size
         get the size of the graph"""
     headers = {'Accept': 'application/json'}
-    r = requests.get("http://localhost:7200/rest/repositories/" + repo + "/size", headers=headers)
+    r = httpget("http://localhost:7200/rest/repositories/" + repo + "/size", headers=headers)
     print(r.text)
 
 
@@ -80,7 +80,7 @@ def graphdownload(repo):
     """ get /rest/repositories/{repositoryID}/download
         downloads the graph """
     headers = {'Accept': 'application/json'}
-    r = requests.get("http://localhost:7200/rest/repositories/" + repo + "/download", headers=headers)
+    r = httpget("http://localhost:7200/rest/repositories/" + repo + "/download", headers=headers)
     # TODO: Make it so this actually writes a file instead of printing
     print(r.text)
 
@@ -89,7 +89,7 @@ def graphrepos():
     """ get /repositories
         gets repos """
     headers = {'Accept': 'application/sparql-results+json'}
-    r = requests.get("http://localhost:7200/repositories", headers=headers)
+    r = httpget("http://localhost:7200/repositories", headers=headers)
     print(r.text)
 
 
@@ -97,7 +97,7 @@ def graphcontexts(repo):
     """ get /repositories/{repositoryID}/contexts
         gets context """
     headers = {'Accept': 'application/sparql-results+json'}
-    r = requests.get("http://localhost:7200/repositories/" + repo + "/contexts", headers=headers)
+    r = httpget("http://localhost:7200/repositories/" + repo + "/contexts", headers=headers)
     print(r.text)
 
 
@@ -106,14 +106,14 @@ def graphstatementsget(graph, repo):  # TODO: ???
     """ get /repositories/{repositoryID}
         gets all statements of a given graph """
     headers = {'Accept': 'text/plain'}
-    r = requests.get("http://localhost:7200/repositories/" + repo + "/rdf-graphs/" + graph, headers=headers)
+    r = httpget("http://localhost:7200/repositories/" + repo + "/rdf-graphs/" + graph, headers=headers)
     print(r.text)
 
 
 def graphstatementedit(baseuri, update, repo):  # DONE??
     """ put /repositories/{repositoryID}/statements -> updates a statement in the repo """
     headers = {'Content-type': ' application/rdf+xml', 'Accept': 'text/plain'}
-    r = requests.get(
+    r = httpget(
         "http://localhost:7200/repositories/" + repo + "/statements?update=" + update + "&baseURI=" + baseuri,
         headers=headers)
     print(r.text)
@@ -123,7 +123,7 @@ def graphstatementedit(baseuri, update, repo):  # DONE??
 def graphqueryrun(query, repo):
     """ get /repositories/{repositoryID} -> runs a query """
     headers = {'Accept': 'application/sparql-results+json'}
-    r = requests.get("http://localhost:7200/repositories/" + repo + "?query=" + quote(query), headers=headers)
+    r = httpget("http://localhost:7200/repositories/" + repo + "?query=" + quote(query), headers=headers)
     print(r.text)
     print(r)
 
@@ -131,7 +131,7 @@ def graphqueryrun(query, repo):
 def graphqueryget():
     """ get /rest/sparql/saved-queries -> gets queries """
     headers = {'Accept': 'application/json'}
-    r = requests.get("http://localhost:7200/rest/sparql/saved-queries", headers=headers)
+    r = httpget("http://localhost:7200/rest/sparql/saved-queries", headers=headers)
     # TODO: It prints but it doesn't look nice
     print(json.loads(r.text))
 
@@ -140,7 +140,7 @@ def graphqueryedit(query):
     """ put /rest/sparql/saved-queries -> edit a query preset """
     headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
     data = '{\n "data": ' + query + ' \n }'
-    r = requests.put("http://localhost:7200/rest/sparql/saved-queries", data=data, headers=headers)
+    r = httpput("http://localhost:7200/rest/sparql/saved-queries", data=data, headers=headers)
     print(r.text)
 
 
@@ -148,14 +148,14 @@ def graphquerycreate(newquery):
     """ post /rest/sparql/saved-queries -> create a query preset """
     headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
     data = '{\n "data": ' + newquery + ' \n }'
-    r = requests.post("http://localhost:7200/rest/sparql/saved-queries", data=data, headers=headers)
+    r = httppost("http://localhost:7200/rest/sparql/saved-queries", data=data, headers=headers)
     print(r.text)
 
 
 def graphquerydelete(query):
     """ deletes a query preset """
     headers = {'Accept': 'application/json'}
-    r = requests.delete("http://localhost:7200/rest/sparql/saved-queries?name=" + query, headers=headers)
+    r = httpdelete("http://localhost:7200/rest/sparql/saved-queries?name=" + query, headers=headers)
     print(r.text)
 
 
@@ -163,7 +163,7 @@ def graphquerydelete(query):
 def graphnamespaceget(prefix, repo):
     """ get /repositories/{repositoryID}/namespaces/{namespacesPrefix} -> gets a namespace prefix """
     headers = {'Accept': 'text/plain'}
-    r = requests.get("http://localhost:7200/repositories/" + repo + "/namespaces/" + prefix, headers=headers)
+    r = httpget("http://localhost:7200/repositories/" + repo + "/namespaces/" + prefix, headers=headers)
     print(r.text)
 
 
@@ -0,0 +1,95 @@
+""" shared http client for all requests to external websites and services """
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from workflow.settings import *
+from workflow.cache_functions import cacheget, cacheput, iscacheonly, CacheMissError
+import requests
+import threading
+
+# one session (connection pool) per host, shared by all threads (and one
+# more for the POSTs to a host that can be retried)
+sessions = {}
+lock = threading.Lock()
+
+
+def getsession(url, retrypost=False):
+    """
+    get (or create) the session used for requests to the host of a url
+    :param url: url of the request
+    :param retrypost: get the session that also retries POSTs (only for POSTs
+        that can be safely repeated, e.g. SPARQL queries but not updates)
+    """
+    host = urlsplit(url).netloc
+    key = (host, retrypost)
+    with lock:
+        if key not in sessions:
+            # POSTs are not retried (once sent) unless asked for as they may change data
+            methods = Retry.DEFAULT_ALLOWED_METHODS | {'POST'} if retrypost else Retry.DEFAULT_ALLOWED_METHODS
+            retry = Retry(total=httpretries, backoff_factor=httpbackoff, status_forcelist=httpretrycodes,
+                          allowed_methods=methods, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=httppoolsize, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'User-Agent': httpagent})
+            sessions[key] = session
+        return sessions[key]
+
+
+def httprequest(method, url, retrypost=False, **kwargs):
+    """ send a request using the pooled session for the host of the url (see getsession) """
+    if 'timeout' not in kwargs:
+        kwargs['timeout'] = httptimeouts.get(urlsplit(url).netloc, httptimeout)
+    return getsession(url, retrypost).request(method, url, **kwargs)
+
+
+def httpget(url, source=None, **kwargs):
+    """
+    GET a url (see httprequest)
+    :param url: url to get
+    :param source: name of the external source, if given the response cache
+        is checked first and the response saved in it
+    """
+    if source is None:
+        return httprequest('GET', url, **kwargs)
+    key = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+    hit = cacheget(source, key)
+    if hit is not None:
+        return cachedresponse(key, hit[0], hit[1])
+    if iscacheonly():
+        raise CacheMissError("No cached response for " + key)
+    response = httprequest('GET', url, **kwargs)
+    if response.status_code in httpcachecodes:
+        cacheput(source, key, response.status_code, response.content)
+    return response
+
+
+def httppost(url, retry=False, **kwargs):
+    """
+    POST to a url (see httprequest)
+    :param url: url to post to
+    :param retry: retry the POST on errors - only if repeating it does not change
+        anything (e.g. a SPARQL query or a PUG REST lookup)
+    """
+    return httprequest('POST', url, retrypost=retry, **kwargs)
+
+
+def httpput(url, **kwargs):
+    """ PUT to a url (see httprequest) """
+    return httprequest('PUT', url, **kwargs)
+
+
+def httpdelete(url, **kwargs):
+    """ DELETE a url (see httprequest) """
+    return httprequest('DELETE', url, **kwargs)
+
+
+def cachedresponse(url, status, content):
+    """ create a response object from a response in the cache """
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.encoding = 'utf-8'
+    response._content = content
+    return response
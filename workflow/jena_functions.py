@@ -1,7 +1,6 @@
-import requests
-import urllib3
 import json
 from sciflow import localsettings
+from workflow.http_functions import httpget, httppost, httpdelete
 
 
 # path = "http://jena1.unfcsd.unf.edu:3030/"
@@ -15,18 +14,18 @@ fpath = localsettings.ppath + "/static/files/"
 def server():
     """get the server info from the fuseki endpoint"""
     endpoint = path + "$/server"
-    response = requests.get(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
+    response = httpget(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
     return response
 
 
 def stats():
     endpoint = path + "$/stats"
-    return requests.get(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
+    return httpget(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
 
 
 def listsets():
     endpoint = path + "$/datasets"
-    response = requests.get(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass))
+    response = httpget(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass))
     jsn = response.content.decode('utf-8')
     dsets = json.loads(jsn)
     output = []
@@ -37,20 +36,20 @@ def listsets():
 
 def compact(dset=dataset):
     endpoint = path + "$/compact/" + dset + "?deleteOld=true"
-    return requests.post(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
+    return httppost(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
 
 
 def setstats(dset=dataset):
     """get the status of the SciData dataset from the fuseki endpoint"""
     endpoint = path + "$/stats/" + dset
-    response = requests.get(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
+    response = httpget(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
     return response
 
 
 def status(dset=dataset):
     """get the stats of the SciData dataset from the fuseki endpoint"""
     endpoint = path + "$/datasets/" + dset
-    response = requests.get(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
+    response = httpget(endpoint, headers=hdrs, auth=(localsettings.fuser, localsettings.fpass)).json()
     return response['ds.state']
 
 
@@ -61,13 +60,13 @@ def query(sparql, dset=dataset, fixes=None):
     if fixes:
         sparql = fixes + " " + sparql
     endpoint = path + dset + "/sparql"
-    return requests.post(endpoint, data={'query': sparql}, auth=(localsettings.fuser, localsettings.fpass))
+    return httppost(endpoint, retry=True, data={'query': sparql}, auth=(localsettings.fuser, localsettings.fpass))
 
 
 def update(sparql, dset=dataset):
     """ executes a SPARQL query """
     endpoint = path + dset + "/update"
-    response = requests.post(endpoint, data={'update': sparql}, auth=(localsettings.fuser, localsettings.fpass))
+    response = httppost(endpoint, data={'update': sparql}, auth=(localsettings.fuser, localsettings.fpass))
     if response.status_code == 200:
         return "success"
     else:
@@ -82,7 +81,7 @@ def deldataset(dset=None):
             cleardataset(dset)
             """ delete the dataset """
             endpoint = path + "$/datasets/" + dset
-            response = requests.delete(endpoint, auth=(localsettings.fuser, localsettings.fpass))
+            response = httpdelete(endpoint, auth=(localsettings.fuser, localsettings.fpass))
             if response.status_code == 200:
                 return response.content  # is empty binary string
             else:
@@ -121,9 +120,7 @@ def tcount():
 def jenaadd(file, replace="", dset=dataset):
     """ add a file to Jena """
     if "http" in file:
-        http = urllib3.PoolManager()
-        r = http.request('GET', file)
-        data = r.data
+        data = httpget(file).content
     elif file[0] == "/":
         """ assumes file is full local path """
         with open(file) as fp:
@@ -140,7 +137,7 @@ def jenaadd(file, replace="", dset=dataset):
         print(result)
     # create endpoint URL
     endpoint = path + dset + "/data"
-    response = requests.post(endpoint, data=data, headers=hdrsld, auth=(localsettings.fuser, localsettings.fpass))
+    response = httppost(endpoint, data=data, headers=hdrsld, auth=(localsettings.fuser, localsettings.fpass))
     if response.status_code == 200:
         return "success"
     else:
@@ -1,4 +1,5 @@
 """ settings for the workflow """
+import os
 
 # headers for files
 jsonhrs = {'Content-type': 'application/json', 'Accept': 'application/json'}
@@ -21,3 +22,38 @@ graphlocalurl = graphlocalpath + 'rest/data/import/upload/' + reponame + '/url'
 graphsparqllocalurl = graphlocalpath + 'repositories/' + reponame
 
 sdsnewpath = "/Users/Shared/sciflow"
+
+# shared http client (workflow/http_functions.py)
+# default (connect, read) timeouts in seconds, with overrides for slow hosts
+httptimeout = (10, 60)
+httptimeouts = {'query.wikidata.org': (10, 120), 'localhost:3030': (10, 300)}
+# retries with exponential backoff (backoff * 2^(retry - 1) seconds)
+httpretries = 3
+httpbackoff = 0.5
+httpretrycodes = [429, 500, 502, 503, 504]
+# number of keep-alive connections kept open per host
+httppoolsize = 10
+httpagent = 'sciflow/0.2 (https://github.com/ChalkLab/sciflow)'
+
+# persistent cache of responses from external sources (workflow/cache_functions.py)
+httpcachepath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'http.sqlite')
+# time (in days) that a response from each source is valid for
+httpcachettl = {'default': 30, 'pubchem': 60, 'classyfire': 180, 'wikidata': 14, 'chembl': 90, 'comchem': 60}
+# 'not found' responses are kept for a shorter time, other errors are not kept
+httpcachecodes = [200, 404]
+httpcachemissttl = 7
+# maximum size (in MB) of cached responses (least recently used are removed)
+httpcachesize = 2048
+# only use the cache (no requests are made, expired responses are used)
+httpcacheonly = False
+
+# compression of stored JSON-LD files (datafiles/zip_functions.py)
+# codec of new files ('gzip', 'zstd' - needs the zstandard package - or None for plain text)
+filecodec = 'gzip'
+filelevel = 6
+
+# versions of data files saved as JSON Patch differences (datafiles/patch_functions.py)
+# a full copy is saved every deltasnap versions (or if the patch is more than half the size of the file)
+deltasnap = 10
+# number of rebuilt versions kept in memory
+deltacache = 16
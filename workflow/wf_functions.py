@@ -16,17 +16,15 @@ def ingest(upload, user):
     actlog("WF_A01: Ingest initiated")
 
     if str(upload).endswith('.jsonld'):
-        upload.seek(0)
-        text = upload.read()
-        file = json.loads(text)
+        # the file was parsed when the upload was validated (see validation.parsefile)
+        file = parsefile(upload)
         mid = adddatafile(file, user)
-        if mid:
-            if not updatedatafile(file):
-                errorlog("WF_E01: File was not updated (added to json_files)")
-        else:
+        if not mid:
             errorlog("WF_E02: File was not added to json_lookup")
 
         ids = updatedatafile(file)
+        if not ids:
+            errorlog("WF_E01: File was not updated (added to json_files)")
         gvars.ingest_data_lookup_id = ids['mid']
         gvars.ingest_data_file_id = ids['fid']
         actlog("WF_A02: UID is " + JsonLookup.objects.get(id=ids['mid']).uniqueid)
@@ -119,7 +117,7 @@ def normalize(dfile, sections, user, jl):
 
                     # load facet file to extract @id for compound
                     fobjt = FacetFiles.objects.filter(facet_lookup_id=ffileid)[0]
-                    ffile = json.loads(fobjt.file)
+                    ffile = json.loads(fobjt.content)
                     normid = ffile['@graph']['@id'] + 'compound/1/'
 
                     # substance already in graph so update facet entry with
@@ -179,7 +177,7 @@ def normalize(dfile, sections, user, jl):
 
                     # load facet file to extract @id for compound
                     fobjt = FacetFiles.objects.get(facet_lookup_id=ffileid)
-                    ffile = json.loads(fobjt.file)
+                    ffile = json.loads(fobjt.content)
                     normid = ffile['@graph']['@id'] + 'target/1/'
 
                     # target already in graph so update facet entry with